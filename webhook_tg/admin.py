@@ -1,44 +1,91 @@
+import json
 from urllib.parse import quote
 
 from django.contrib import admin
-from django.db.models import Q
-from django.urls import reverse
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Sum
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
-from .chat_display import format_message_html
-from .models import Message, UserTg, AdminChatFilter, TelegramOutbox, BotOutgoingMessage
+from .admin_lists import (
+    BusinessConnectionFilter,
+    ChatIdFilter,
+    ChatModeChangeList,
+    EstimatedCountPaginator,
+    OutgoingMethodFilter,
+    UsernameFilter,
+    is_unfiltered,
+)
+from .chat_access import can_view_chat, restrict_to_permitted_chats
+from .chat_display import CHAT_DISPLAY_FIELDS, chat_page, render_chat_rows
+from .config import CHAT_PAGE_SIZE
+from .live_updates import chat_event_stream
+from .payloads import load_message_payload
+from .search import RANK_ORDERING, fts_available, highlight_html, is_ranked, search_messages
+from .models import (
+    ChatSummary,
+    Message,
+    UserTg,
+    AdminChatFilter,
+    TelegramOutbox,
+    BotOutgoingMessage,
+    WebhookInboxUpdate,
+    TelegramBusinessConnection,
+)
 
 HIDDEN_USERNAMES = {"@tamataeva86", }
 
 
+def _chat_url(chat_id, business_connection_id) -> str:
+    url = reverse("admin:webhook_tg_message_changelist") + f"?chat_id={chat_id}"
+    if business_connection_id:
+        url += f"&business_connection_id={quote(business_connection_id, safe='')}"
+    return url
+
+
+def _recipient_names(chat_ids) -> dict:
+    """chat_id → @username или имя пользователя бота. Один запрос, покрытый индексом wtg_usertg_chat_names_idx."""
+    names = {}
+    if not chat_ids:
+        return names
+    for chat_id, username, first_name in UserTg.objects.filter(chat_id__in=chat_ids).values_list(
+        "chat_id", "username", "first_name"
+    ):
+        if chat_id not in names and (username or first_name):
+            names[chat_id] = f"@{username}" if username else first_name
+    return names
+
+
+def _highlighted(message) -> str | None:
+    """Фрагмент с подсвеченными совпадениями, если сообщение найдено полнотекстовым поиском."""
+    snippet = getattr(message, "fts_snippet", None)
+    return highlight_html(snippet) if snippet else None
+
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     change_list_template = "admin/webhook_tg/message/change_list.html"
     list_display = ("chat_link", "username_from", "first_name", "text_preview", "file_type", "created_at")
-    list_filter = ("username_from", "business_connection_id", "chat_id")
+    # Поля ввода с подсказками из справочников вместо SELECT DISTINCT по всей таблице сообщений
+    list_filter = (UsernameFilter, BusinessConnectionFilter, ChatIdFilter)
     search_fields = ("username_from", "first_name", "text", "message_id", "business_connection_id")
     ordering = ("-created_at",)
     list_per_page = 50
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
 
-    readonly_fields = ("created_at",)
+    # Сырой апдейт лежит в MessagePayload и читается только на странице сообщения
+    exclude = ("payload",)
+    readonly_fields = ("created_at", "payload_json")
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).defer("payload")
         qs = qs.exclude(username_from__in=HIDDEN_USERNAMES)
-        if request.user.is_superuser:
-            filtered = qs
-        else:
-            filters = request.user.admin_chat_filters.all()
-            if not filters:
-                return qs.none()
-            q = Q()
-            for f in filters:
-                if f.business_connection_id:
-                    q |= Q(chat_id=f.chat_id, business_connection_id=f.business_connection_id)
-                else:
-                    q |= Q(chat_id=f.chat_id)
-            filtered = qs.filter(q)
+        filtered = restrict_to_permitted_chats(qs, request.user)
 
         chat_id = (request.GET.get("chat_id") or "").strip()
         if chat_id:
@@ -49,6 +96,126 @@ class MessageAdmin(admin.ModelAdmin):
 
         return filtered
 
+    def chat_summaries(self, request):
+        """Сводки чатов, доступных пользователю: маленький справочник для подсказок в фильтрах."""
+        return restrict_to_permitted_chats(ChatSummary.objects.all(), request.user)
+
+    def chat_message_count(self, request) -> int:
+        """
+        Число сообщений открытого чата: из сводок ChatSummary (по доступным пользователю подключениям),
+        при поиске — число найденных.
+        """
+        if self._search_term(request):
+            return self._chat_queryset(request).count()
+        summaries = self.chat_summaries(request).filter(chat_id=request.GET["chat_id"].strip())
+        conn_id = (request.GET.get("business_connection_id") or "").strip()
+        if conn_id:
+            summaries = summaries.filter(business_connection_id=conn_id)
+        return summaries.aggregate(total=Sum("message_count"))["total"] or 0
+
+    def get_changelist(self, request, **kwargs):
+        if (request.GET.get("chat_id") or "").strip():
+            return ChatModeChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # Оценка годится, только когда список — вся таблица: без фильтров и без ограничений доступа
+        if request.user.is_superuser and is_unfiltered(request):
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def _search_term(self, request) -> str:
+        return (request.GET.get(SEARCH_VAR) or "").strip()
+
+    def get_search_results(self, request, queryset, search_term):
+        # На SQLite ищем через FTS5 (индекс webhook_tg_message_fts), а не LIKE '%…%' по всей таблице
+        if search_term and fts_available():
+            found = search_messages(queryset, search_term)
+            if found is not None:
+                # get_ordering вызывается после поиска: по рангу сортируем, только если он посчитан
+                request.wu_fts_ranked = is_ranked(found)
+                return found, False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_ordering(self, request):
+        # Результаты поиска — по релевантности, если пользователь не выбрал сортировку сам
+        if getattr(request, "wu_fts_ranked", False):
+            return RANK_ORDERING
+        return super().get_ordering(request)
+
+    def get_urls(self):
+        urls = [
+            path(
+                "chat-page/",
+                self.admin_site.admin_view(self.chat_page_view),
+                name="webhook_tg_message_chat_page",
+            ),
+            path(
+                "chat-live/",
+                self.admin_site.admin_view(self.chat_live_view),
+                name="webhook_tg_message_chat_live",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def _chat_queryset(self, request):
+        """Сообщения открытого чата с учётом прав и поиска; только колонки, которые выводятся."""
+        chat_messages = self.get_queryset(request)
+        search_term = self._search_term(request)
+        if search_term:
+            chat_messages, _ = self.get_search_results(request, chat_messages, search_term)
+        return chat_messages.only(*CHAT_DISPLAY_FIELDS)
+
+    def _chat_page_html(self, chat_messages, cursor):
+        messages, next_cursor = chat_page(chat_messages, cursor, CHAT_PAGE_SIZE)
+        return mark_safe(render_chat_rows(messages, highlight=_highlighted)), next_cursor
+
+    def chat_page_view(self, request):
+        """JSON со следующей страницей чата (более старые сообщения) для подгрузки при прокрутке."""
+        if not (request.GET.get("chat_id") or "").strip():
+            return JsonResponse({"error": "chat_id is required"}, status=400)
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        html, next_cursor = self._chat_page_html(self._chat_queryset(request), request.GET.get("cursor"))
+        return JsonResponse({"html": html, "next_cursor": next_cursor})
+
+    def chat_live_view(self, request):
+        """
+        SSE-поток новых и изменённых сообщений открытого чата. Работает только под ASGI:
+        под WSGI бесконечный поток занял бы воркер, поэтому отвечаем 204 — браузер не переподключается.
+        """
+        chat_id = (request.GET.get("chat_id") or "").strip()
+        if not chat_id:
+            return JsonResponse({"error": "chat_id is required"}, status=400)
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            return JsonResponse({"error": "chat_id must be an integer"}, status=400)
+
+        conn_id = (request.GET.get("business_connection_id") or "").strip() or None
+        if not can_view_chat(request.user, chat_id, conn_id):
+            raise PermissionDenied
+
+        def render(message_id):
+            # Доступ проверяется на каждое событие (через кэш ACL с проверкой версии):
+            # фильтр могли удалить, пока поток открыт
+            if not can_view_chat(request.user, chat_id, conn_id):
+                raise PermissionDenied
+            message = self.get_queryset(request).only(*CHAT_DISPLAY_FIELDS).filter(message_id=message_id).first()
+            return render_chat_rows([message]) if message is not None else None
+
+        response = StreamingHttpResponse(
+            chat_event_stream(chat_id, conn_id, render),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         chat_id = (request.GET.get("chat_id") or "").strip()
@@ -56,41 +223,55 @@ class MessageAdmin(admin.ModelAdmin):
         extra_context["wu_chat_mode"] = bool(chat_id)
 
         if chat_id:
-            messages = list(self.get_queryset(request).order_by("-created_at"))
-            extra_context["wu_chat_count"] = len(messages)
+            chat_messages = self._chat_queryset(request)
 
             title_parts = [f"chat_id {chat_id}"]
             if conn_id:
                 title_parts.append(f"({conn_id[:12]}…)")
-            if messages:
-                last = messages[-1]
-                if last.username_from:
-                    title_parts.insert(0, f"@{last.username_from}")
-                elif last.first_name:
-                    title_parts.insert(0, last.first_name)
+            first = (
+                chat_messages.filter(created_at__isnull=False)
+                .order_by("created_at", "id")
+                .values_list("username_from", "first_name")
+                .first()
+            )
+            if first:
+                username_from, first_name = first
+                if username_from:
+                    title_parts.insert(0, f"@{username_from}")
+                elif first_name:
+                    title_parts.insert(0, first_name)
             extra_context["wu_chat_title"] = " · ".join(title_parts)
 
-            if messages:
-                extra_context["wu_chat_html"] = mark_safe(
-                    "".join(format_message_html(message) for message in messages)
+            html, next_cursor = self._chat_page_html(chat_messages, None)
+            extra_context["wu_chat_html"] = html or "Сообщений пока нет."
+            extra_context["wu_chat_next_cursor"] = next_cursor or ""
+            extra_context["wu_chat_page_url"] = (
+                reverse("admin:webhook_tg_message_chat_page") + "?" + request.GET.urlencode()
+            )
+            # Во время поиска живые обновления не подключаем: новые строки не прошли бы фильтр поиска
+            if not self._search_term(request):
+                extra_context["wu_chat_live_url"] = (
+                    reverse("admin:webhook_tg_message_chat_live") + "?" + request.GET.urlencode()
                 )
-            else:
-                extra_context["wu_chat_html"] = "Сообщений пока нет."
 
         return super().changelist_view(request, extra_context=extra_context)
 
     @admin.display(description="Чат")
     def chat_link(self, obj):
-        url = reverse("admin:webhook_tg_message_changelist") + f"?chat_id={obj.chat_id}"
-        if obj.business_connection_id:
-            url += f"&business_connection_id={quote(obj.business_connection_id, safe='')}"
-        label = obj.username_from or obj.first_name or str(obj.chat_id)
-        if obj.username_from and not label.startswith("@"):
-            label = f"@{label}"
-        return format_html('<a href="{}">Открыть чат</a>', url)
+        return format_html('<a href="{}">Открыть чат</a>', _chat_url(obj.chat_id, obj.business_connection_id))
+
+    @admin.display(description="payload")
+    def payload_json(self, obj):
+        payload = load_message_payload(obj) if obj.pk else None
+        if payload is None:
+            return "—"
+        return format_html("<pre>{}</pre>", json.dumps(payload, ensure_ascii=False, indent=2))
 
     @admin.display(description="Текст")
     def text_preview(self, obj):
+        highlighted = _highlighted(obj)
+        if highlighted:
+            return mark_safe(highlighted)
         text = obj.text or obj.caption or ""
         if len(text) > 80:
             return text[:77] + "…"
@@ -106,10 +287,72 @@ class AdminChatFilterAdmin(admin.ModelAdmin):
 
     @admin.display(description="Чат")
     def chat_open_link(self, obj):
-        url = reverse("admin:webhook_tg_message_changelist") + f"?chat_id={obj.chat_id}"
-        if obj.business_connection_id:
-            url += f"&business_connection_id={quote(obj.business_connection_id, safe='')}"
-        return format_html('<a href="{}">Открыть чат</a>', url)
+        return format_html('<a href="{}">Открыть чат</a>', _chat_url(obj.chat_id, obj.business_connection_id))
+
+
+@admin.register(ChatSummary)
+class ChatSummaryAdmin(admin.ModelAdmin):
+    """Список переписок: одна строка на чат из сводки, без обращения к таблице сообщений."""
+
+    list_display = (
+        "chat_title",
+        "chat_id",
+        "message_count",
+        "media_counts",
+        "last_message_at",
+        "last_text_preview",
+        "chat_open_link",
+    )
+    search_fields = ("last_username", "last_first_name", "business_connection_id")
+    ordering = ("-last_message_at", "-id")
+    list_per_page = 50
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return restrict_to_permitted_chats(super().get_queryset(request), request.user)
+
+    # Сводка — производные данные: видна тем, кто может смотреть сообщения, и не редактируется
+    def has_module_permission(self, request):
+        return request.user.has_perm("webhook_tg.view_message")
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.has_perm("webhook_tg.view_message")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    @admin.display(description="Собеседник")
+    def chat_title(self, obj):
+        if obj.last_username:
+            return f"@{obj.last_username}"
+        return obj.last_first_name or str(obj.chat_id)
+
+    @admin.display(description="Медиа")
+    def media_counts(self, obj):
+        parts = [
+            (obj.photo_count, "фото"),
+            (obj.video_count, "видео"),
+            (obj.audio_count, "аудио"),
+            (obj.document_count, "док."),
+        ]
+        return ", ".join(f"{count} {label}" for count, label in parts if count) or "—"
+
+    @admin.display(description="Последнее сообщение")
+    def last_text_preview(self, obj):
+        text = obj.last_text or ""
+        if len(text) > 80:
+            return text[:77] + "…"
+        return text or "—"
+
+    @admin.display(description="Чат")
+    def chat_open_link(self, obj):
+        return format_html('<a href="{}">Открыть чат</a>', _chat_url(obj.chat_id, obj.business_connection_id))
 
 
 admin.site.register(UserTg)
@@ -117,11 +360,58 @@ admin.site.register(UserTg)
 
 @admin.register(TelegramOutbox)
 class TelegramOutboxAdmin(admin.ModelAdmin):
-    list_display = ("id", "method", "chat_id", "attempts", "next_attempt_at", "created_at", "dedup_key")
+    list_display = ("id", "method", "chat_id", "attempts", "next_attempt_at", "locked_by", "created_at", "dedup_key")
     list_filter = ("method",)
     search_fields = ("chat_id", "dedup_key", "last_error")
     ordering = ("next_attempt_at",)
-    readonly_fields = ("created_at", "payload", "last_error")
+    readonly_fields = ("created_at", "payload", "last_error", "locked_until", "locked_by")
+
+    def has_module_permission(self, request):
+        return request.user.is_superuser
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_add_permission(self, request):
+        return request.user.is_superuser
+
+    def has_change_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+@admin.register(WebhookInboxUpdate)
+class WebhookInboxUpdateAdmin(admin.ModelAdmin):
+    list_display = ("update_id", "received_at", "processed_at", "attempts")
+    list_filter = (("processed_at", admin.EmptyFieldListFilter),)
+    search_fields = ("update_id", "last_error")
+    ordering = ("-update_id",)
+    readonly_fields = ("update_id", "payload", "received_at", "processed_at", "attempts", "last_error")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_module_permission(self, request):
+        return request.user.is_superuser
+
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+@admin.register(TelegramBusinessConnection)
+class TelegramBusinessConnectionAdmin(admin.ModelAdmin):
+    list_display = ("connection_id", "username", "user_id", "user_chat_id", "is_enabled", "updated_at")
+    list_filter = ("is_enabled",)
+    search_fields = ("connection_id", "username", "user_id")
+    readonly_fields = ("updated_at",)
 
     def has_module_permission(self, request):
         return request.user.is_superuser
@@ -142,22 +432,33 @@ class TelegramOutboxAdmin(admin.ModelAdmin):
 @admin.register(BotOutgoingMessage)
 class BotOutgoingMessageAdmin(admin.ModelAdmin):
     list_display = ("sent_at", "chat_id", "recipient", "method")
-    list_filter = ("method", ("sent_at", admin.DateFieldListFilter))
+    list_filter = (OutgoingMethodFilter, ("sent_at", admin.DateFieldListFilter))
     search_fields = ("chat_id",)
     ordering = ("-sent_at",)
-    date_hierarchy = "sent_at"
+    # Без date_hierarchy и списка всех методов: они на каждой загрузке делают SELECT DISTINCT
+    # по всей таблице; период выбирается фильтром DateFieldListFilter по индексу sent_at
     list_per_page = 100
+    show_full_result_count = False
     readonly_fields = ("chat_id", "method", "sent_at")
 
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if is_unfiltered(request):
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # Получатели всей страницы — одним запросом, а не по запросу на строку
+        names = _recipient_names({obj.chat_id for obj in changelist.result_list})
+        for obj in changelist.result_list:
+            obj.recipient_name = names.get(obj.chat_id, "—")
+        return changelist
+
     @admin.display(description="Получатель")
     def recipient(self, obj):
-        user = UserTg.objects.filter(chat_id=obj.chat_id).first()
-        if user:
-            if user.username:
-                return f"@{user.username}"
-            if user.first_name:
-                return user.first_name
-        return "—"
+        if not hasattr(obj, "recipient_name"):
+            obj.recipient_name = _recipient_names({obj.chat_id}).get(obj.chat_id, "—")
+        return obj.recipient_name
 
     def has_add_permission(self, request):
         return False
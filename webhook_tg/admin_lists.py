@@ -0,0 +1,197 @@
+from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connection
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+from .config import ADMIN_FILTER_SUGGESTIONS, ESTIMATED_COUNT_MIN_ROWS
+from .models import TelegramBusinessConnection, TelegramOutbox
+
+
+def estimated_row_count(model) -> int | None:
+    """
+    Примерное число строк таблицы без COUNT(*) по ней: PostgreSQL — reltuples из pg_class,
+    SQLite — статистика ANALYZE (sqlite_stat1). None — оценки нет, нужен точный COUNT.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor != "sqlite" or "sqlite_stat1" not in connection.introspection.table_names():
+            return None
+        cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+        row = cursor.fetchone()
+        return int(row[0].split()[0]) if row and row[0] else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списка без фильтров: на больших таблицах число строк берётся из оценки, а не из COUNT(*).
+    Оценка уточняется по самой странице: неполная страница — последняя, и точное число строк известно;
+    страница за концом таблицы (оценка завышена) заменяется последней.
+    """
+
+    estimated = False
+    # Запрошена страница за концом таблицы: номера страниц ограничиваются последней
+    clamped = False
+
+    @cached_property
+    def count(self):
+        estimate = estimated_row_count(self.object_list.model)
+        if estimate is None or estimate < ESTIMATED_COUNT_MIN_ROWS:
+            return super().count
+        self.estimated = True
+        return estimate
+
+    def _set_count(self, count: int) -> None:
+        self.__dict__["count"] = count
+        self.__dict__.pop("num_pages", None)
+        self.estimated = False
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.clamped:
+                raise
+            return self.num_pages
+
+    def page(self, number):
+        page = super().page(number)
+        if not self.estimated:
+            return page
+        rows = len(page.object_list)
+        if rows == self.per_page:
+            return page
+        if rows or page.number == 1:
+            self._set_count((page.number - 1) * self.per_page + rows)
+            return page
+        # Пустая страница: оценка завышена — один точный COUNT и последняя настоящая страница
+        self._set_count(self.object_list.count())
+        self.clamped = True
+        return super().page(number)
+
+
+class ChatModeChangeList(ChangeList):
+    """
+    Список в режиме чата: сообщения выводит сам чат постранично, поэтому обычная выдача не запрашивается,
+    а число сообщений даёт model_admin.chat_message_count (сводка чата вместо COUNT(*) по сообщениям).
+    """
+
+    def get_results(self, request):
+        self.result_count = self.model_admin.chat_message_count(request)
+        self.show_full_result_count = False
+        self.show_admin_actions = False
+        self.full_result_count = None
+        self.result_list = self.queryset.none()
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = self.model_admin.get_paginator(request, self.result_list, self.list_per_page)
+
+
+def is_unfiltered(request) -> bool:
+    """В запросе списка нет фильтров и поиска — только сортировка и номер страницы."""
+    return not (set(request.GET) - {ORDER_VAR, PAGE_VAR})
+
+
+class InputListFilter(admin.SimpleListFilter):
+    """
+    Фильтр-поле ввода вместо списка всех значений: боковая панель не делает SELECT DISTINCT по таблице.
+    Подсказки (datalist) — немного значений из маленьких справочников, см. lookups() наследников.
+    """
+
+    template = "admin/webhook_tg/input_filter.html"
+    lookup = None
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        value = (self.value() or "").strip()
+        if not value:
+            return queryset
+        return queryset.filter(**{self.lookup or self.parameter_name: value})
+
+    def choices(self, changelist):
+        # Остальные параметры списка переносятся в форму скрытыми полями
+        query_string = changelist.get_query_string(remove=[self.parameter_name, PAGE_VAR])
+        yield {
+            "parameter_name": self.parameter_name,
+            "value": self.value() or "",
+            "hidden": list(QueryDict(query_string.lstrip("?")).items()),
+            "clear_query_string": query_string,
+            "suggestions": self.lookup_choices,
+        }
+
+
+class ChatIdFilter(InputListFilter):
+    title = "Chat id"
+    parameter_name = "chat_id__exact"
+    lookup = "chat_id"
+
+    def queryset(self, request, queryset):
+        if (self.value() or "").strip().lstrip("-").isdigit():
+            return super().queryset(request, queryset)
+        return queryset
+
+    def lookups(self, request, model_admin):
+        summaries = model_admin.chat_summaries(request).order_by("-last_message_at", "-id")
+        return [
+            (chat_id, f"@{username}" if username else (first_name or ""))
+            for chat_id, username, first_name in summaries.values_list(
+                "chat_id", "last_username", "last_first_name"
+            )[:ADMIN_FILTER_SUGGESTIONS]
+        ]
+
+
+class UsernameFilter(InputListFilter):
+    title = "Username sender"
+    parameter_name = "username_from__exact"
+    lookup = "username_from"
+
+    def lookups(self, request, model_admin):
+        usernames = (
+            model_admin.chat_summaries(request)
+            .exclude(last_username__isnull=True)
+            .exclude(last_username="")
+            .order_by("-last_message_at", "-id")
+            .values_list("last_username", flat=True)[:ADMIN_FILTER_SUGGESTIONS]
+        )
+        return [(username, "") for username in dict.fromkeys(usernames)]
+
+
+class BusinessConnectionFilter(InputListFilter):
+    title = "Business connection id"
+    parameter_name = "business_connection_id__exact"
+    lookup = "business_connection_id"
+
+    def lookups(self, request, model_admin):
+        if not request.user.is_superuser:
+            # Список подключений виден только суперпользователю — остальным подсказки из их чатов
+            connection_ids = (
+                model_admin.chat_summaries(request)
+                .exclude(business_connection_id="")
+                .order_by("-last_message_at", "-id")
+                .values_list("business_connection_id", flat=True)[:ADMIN_FILTER_SUGGESTIONS]
+            )
+            return [(connection_id, "") for connection_id in dict.fromkeys(connection_ids)]
+        connections = TelegramBusinessConnection.objects.order_by("-updated_at").values_list(
+            "connection_id", "username"
+        )[:ADMIN_FILTER_SUGGESTIONS]
+        return [(connection_id, f"@{username}" if username else "") for connection_id, username in connections]
+
+
+class OutgoingMethodFilter(InputListFilter):
+    title = "Метод Telegram API"
+    parameter_name = "method__exact"
+    lookup = "method"
+
+    def lookups(self, request, model_admin):
+        # Подсказки — известные методы отправки, а не SELECT DISTINCT по журналу исходящих
+        return [(method, "") for method in TelegramOutbox.Method.values]
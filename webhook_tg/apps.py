@@ -8,3 +8,4 @@ class WebhookTgConfig(AppConfig):
 
     def ready(self):
         import webhook_tg.signals.auth_signals # noqa
+        import webhook_tg.signals.chat_access_signals # noqa
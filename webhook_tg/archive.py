@@ -0,0 +1,299 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from calendar import monthrange
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from .config import DELETED_LOOKUP_CHUNK_SIZE, MESSAGE_ARCHIVE_AFTER_DAYS, MESSAGE_ARCHIVE_DIR
+from .message_store import PREVIOUS_FIELDS
+from .models import Message, MessagePayload
+from .payloads import decode_payload, parse_legacy_payload
+
+logger = logging.getLogger(__name__)
+
+# Архив: MESSAGE_ARCHIVE_DIR/ГГГГ-ММ/000001.seg + 000001.idx. Сегмент — подряд записанные блоки,
+# блок — сжатые zlib строки JSON, отсортированные по (chat_id, message_id). Индекс разреженный:
+# на блок одна запись (ключ первого сообщения, смещение, длина), последняя — максимальный ключ сегмента.
+# Сегменты не меняются после записи, новые сообщения попадают в новые сегменты.
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+# chat_id, message_id, offset, length
+_INDEX_ENTRY = struct.Struct("<qqQI")
+# Сообщений в одном сжатом блоке: больше — лучше сжатие, меньше — быстрее поиск одного сообщения
+BLOCK_RECORDS = 256
+
+_RECORD_FIELDS = (
+    "business_connection_id",
+    "username_from",
+    "first_name",
+    "text",
+    "caption",
+    "file_id",
+    "file_type",
+)
+
+
+def _archive_dir() -> Path:
+    return Path(MESSAGE_ARCHIVE_DIR)
+
+
+class _SegmentWriter:
+    """Пишет сегмент во временные файлы; в архиве он появляется только после close()."""
+
+    def __init__(self, base: Path):
+        self._segment_path = base.with_suffix(SEGMENT_SUFFIX)
+        self._index_path = base.with_suffix(INDEX_SUFFIX)
+        self._segment = open(f"{self._segment_path}.tmp", "wb")
+        self._index = open(f"{self._index_path}.tmp", "wb")
+        self._block: list[bytes] = []
+        self._block_key = None
+        self._last_key = None
+        self._offset = 0
+
+    def add(self, key: tuple[int, int], record: dict) -> None:
+        if self._block_key is None:
+            self._block_key = key
+        self._block.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self._last_key = key
+        if len(self._block) >= BLOCK_RECORDS:
+            self._flush_block()
+
+    def _flush_block(self) -> None:
+        if not self._block:
+            return
+        data = zlib.compress(b"\n".join(self._block), 6)
+        self._segment.write(data)
+        self._index.write(_INDEX_ENTRY.pack(*self._block_key, self._offset, len(data)))
+        self._offset += len(data)
+        self._block = []
+        self._block_key = None
+
+    def close(self) -> None:
+        self._flush_block()
+        self._index.write(_INDEX_ENTRY.pack(*self._last_key, self._offset, 0))
+        for handle in (self._segment, self._index):
+            handle.flush()
+            os.fsync(handle.fileno())
+            handle.close()
+        # Индекс переименовывается последним: сегмент без индекса читатель не видит
+        os.replace(f"{self._segment_path}.tmp", self._segment_path)
+        os.replace(f"{self._index_path}.tmp", self._index_path)
+
+    def abort(self) -> None:
+        for handle in (self._segment, self._index):
+            handle.close()
+        for path in (self._segment_path, self._index_path):
+            Path(f"{path}.tmp").unlink(missing_ok=True)
+
+
+class _Segment:
+    """Сегмент архива, отображённый в память: индекс и данные читаются через mmap."""
+
+    def __init__(self, index_path: Path):
+        with open(index_path, "rb") as index_file:
+            self._index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(index_path.with_suffix(SEGMENT_SUFFIX), "rb") as segment_file:
+            self._data = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._blocks = len(self._index) // _INDEX_ENTRY.size - 1
+        self.first_key = self._entry(0)[:2]
+        self.last_key = self._entry(self._blocks)[:2]
+
+    def close(self) -> None:
+        self._index.close()
+        self._data.close()
+
+    def _entry(self, position: int):
+        return _INDEX_ENTRY.unpack_from(self._index, position * _INDEX_ENTRY.size)
+
+    def _block_for(self, key) -> int:
+        """Номер последнего блока, первый ключ которого не больше key (бинпоиск прямо по mmap индекса)."""
+        low, high = 0, self._blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[:2] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def find(self, key: tuple[int, int]) -> dict | None:
+        if not (self.first_key <= key <= self.last_key):
+            return None
+        _, _, offset, length = self._entry(self._block_for(key))
+        for line in zlib.decompress(self._data[offset:offset + length]).split(b"\n"):
+            record = json.loads(line)
+            record_key = (record["chat_id"], record["message_id"])
+            if record_key == key:
+                return record
+            if record_key > key:
+                return None
+        return None
+
+
+class MessageArchive:
+    """
+    Поиск сообщений в сегментах архива. Список сегментов кэшируется и перечитывается,
+    только когда меняется mtime каталога архива или каталога месяца (сегмент появляется
+    через os.replace, а это меняет mtime каталога). Поиск идёт только по сегментам,
+    чей диапазон ключей из индекса покрывает chat_id, от новых к старым: сообщение, которое
+    после правки попало в архив повторно, находится в последней версии.
+    """
+
+    def __init__(self):
+        self._segments: dict[Path, _Segment] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature_of(directory: Path):
+        months = tuple(
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(directory), key=lambda entry: entry.name)
+            if entry.is_dir()
+        )
+        return str(directory), directory.stat().st_mtime_ns, months
+
+    def _current_segments(self) -> list[_Segment]:
+        directory = _archive_dir()
+        if not directory.is_dir():
+            return []
+        signature = self._signature_of(directory)
+        with self._lock:
+            if signature != self._signature:
+                known = self._segments
+                # Новые сегменты — в конце каталога месяца и в более поздних месяцах
+                self._segments = {
+                    index_path: known.pop(index_path, None) or _Segment(index_path)
+                    for index_path in sorted(directory.glob(f"*/*{INDEX_SUFFIX}"), reverse=True)
+                }
+                # Сегменты, которых больше нет на диске, освобождают свои mmap
+                for segment in known.values():
+                    segment.close()
+                self._signature = signature
+            return list(self._segments.values())
+
+    def find_many(self, chat_id, message_ids) -> dict[int, dict]:
+        found = {}
+        if chat_id is None:
+            return found
+        chat_id = int(chat_id)
+        segments = [
+            segment for segment in self._current_segments()
+            if segment.first_key[0] <= chat_id <= segment.last_key[0]
+        ]
+        for message_id in message_ids:
+            key = (chat_id, int(message_id))
+            for segment in segments:
+                record = segment.find(key)
+                if record is not None:
+                    found[int(message_id)] = record
+                    break
+        return found
+
+
+message_archive = MessageArchive()
+
+
+def archived_previous(chat_id, message_id, business_connection_id) -> dict | None:
+    """Прежнее содержимое сообщения, которое уже ушло в архив: нужно уведомлению о правке старого сообщения."""
+    if message_id is None:
+        return None
+    record = message_archive.find_many(chat_id, [message_id]).get(int(message_id))
+    if record is None or record.get("business_connection_id") != business_connection_id:
+        return None
+    return {field: record.get(field) for field in PREVIOUS_FIELDS}
+
+
+def archived_message(record: dict) -> Message:
+    """Несохранённый Message из записи архива — с теми же атрибутами, что и строка из БД."""
+    created_at = record.get("created_at")
+    return Message(
+        chat_id=record["chat_id"],
+        message_id=record["message_id"],
+        created_at=datetime.fromisoformat(created_at) if created_at else None,
+        **{field: record.get(field) for field in _RECORD_FIELDS},
+    )
+
+
+def _record(message: Message, payload) -> dict:
+    record = {
+        "chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "created_at": message.created_at.isoformat() if message.created_at else None,
+        **{field: getattr(message, field) for field in _RECORD_FIELDS},
+    }
+    if payload is not None:
+        record["payload"] = payload
+    return record
+
+
+def _payloads(messages: list) -> dict:
+    found = {}
+    pks = [m.pk for m in messages]
+    for start in range(0, len(pks), DELETED_LOOKUP_CHUNK_SIZE):
+        chunk = pks[start:start + DELETED_LOOKUP_CHUNK_SIZE]
+        found.update(MessagePayload.objects.filter(message_id__in=chunk).values_list("message_id", "data"))
+    return found
+
+
+def _next_segment_base(month_dir: Path) -> Path:
+    numbers = [int(path.stem) for path in month_dir.glob(f"*{INDEX_SUFFIX}") if path.stem.isdigit()]
+    return month_dir / f"{max(numbers, default=0) + 1:06d}"
+
+
+def _month_bounds(month):
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    return start, start + timedelta(days=monthrange(month.year, month.month)[1])
+
+
+def archive_messages(*, older_than_days: int | None = None, segment_size: int = 50000):
+    """
+    Переносит сообщения старше older_than_days в сегменты архива и удаляет их из БД.
+    Сегмент сначала целиком пишется на диск, потом строки удаляются: при сбое между этими шагами
+    сообщения останутся и в БД, и в архиве, но не потеряются.
+    Генератор: после каждого сегмента отдаёт (месяц ГГГГ-ММ, число сообщений).
+    """
+    if older_than_days is None:
+        older_than_days = MESSAGE_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    old = Message.objects.filter(created_at__lt=cutoff)
+
+    for month in old.dates("created_at", "month"):
+        start, end = _month_bounds(month)
+        month_dir = _archive_dir() / f"{month:%Y-%m}"
+        month_dir.mkdir(parents=True, exist_ok=True)
+        month_messages = old.filter(created_at__gte=start, created_at__lt=end).order_by("chat_id", "message_id")
+
+        while True:
+            messages = list(month_messages[:segment_size])
+            if not messages:
+                break
+            payloads = _payloads(messages)
+            writer = _SegmentWriter(_next_segment_base(month_dir))
+            try:
+                for message in messages:
+                    data = payloads.get(message.pk)
+                    if data is not None:
+                        payload = decode_payload(data)
+                    else:
+                        payload = parse_legacy_payload(message.payload) if message.payload else None
+                    writer.add((message.chat_id, message.message_id), _record(message, payload))
+                writer.close()
+            except BaseException:
+                writer.abort()
+                raise
+
+            pks = [m.pk for m in messages]
+            with transaction.atomic():
+                for offset in range(0, len(pks), DELETED_LOOKUP_CHUNK_SIZE):
+                    Message.objects.filter(pk__in=pks[offset:offset + DELETED_LOOKUP_CHUNK_SIZE]).delete()
+            logger.info("Archived %s messages for %s", len(messages), f"{month:%Y-%m}")
+            yield f"{month:%Y-%m}", len(messages)
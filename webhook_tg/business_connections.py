@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.db import transaction
+
+from .config import BUSINESS_CONNECTION_CACHE_SIZE, BUSINESS_CONNECTION_CACHE_TTL_SECONDS
+from .inner_models.BusinessConnection import BusinessConnection
+from .models import TelegramBusinessConnection
+from .telegram import business_connection_from_result, fetch_business_connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать чужой загрузки того же подключения, прежде чем грузить самим
+_INFLIGHT_WAIT_SECONDS = 10
+
+
+class _TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей. Потокобезопасный."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_cache = _TTLCache(BUSINESS_CONNECTION_CACHE_SIZE, BUSINESS_CONNECTION_CACHE_TTL_SECONDS)
+_inflight: dict[str, threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+def clear_business_connection_cache() -> None:
+    _cache.clear()
+
+
+def _to_dataclass(row: TelegramBusinessConnection) -> BusinessConnection:
+    return BusinessConnection(
+        user_id=row.user_id,
+        user_chat_id=row.user_chat_id,
+        username=row.username,
+        is_enabled=row.is_enabled,
+    )
+
+
+def _persist(connection_id: str, connection: BusinessConnection) -> None:
+    TelegramBusinessConnection.objects.update_or_create(
+        connection_id=connection_id,
+        defaults={
+            "user_id": connection.user_id,
+            "user_chat_id": connection.user_chat_id,
+            "username": connection.username,
+            "is_enabled": connection.is_enabled,
+        },
+    )
+
+
+def _remember(connection_id: str, connection: BusinessConnection) -> None:
+    # Отключённые и неизвестные подключения тоже кэшируются на TTL: иначе каждое их сообщение
+    # стоило бы запроса в Telegram. Состояние меняет апдейт business_connection (save_business_connection)
+    _cache.set(connection_id, connection)
+
+
+def save_business_connection(data: dict) -> BusinessConnection | None:
+    """Сохраняет подключение из апдейта business_connection, который Telegram присылает в webhook."""
+    connection_id = data.get("id")
+    if not connection_id:
+        return None
+    connection = business_connection_from_result(data)
+    _persist(connection_id, connection)
+    # Кэш обновляем только если запись в таблице закоммитилась
+    transaction.on_commit(partial(_remember, connection_id, connection), robust=True)
+    return connection
+
+
+def _unknown() -> BusinessConnection:
+    """Подключение, которого нет ни в таблице, ни в Telegram: уведомлять некого."""
+    return BusinessConnection(is_enabled=False)
+
+
+def _load(connection_id: str, allow_fetch: bool) -> BusinessConnection:
+    row = TelegramBusinessConnection.objects.filter(connection_id=connection_id).first()
+    if row is not None:
+        connection = _to_dataclass(row)
+        _remember(connection_id, connection)
+        return connection
+    if not allow_fetch:
+        return _unknown()
+
+    # Холодный промах: подключение появилось до того, как мы начали сохранять апдейты
+    connection = fetch_business_connection(connection_id)
+    if connection is None:
+        # Отрицательный результат тоже живёт TTL — без запроса в Telegram на каждое сообщение
+        connection = _unknown()
+        _remember(connection_id, connection)
+        return connection
+    _persist(connection_id, connection)
+    _remember(connection_id, connection)
+    return connection
+
+
+def get_business_connection(msg, *, allow_fetch: bool = True) -> BusinessConnection:
+    """
+    Подключение по business_connection_id сообщения: кэш процесса → таблица → getBusinessConnection.
+    Одновременные промахи по одному id ждут единственную загрузку (single-flight).
+    allow_fetch=False — без запроса в Telegram: так вызывают внутри транзакции апдейта,
+    после того как prepare_update уже загрузил подключение.
+    """
+    connection_id = msg.get("business_connection_id")
+    if not connection_id:
+        return BusinessConnection()
+
+    cached = _cache.get(connection_id)
+    if cached is not None:
+        return cached
+
+    with _inflight_lock:
+        event = _inflight.get(connection_id)
+        is_leader = event is None
+        if is_leader:
+            event = _inflight[connection_id] = threading.Event()
+
+    if not is_leader:
+        event.wait(_INFLIGHT_WAIT_SECONDS)
+        cached = _cache.get(connection_id)
+        if cached is not None:
+            return cached
+        logger.warning("Business connection %s: загрузка другим потоком не удалась", connection_id)
+        return _load(connection_id, allow_fetch)
+
+    try:
+        return _load(connection_id, allow_fetch)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(connection_id, None)
+        event.set()
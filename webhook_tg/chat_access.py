@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .config import ADMIN_CHAT_ACCESS_TTL_SECONDS
+from .models import AdminChatAccessVersion, AdminChatFilter
+
+
+@dataclass(frozen=True, slots=True)
+class ChatAccess:
+    """Чаты, открытые пользователю админки: целиком (любое подключение) и по подключениям."""
+
+    chat_ids: frozenset
+    # business_connection_id → chat_id, открытые только с этим подключением
+    connection_chat_ids: dict
+
+    def as_q(self) -> Q | None:
+        """
+        Условие в виде IN-списков: chat_id IN (…) плюс по одному (подключение, chat_id IN (…))
+        на подключение — SQLite берёт их из индексов по (chat_id, business_connection_id, …),
+        а не проверяет длинную цепочку OR по каждому фильтру. None — доступа нет ни к одному чату.
+        """
+        q = Q()
+        if self.chat_ids:
+            q |= Q(chat_id__in=sorted(self.chat_ids))
+        for business_connection_id, chat_ids in sorted(self.connection_chat_ids.items()):
+            q |= Q(business_connection_id=business_connection_id, chat_id__in=sorted(chat_ids))
+        return q or None
+
+    def allows(self, chat_id, business_connection_id=None) -> bool:
+        """Открыт ли чат (с этим подключением; без подключения — хотя бы с одним)."""
+        if chat_id in self.chat_ids:
+            return True
+        if business_connection_id:
+            return chat_id in self.connection_chat_ids.get(business_connection_id, ())
+        return any(chat_id in chat_ids for chat_ids in self.connection_chat_ids.values())
+
+
+def _cache_key(user_id) -> str:
+    return f"webhook_tg:admin-chat-access:{user_id}"
+
+
+def compile_chat_access(user_id) -> ChatAccess:
+    chat_ids = set()
+    by_connection: dict[str, set] = {}
+    for chat_id, business_connection_id in AdminChatFilter.objects.filter(user_id=user_id).values_list(
+        "chat_id", "business_connection_id"
+    ):
+        if business_connection_id:
+            by_connection.setdefault(business_connection_id, set()).add(chat_id)
+        else:
+            chat_ids.add(chat_id)
+    # Чат, открытый целиком, не нужно повторять в условиях по подключениям
+    connection_chat_ids = {
+        business_connection_id: frozenset(ids - chat_ids)
+        for business_connection_id, ids in by_connection.items()
+        if ids - chat_ids
+    }
+    return ChatAccess(frozenset(chat_ids), connection_chat_ids)
+
+
+def chat_access_version(user_id) -> int:
+    return AdminChatAccessVersion.objects.filter(user_id=user_id).values_list("version", flat=True).first() or 0
+
+
+def chat_access_for(user) -> ChatAccess:
+    """
+    Скомпилированный доступ пользователя из кэша Django. Кэш у процессов может быть свой, поэтому
+    запись хранится вместе с версией фильтров и сверяется с AdminChatAccessVersion одним запросом
+    по первичному ключу: изменение фильтров в любом процессе сразу делает чужие записи устаревшими.
+    """
+    key = _cache_key(user.pk)
+    version = chat_access_version(user.pk)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    access = compile_chat_access(user.pk)
+    cache.set(key, (version, access), ADMIN_CHAT_ACCESS_TTL_SECONDS)
+    return access
+
+
+def invalidate_chat_access(user_id) -> None:
+    """Повышает версию фильтров пользователя в той же транзакции, что и само изменение AdminChatFilter."""
+    if AdminChatAccessVersion.objects.filter(user_id=user_id).update(version=F("version") + 1):
+        return
+    try:
+        with transaction.atomic():
+            AdminChatAccessVersion.objects.create(user_id=user_id, version=1)
+    except IntegrityError:
+        # строку версии параллельно создал другой процесс
+        AdminChatAccessVersion.objects.filter(user_id=user_id).update(version=F("version") + 1)
+
+
+def can_view_chat(user, chat_id, business_connection_id=None) -> bool:
+    return user.is_superuser or chat_access_for(user).allows(chat_id, business_connection_id)
+
+
+def restrict_to_permitted_chats(queryset, user):
+    """Строки только тех чатов, что открыты пользователю через AdminChatFilter (суперпользователю — все)."""
+    if user.is_superuser:
+        return queryset
+    q = chat_access_for(user).as_q()
+    return queryset.filter(q) if q is not None else queryset.none()
@@ -1,18 +1,29 @@
 import html
+from datetime import datetime
 
-from .models import FileType
+from django.db.models import Q
 
+from .models import FILE_TYPE_LABELS, FileType
 
-def format_message_html(message) -> str:
+# Колонки, которые нужны format_message_html: чат грузит только их
+CHAT_DISPLAY_FIELDS = ("id", "message_id", "text", "caption", "file_type", "first_name", "username_from", "created_at")
+
+
+def format_message_html(message, text_html: str | None = None) -> str:
+    """text_html — уже безопасный HTML текста (например, с подсветкой поиска) вместо message.text."""
     text = (message.text or message.caption or "").strip()
+    media_label = None
     if message.file_type and message.file_type != FileType.UNKNOWN:
-        media_label = dict(FileType.choices).get(message.file_type, message.file_type)
+        media_label = FILE_TYPE_LABELS.get(message.file_type, message.file_type)
         if text:
             text = f"[{media_label}]\n{text}"
         else:
             text = f"[{media_label}]"
 
-    safe = html.escape(text).replace("\n", "<br>") if text else "<i>(пусто)</i>"
+    if text_html:
+        safe = f"{html.escape(f'[{media_label}]')}<br>{text_html}" if media_label else text_html
+    else:
+        safe = html.escape(text).replace("\n", "<br>") if text else "<i>(пусто)</i>"
 
     name_parts = []
     if message.first_name:
@@ -24,8 +35,65 @@ def format_message_html(message) -> str:
     when = message.created_at.strftime("%d.%m.%Y %H:%M:%S") if message.created_at else "—"
 
     return (
-        f'<div class="wu-chat-row wu-chat-msg">'
+        f'<div class="wu-chat-row wu-chat-msg" data-message-id="{message.message_id}">'
         f'<div class="wu-chat-meta">{html.escape(who)} · {when}</div>'
         f'<div class="wu-chat-text">{safe}</div>'
         f'</div>'
     )
+
+
+def render_chat_rows(messages, highlight=None) -> str:
+    """
+    HTML строк чата. highlight(message) — подсвеченный текст из поиска или None.
+    Готовые строки не кэшируются: чтение страницы из кэша Django почти не быстрее отрисовки,
+    а промах добавляет к ней ещё и запись в кэш.
+    """
+    return "".join(
+        format_message_html(message, text_html=highlight(message) if highlight else None) for message in messages
+    )
+
+
+def chat_page(queryset, cursor: str | None, page_size: int) -> tuple[list, str | None]:
+    """
+    Страница чата от новых к старым с keyset-пагинацией по (created_at, id): без OFFSET и без
+    загрузки всего чата. Сообщения без created_at (старые записи) идут последними, по убыванию id.
+    Возвращает (сообщения, курсор следующей страницы или None).
+    """
+    dated = queryset.filter(created_at__isnull=False).order_by("-created_at", "-id")
+    undated = queryset.filter(created_at__isnull=True).order_by("-id")
+
+    kind, created_at, last_id = _parse_cursor(cursor)
+    if kind == "t":
+        dated = dated.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id))
+        messages = list(dated[:page_size + 1])
+    elif kind == "n":
+        messages = []
+        undated = undated.filter(id__lt=last_id)
+    else:
+        messages = list(dated[:page_size + 1])
+
+    if len(messages) <= page_size:
+        messages += list(undated[:page_size + 1 - len(messages)])
+    has_more = len(messages) > page_size
+    messages = messages[:page_size]
+    return messages, (_encode_cursor(messages[-1]) if has_more else None)
+
+
+def _encode_cursor(message) -> str:
+    if message.created_at is None:
+        return f"n:{message.id}"
+    return f"t:{message.created_at.isoformat()}:{message.id}"
+
+
+def _parse_cursor(cursor: str | None):
+    """'t:<created_at>:<id>' или 'n:<id>'; некорректный курсор — первая страница."""
+    try:
+        kind, rest = (cursor or "").split(":", 1)
+        if kind == "t":
+            created_at, last_id = rest.rsplit(":", 1)
+            return kind, datetime.fromisoformat(created_at), int(last_id)
+        if kind == "n":
+            return kind, None, int(rest)
+    except ValueError:
+        pass
+    return None, None, None
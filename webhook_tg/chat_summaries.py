@@ -0,0 +1,164 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Greatest
+
+from .config import CHAT_SUMMARY_PREVIEW_CHARS
+from .models import FILE_TYPE_LABELS, ChatSummary, FileType, Message
+
+# Счётчик медиа в сводке по типу файла сообщения
+MEDIA_COUNT_FIELDS = {
+    FileType.PHOTO: "photo_count",
+    FileType.VIDEO: "video_count",
+    FileType.AUDIO: "audio_count",
+    FileType.DOCUMENT: "document_count",
+}
+_COUNT_FIELDS = ("message_count", *MEDIA_COUNT_FIELDS.values())
+_LAST_FIELDS = ("last_message_id", "last_message_at", "last_username", "last_first_name", "last_text")
+
+
+def _column(name: str) -> str:
+    return connection.ops.quote_name(ChatSummary._meta.get_field(name).column)
+
+
+def preview_text(values: dict) -> str:
+    """Начало сообщения для списка переписок; у медиа без подписи — название типа файла."""
+    text = (values.get("text") or values.get("caption") or "").strip()
+    if not text and values.get("file_type") in MEDIA_COUNT_FIELDS:
+        text = f"[{FILE_TYPE_LABELS[values['file_type']]}]"
+    return text[:CHAT_SUMMARY_PREVIEW_CHARS]
+
+
+def _summary_key(values: dict) -> tuple:
+    return values["chat_id"], values.get("business_connection_id") or ""
+
+
+def _recency(values: dict) -> tuple:
+    """Ключ «какое сообщение новее»: по created_at, затем по message_id; без даты — старше любого с датой."""
+    created_at = values.get("created_at")
+    return created_at is not None, created_at or 0, values["message_id"]
+
+
+def _accumulate(summaries: dict, values: dict) -> None:
+    summary = summaries.get(_summary_key(values))
+    if summary is None:
+        summary = summaries[_summary_key(values)] = dict.fromkeys(_COUNT_FIELDS, 0)
+        summary["last"] = values
+    summary["message_count"] += 1
+    media_field = MEDIA_COUNT_FIELDS.get(values.get("file_type"))
+    if media_field:
+        summary[media_field] += 1
+    if _recency(values) >= _recency(summary["last"]):
+        summary["last"] = values
+
+
+def _upsert_sql() -> tuple[str, list]:
+    table = connection.ops.quote_name(ChatSummary._meta.db_table)
+    columns = ["chat_id", "business_connection_id", *_COUNT_FIELDS, *_LAST_FIELDS]
+    # SET видит строку до изменения, поэтому все CASE сравнивают со старым last_message_at
+    newer = (
+        f"{table}.{_column('last_message_at')} IS NULL "
+        f"OR EXCLUDED.{_column('last_message_at')} >= {table}.{_column('last_message_at')}"
+    )
+    assignments = [f"{_column(c)} = {table}.{_column(c)} + EXCLUDED.{_column(c)}" for c in _COUNT_FIELDS]
+    assignments += [
+        f"{_column(c)} = CASE WHEN {newer} THEN EXCLUDED.{_column(c)} ELSE {table}.{_column(c)} END"
+        for c in _LAST_FIELDS
+    ]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(_column(c) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({_column('chat_id')}, {_column('business_connection_id')}) DO UPDATE SET "
+        + ", ".join(assignments)
+    )
+    return sql, columns
+
+
+def record_new_messages(messages) -> None:
+    """
+    Учитывает новые сообщения (словари полей Message с created_at) в сводках их переписок:
+    одна строка INSERT … ON CONFLICT на переписку, счётчики прибавляются, «последнее сообщение»
+    меняется, только если пришедшее новее записанного.
+    """
+    deltas: dict[tuple, dict] = {}
+    for values in messages:
+        _accumulate(deltas, values)
+    if not deltas:
+        return
+
+    sql, columns = _upsert_sql()
+    rows = []
+    for (chat_id, business_connection_id), delta in deltas.items():
+        last = delta["last"]
+        row = {
+            "chat_id": chat_id,
+            "business_connection_id": business_connection_id,
+            **{field: delta[field] for field in _COUNT_FIELDS},
+            "last_message_id": last["message_id"],
+            "last_message_at": connection.ops.adapt_datetimefield_value(last.get("created_at")),
+            "last_username": last.get("username_from"),
+            "last_first_name": last.get("first_name"),
+            "last_text": preview_text(last),
+        }
+        rows.append([row[c] for c in columns])
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def record_message_edit(values: dict, previous: dict) -> None:
+    """Правка сообщения: обновляет превью, если это последнее сообщение переписки, и счётчики медиа при смене типа."""
+    chat_id, business_connection_id = _summary_key(values)
+    changes = {
+        "last_text": Case(
+            When(last_message_id=values["message_id"], then=Value(preview_text(values))),
+            default=F("last_text"),
+            output_field=TextField(),
+        ),
+    }
+    old_field = MEDIA_COUNT_FIELDS.get(previous.get("file_type"))
+    new_field = MEDIA_COUNT_FIELDS.get(values.get("file_type"))
+    if old_field != new_field:
+        if old_field:
+            changes[old_field] = Greatest(F(old_field) - 1, Value(0))
+        if new_field:
+            changes[new_field] = F(new_field) + 1
+    ChatSummary.objects.filter(chat_id=chat_id, business_connection_id=business_connection_id).update(**changes)
+
+
+def record_message(values: dict, previous: dict | None, *, created_at) -> None:
+    """Сводка после upsert сообщения: previous is None — сообщение новое."""
+    if previous is None:
+        record_new_messages([{**values, "created_at": created_at}])
+    else:
+        record_message_edit(values, previous)
+
+
+def rebuild_chat_summaries(batch_size: int = 1000) -> int:
+    """
+    Пересчитывает все сводки по сообщениям в БД (архивные в счётчики не попадают).
+    Один проход по таблице сообщений в одной транзакции; возвращает число переписок.
+    """
+    fields = ("chat_id", "business_connection_id", "message_id", "created_at", "username_from", "first_name",
+              "text", "caption", "file_type")
+    summaries: dict[tuple, dict] = {}
+    with transaction.atomic():
+        for values in Message.objects.order_by().values(*fields).iterator(chunk_size=batch_size):
+            _accumulate(summaries, values)
+
+        ChatSummary.objects.all().delete()
+        ChatSummary.objects.bulk_create(
+            (
+                ChatSummary(
+                    chat_id=chat_id,
+                    business_connection_id=business_connection_id,
+                    **{field: summary[field] for field in _COUNT_FIELDS},
+                    last_message_id=summary["last"]["message_id"],
+                    last_message_at=summary["last"]["created_at"],
+                    last_username=summary["last"]["username_from"],
+                    last_first_name=summary["last"]["first_name"],
+                    last_text=preview_text(summary["last"]),
+                )
+                for (chat_id, business_connection_id), summary in summaries.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(summaries)
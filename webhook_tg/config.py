@@ -1,3 +1,5 @@
+from pathlib import Path
+
 START_PHOTO_ID = "AgACAgIAAxkDAAEKAyRqJJYFv4D0Ix7NOIF7wjy8Jaq7ZgACKBhrG6BCKEmQv3TUzQcFxgEAAwIAA3gAAzsE"
 START_TEXT = (
     "<b>Добро пожаловать!</b>\n\n"
@@ -18,4 +20,120 @@ OWNER_CHAT_ID = "1394340082"
 ALLOWED_SEND_CHAT_IDS = [
     1394340082,  # maksonchik200
     870546616,   # angelinatam
-]
\ No newline at end of file
+]
+
+# Режим inbox: webhook только сохраняет сырой апдейт в WebhookInboxUpdate и сразу отвечает 200,
+# обработку выполняет воркер `python manage.py process_tg_inbox --loop`.
+WEBHOOK_INBOX_MODE = False
+
+# После стольких неудачных попыток апдейт помечается обработанным, чтобы не блокировать очередь
+INBOX_MAX_ATTEMPTS = 5
+# Аренда апдейтов воркером process_tg_inbox: несколько воркеров не берут одну строку,
+# а строки упавшего воркера возвращаются в очередь по истечении аренды
+INBOX_LEASE_SECONDS = 120
+# Обработанные апдейты старше стольких дней удаляет команда prune_tg_inbox
+INBOX_KEEP_DAYS = 7
+
+# Кэш business-подключений в памяти процесса (поверх таблицы TelegramBusinessConnection)
+BUSINESS_CONNECTION_CACHE_SIZE = 1024
+BUSINESS_CONNECTION_CACHE_TTL_SECONDS = 600
+
+# HTTP-клиент Telegram: размер пула keep-alive соединений и таймауты (connect, read) по методам API
+TELEGRAM_POOL_SIZE = 10
+TELEGRAM_DEFAULT_TIMEOUT = (3.05, 10)
+TELEGRAM_METHOD_TIMEOUTS = {
+    "getBusinessConnection": (3.05, 5),
+    "sendMessage": (3.05, 5),
+    "sendPhoto": (3.05, 15),
+    "sendAudio": (3.05, 15),
+    "sendVideo": (3.05, 15),
+    "sendDocument": (3.05, 30),
+    "sendMediaGroup": (3.05, 30),
+}
+
+# Лимиты Telegram Bot API для отправки из outbox
+TELEGRAM_GLOBAL_RATE_PER_SECOND = 30
+TELEGRAM_CHAT_RATE_PER_SECOND = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE_PER_MINUTE = 20
+# Лимитер живёт в памяти процесса, а лимиты Telegram общие на бота: каждый процесс получает
+# 1/TELEGRAM_SENDING_PROCESSES бюджета. Считать все процессы, которые шлют сообщения:
+# воркеры run_outbox_worker и, при OUTBOX_INLINE_DELIVERY, процессы webhook
+TELEGRAM_SENDING_PROCESSES = 1
+# Полные бакеты чатов и истёкшие паузы удаляются раз в столько секунд или когда чатов больше предела:
+# полный бакет ничем не отличается от нового, поэтому память не растёт с числом чатов
+TELEGRAM_RATE_SWEEP_SECONDS = 60
+TELEGRAM_RATE_MAX_CHATS = 10000
+# Дольше этого outbox не ждёт освобождения чата, а откладывает сообщение
+OUTBOX_MAX_RATE_WAIT_SECONDS = 1.0
+
+# Аренда строк outbox воркером: после истечения строки упавшего воркера забирают другие
+OUTBOX_LEASE_SECONDS = 60
+
+# Отправлять сообщение outbox сразу после коммита в том же процессе (поток запроса webhook ждёт Telegram).
+# По умолчанию выключено: отправляет run_outbox_worker, его будит сигнал на OUTBOX_WAKEUP_PORT (UDP, 127.0.0.1)
+OUTBOX_INLINE_DELIVERY = False
+OUTBOX_WAKEUP_PORT = 47813
+
+# Массовое удаление: больше стольких сообщений — одним файлом-отчётом вместо отдельных уведомлений
+DELETED_DOCUMENT_THRESHOLD = 20
+# Размер пачки message_id в одном запросе к БД (лимит переменных SQLite)
+DELETED_LOOKUP_CHUNK_SIZE = 500
+# Куда складываются отчёты до отправки через outbox
+DELETED_REPORTS_DIR = Path(__file__).resolve().parent.parent / "var" / "deleted_reports"
+
+# Окно склейки правок одного сообщения: уведомление ждёт столько секунд, и все правки за это время
+# сливаются в одно «исходный текст → последний». 0 — без задержки, каждая правка отдельно.
+EDIT_COALESCE_WINDOW_SECONDS = 0
+
+# Отложенная запись (write-behind): новые сообщения и журнал исходящих копятся в памяти процесса
+# и пишутся пачками раз в WRITE_BEHIND_FLUSH_MS мс или по WRITE_BEHIND_MAX_ROWS строк.
+# При аварийном завершении процесса ненаписанные строки теряются. False — каждая строка пишется сразу.
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_FLUSH_MS = 50
+WRITE_BEHIND_MAX_ROWS = 200
+# Больше стольких строк в очереди — пишем синхронно, чтобы память не росла
+WRITE_BEHIND_MAX_PENDING = 5000
+
+# Кэш недавно сохранённых сообщений (на процесс) для уведомлений о правках и удалениях, байт. 0 — выключен.
+# Кэш считается точной копией строки, поэтому включать его можно только когда сообщения пишет один процесс
+# (один webhook-воркер или один process_tg_inbox): правку из другого процесса он не увидит.
+RECENT_MESSAGE_CACHE_BYTES = 0
+
+# Идемпотентность webhook: update_id растут, поэтому храним только окно последних id.
+# Апдейт с id ниже (максимальный id − WEBHOOK_UPDATE_WINDOW) считается повтором и отбрасывается;
+# строки ниже окна удаляет команда prune_webhook_updates
+WEBHOOK_UPDATE_WINDOW = 1000
+# После недели без апдейтов Telegram начинает update_id со случайного числа — старый максимум не действует
+WEBHOOK_UPDATE_ID_RESET_DAYS = 7
+
+# Архив старых сообщений: archive_messages переносит сообщения старше MESSAGE_ARCHIVE_AFTER_DAYS
+# из БД в сжатые файлы-сегменты по месяцам; уведомления об удалении ищут в них то, чего нет в БД
+MESSAGE_ARCHIVE_AFTER_DAYS = 180
+MESSAGE_ARCHIVE_DIR = Path(__file__).resolve().parent.parent / "var" / "message_archive"
+
+# Сколько сообщений чата в админке загружается за один запрос (остальные — при прокрутке)
+CHAT_PAGE_SIZE = 50
+
+# Живые обновления чата в админке (SSE, только под ASGI)
+LIVE_HEARTBEAT_SECONDS = 15
+# Через сколько браузер переподключается после обрыва потока
+LIVE_RETRY_MS = 5000
+# Очередь событий одного подключения; переполнилась — клиент получает resync и перечитывает чат
+LIVE_QUEUE_SIZE = 100
+# Unix-сокеты процессов с открытыми SSE: сюда рассылаются события из других процессов
+LIVE_SOCKET_DIR = Path(__file__).resolve().parent.parent / "var" / "live"
+# Список сокетов перечитывается при изменении каталога, но не реже чем раз в столько секунд
+LIVE_PEERS_REFRESH_SECONDS = 1.0
+
+# Список переписок в админке: сколько символов последнего сообщения хранить в сводке
+CHAT_SUMMARY_PREVIEW_CHARS = 200
+
+# Списки в админке: сколько подсказок показывать в фильтрах-полях ввода
+ADMIN_FILTER_SUGGESTIONS = 20
+# Таблица без фильтров больше этого — число строк в списке берётся из оценки, а не COUNT(*)
+ESTIMATED_COUNT_MIN_ROWS = 10000
+
+# Доступ к чатам в админке (AdminChatFilter), скомпилированный в IN-списки: сколько хранить в кэше.
+# Актуальность проверяется по версии фильтров (AdminChatAccessVersion), TTL лишь освобождает память
+ADMIN_CHAT_ACCESS_TTL_SECONDS = 300
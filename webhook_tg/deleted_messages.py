@@ -0,0 +1,106 @@
+import uuid
+from datetime import datetime
+
+from .archive import archived_message, message_archive
+from .config import DELETED_LOOKUP_CHUNK_SIZE, DELETED_REPORTS_DIR
+from .models import FILE_TYPE_LABELS, FileType, Message
+from .recent_messages import recent_messages
+
+_LOOKUP_FIELDS = ("message_id", "text", "caption", "file_id", "file_type", "created_at")
+
+# Ключ payload outbox: отчёт о массовом удалении собирается из сохранённых сообщений прямо перед отправкой
+DELETED_REPORT_KEY = "deleted_report"
+
+
+def iter_deleted_messages(chat_id, business_connection_id, msg_ids):
+    """
+    Пары (message_id, Message | None) в порядке msg_ids.
+    Порядок поиска: recent_messages, затем БД, затем архив старых сообщений.
+    Ищет пачками по DELETED_LOOKUP_CHUNK_SIZE, чтобы не упираться в лимит переменных SQLite
+    и не держать в памяти все сообщения сразу.
+    """
+    for start in range(0, len(msg_ids), DELETED_LOOKUP_CHUNK_SIZE):
+        chunk = msg_ids[start:start + DELETED_LOOKUP_CHUNK_SIZE]
+        known = _cached_messages(chat_id, business_connection_id, chunk)
+        missing = [mid for mid in chunk if mid not in known]
+        if missing:
+            known.update(
+                (m.message_id, m)
+                for m in Message.objects.filter(
+                    message_id__in=missing,
+                    business_connection_id=business_connection_id,
+                    chat_id=chat_id,
+                ).only(*_LOOKUP_FIELDS)
+            )
+            missing = [mid for mid in missing if mid not in known]
+        if missing:
+            # Старые сообщения могли уйти из БД в архив (archive_messages)
+            known.update(
+                (mid, archived_message(record))
+                for mid, record in message_archive.find_many(chat_id, missing).items()
+                if record.get("business_connection_id") == business_connection_id
+            )
+        for mid in chunk:
+            yield mid, known.get(mid)
+
+
+def _cached_messages(chat_id, business_connection_id, message_ids) -> dict:
+    """Недавние сообщения из recent_messages в виде несохранённых Message (те же атрибуты, что из БД)."""
+    if chat_id is None:
+        return {}
+    return {
+        mid: Message(
+            chat_id=chat_id,
+            message_id=mid,
+            business_connection_id=entry.business_connection_id,
+            text=entry.text,
+            caption=entry.caption,
+            file_id=entry.file_id,
+            file_type=entry.file_type,
+            created_at=entry.created_at,
+        )
+        for mid, entry in recent_messages.get_many(chat_id, message_ids).items()
+        if entry.business_connection_id == business_connection_id
+    }
+
+
+def deleted_report_payload(deleted: dict) -> dict:
+    """Всё, что нужно для сборки отчёта в воркере outbox: чат, подключение и id удалённых сообщений."""
+    chat = deleted.get("chat") or {}
+    return {
+        "chat": {key: chat.get(key) for key in ("id", "first_name", "username")},
+        "business_connection_id": deleted.get("business_connection_id"),
+        "message_ids": list(deleted.get("message_ids") or []),
+    }
+
+
+def write_deleted_report(deleted: dict, msg_ids) -> str:
+    """
+    Пишет текстовый отчёт о массовом удалении во временный файл и возвращает путь к нему.
+    Сообщения читаются пачками и сразу пишутся в файл — память не растёт с числом удалённых.
+    """
+    chat = deleted.get("chat") or {}
+    first_name = chat.get("first_name") or "Unknown"
+    username = chat.get("username")
+    who = f"{first_name} (@{username})" if username else first_name
+
+    DELETED_REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = DELETED_REPORTS_DIR / f"deleted_{chat.get('id')}_{uuid.uuid4().hex}.txt"
+    with open(path, "w", encoding="utf-8") as report:
+        report.write(f"{who} удалил(а) {len(msg_ids)} сообщений\n")
+        report.write(f"chat_id: {chat.get('id')}\n")
+        report.write(f"Отчёт сформирован: {datetime.now():%d.%m.%Y %H:%M:%S}\n\n")
+
+        for mid, message in iter_deleted_messages(chat.get("id"), deleted.get("business_connection_id"), msg_ids):
+            report.write(f"— id={mid}")
+            if message is not None and message.created_at:
+                report.write(f" · {message.created_at:%d.%m.%Y %H:%M:%S}")
+            report.write("\n")
+            if message is None:
+                report.write("(текст не сохранён)\n\n")
+                continue
+            if message.file_id and message.file_type and message.file_type != FileType.UNKNOWN:
+                label = FILE_TYPE_LABELS.get(message.file_type, message.file_type)
+                report.write(f"[{label}] file_id={message.file_id}\n")
+            report.write(f"{message.text or message.caption or '(пусто)'}\n\n")
+    return str(path)
@@ -2,10 +2,12 @@ import json
 import logging
 import threading
 
-import requests
+from .http_pool import PooledSessions
 
 logger = logging.getLogger(__name__)
 
+_sessions = PooledSessions(pool_size=4)
+
 
 def report_who_update_event(
     *,
@@ -32,7 +34,7 @@ def report_who_update_event(
 
     def _post():
         try:
-            requests.post(
+            _sessions.session().post(
                 WHO_UPDATE_EVENT_URL,
                 json=payload,
                 headers={"X-Who-Update-Token": WHO_UPDATE_EVENT_TOKEN},
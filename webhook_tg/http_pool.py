@@ -0,0 +1,28 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledSessions:
+    """
+    Сессии requests с общим пулом keep-alive соединений.
+    У каждого потока своя Session (cookies/headers не делятся между потоками),
+    но все они смонтированы на один HTTPAdapter, поэтому TCP+TLS соединения переиспользуются.
+    """
+
+    def __init__(self, pool_size: int = 10):
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._local = threading.local()
+
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def close(self) -> None:
+        self._adapter.close()
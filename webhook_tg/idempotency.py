@@ -1,24 +1,138 @@
 import logging
+import threading
+import time
+from datetime import timedelta
+from functools import partial
 
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
 
+from .config import WEBHOOK_UPDATE_ID_RESET_DAYS, WEBHOOK_UPDATE_WINDOW
 from .models import WebhookUpdate
 
 logger = logging.getLogger(__name__)
 
 
+class _UpdateWindow:
+    """
+    Уже закоммиченные в этом процессе update_id: максимум и id в окне под ним.
+    Очевидные повторы отсекаются без запроса к БД.
+    """
+
+    def __init__(self, window: int, reset_seconds: float):
+        self.window = window
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._high = None
+            self._high_at = 0.0
+            self._seen: set[int] = set()
+
+    def is_replay(self, update_id: int) -> bool:
+        with self._lock:
+            if self._high is None or time.monotonic() - self._high_at > self.reset_seconds:
+                return False
+            return update_id in self._seen or update_id <= self._high - self.window
+
+    def add(self, update_id: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._high is None or update_id > self._high or now - self._high_at > self.reset_seconds:
+                self._high = update_id
+                self._high_at = now
+            self._seen.add(update_id)
+            if len(self._seen) > 2 * self.window:
+                floor = self._high - self.window
+                self._seen = {seen for seen in self._seen if seen > floor}
+
+
+_recent = _UpdateWindow(WEBHOOK_UPDATE_WINDOW, WEBHOOK_UPDATE_ID_RESET_DAYS * 86400)
+
+
+def clear_update_window() -> None:
+    _recent.clear()
+
+
+def _reset_cutoff():
+    return timezone.now() - timedelta(days=WEBHOOK_UPDATE_ID_RESET_DAYS)
+
+
+def _insert_if_in_window_sql() -> str:
+    table = connection.ops.quote_name(WebhookUpdate._meta.db_table)
+    update_id = connection.ops.quote_name("update_id")
+    processed_at = connection.ops.quote_name("processed_at")
+    # Водяной знак — максимум update_id по уникальному индексу, отдельной строки-счётчика нет:
+    # она стала бы точкой конкуренции для всех параллельных транзакций
+    return (
+        f"INSERT INTO {table} ({update_id}, {processed_at}) SELECT %s, %s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {update_id} >= %s AND {processed_at} >= %s)"
+    )
+
+
+def is_valid_update_id(update_id) -> bool:
+    """update_id из тела апдейта: целое число (или строка из цифр) либо отсутствует."""
+    if update_id is None:
+        return True
+    if isinstance(update_id, bool):
+        return False
+    if isinstance(update_id, int):
+        return True
+    return isinstance(update_id, str) and update_id.strip().lstrip("-").isdigit()
+
+
 def acquire_webhook_update(update_id) -> bool:
     """
     Регистрирует update_id Telegram. Возвращает True, если апдейт новый и его нужно обработать.
-    False — апдейт уже обрабатывался (идемпотентный пропуск).
+    False — апдейт уже обрабатывался или старше окна WEBHOOK_UPDATE_WINDOW (идемпотентный пропуск).
     """
     if update_id is None:
         logger.warning("Webhook без update_id — обрабатываем без идемпотентности")
         return True
 
+    update_id = int(update_id)
+    if _recent.is_replay(update_id):
+        return False
+
     try:
         with transaction.atomic():
-            WebhookUpdate.objects.create(update_id=update_id)
-        return True
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    _insert_if_in_window_sql(),
+                    [
+                        update_id,
+                        connection.ops.adapt_datetimefield_value(timezone.now()),
+                        update_id + WEBHOOK_UPDATE_WINDOW,
+                        connection.ops.adapt_datetimefield_value(_reset_cutoff()),
+                    ],
+                )
+                inserted = cursor.rowcount == 1
     except IntegrityError:
         return False
+
+    if not inserted:
+        logger.info("Webhook update_id=%s ниже окна идемпотентности — пропуск", update_id)
+        return False
+    # В быстрый фильтр — только после коммита: откаченный апдейт Telegram пришлёт снова
+    transaction.on_commit(partial(_recent.add, update_id), robust=True)
+    return True
+
+
+def prune_webhook_updates(*, batch_size: int = 1000) -> int:
+    """Удаляет пачками строки WebhookUpdate ниже окна и старше периода сброса update_id. Возвращает число удалённых."""
+    cutoff = _reset_cutoff()
+    recent = WebhookUpdate.objects.filter(processed_at__gte=cutoff)
+    high = recent.order_by("-update_id").values_list("update_id", flat=True).first()
+
+    stale = WebhookUpdate.objects.filter(processed_at__lt=cutoff)
+    if high is not None:
+        stale = stale | WebhookUpdate.objects.filter(update_id__lte=high - WEBHOOK_UPDATE_WINDOW)
+
+    deleted = 0
+    while True:
+        pks = list(stale.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += WebhookUpdate.objects.filter(pk__in=pks).delete()[0]
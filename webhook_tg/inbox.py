@@ -0,0 +1,124 @@
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .config import INBOX_KEEP_DAYS, INBOX_LEASE_SECONDS, INBOX_MAX_ATTEMPTS
+from .models import WebhookInboxUpdate
+from .outbox import default_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+def store_inbox_update(data: dict) -> bool:
+    """
+    Сохраняет сырой апдейт в очередь. Уникальность update_id заменяет acquire_webhook_update:
+    False — апдейт уже был принят ранее (повтор от Telegram).
+    """
+    update_id = data.get("update_id")
+    if update_id is None:
+        logger.warning("Webhook без update_id — сохраняем в inbox без идемпотентности")
+
+    try:
+        with transaction.atomic():
+            WebhookInboxUpdate.objects.create(update_id=update_id, payload=data)
+        return True
+    except IntegrityError:
+        return False
+
+
+def _unlocked(now) -> Q:
+    return Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+
+
+def claim_inbox_batch(*, worker_id: str, limit: int, lease_seconds: int = INBOX_LEASE_SECONDS) -> list:
+    """
+    Атомарно берёт в аренду до limit необработанных апдейтов в порядке update_id — так же, как claim_outbox_batch.
+    UPDATE повторно проверяет processed_at и аренду, поэтому одну строку не получат два воркера.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=lease_seconds)
+    candidate_ids = list(
+        WebhookInboxUpdate.objects.filter(_unlocked(now), processed_at__isnull=True)
+        .order_by("update_id", "id")
+        .values_list("pk", flat=True)[:limit]
+    )
+    if not candidate_ids:
+        return []
+
+    WebhookInboxUpdate.objects.filter(_unlocked(now), processed_at__isnull=True, pk__in=candidate_ids).update(
+        locked_by=worker_id,
+        locked_until=lease_until,
+    )
+    return list(
+        WebhookInboxUpdate.objects.filter(pk__in=candidate_ids, locked_by=worker_id, locked_until=lease_until)
+        .order_by("update_id", "id")
+    )
+
+
+def process_inbox(
+    *,
+    limit: int = 100,
+    worker_id: str | None = None,
+    lease_seconds: int = INBOX_LEASE_SECONDS,
+    count_pending: bool = False,
+) -> dict:
+    """
+    Обрабатывает пачку арендованных апдейтов в порядке update_id существующими обработчиками.
+    pending (полный COUNT очереди) считается только при count_pending=True.
+    """
+    # views импортирует inbox, поэтому обработчик подключаем при вызове
+    from .views import handle_update, prepare_update
+
+    stats = {"processed": 0, "ok": 0, "failed": 0, "skipped": 0, "pending": None}
+    worker_id = worker_id or default_worker_id()
+
+    for item in claim_inbox_batch(worker_id=worker_id, limit=limit, lease_seconds=lease_seconds):
+        stats["processed"] += 1
+        owned = WebhookInboxUpdate.objects.filter(pk=item.pk, processed_at__isnull=True, locked_by=worker_id)
+        try:
+            prepare_update(item.payload)
+            # Апдейт и отметка processed_at — одна транзакция: повторной обработки после сбоя не будет.
+            # Отметка идёт первой и повторно проверяет владельца: если аренда истекла и строку забрал
+            # другой воркер, апдейт не обрабатывается второй раз
+            with transaction.atomic():
+                if not owned.update(processed_at=timezone.now(), locked_by="", locked_until=None):
+                    stats["skipped"] += 1
+                    logger.warning("Inbox update_id=%s lease lost by %s, skipped", item.update_id, worker_id)
+                    continue
+                handle_update(item.payload)
+        except Exception as exc:
+            stats["failed"] += 1
+            new_attempts = item.attempts + 1
+            give_up = new_attempts >= INBOX_MAX_ATTEMPTS
+            owned.update(
+                attempts=F("attempts") + 1,
+                last_error=str(exc)[:1000],
+                processed_at=timezone.now() if give_up else None,
+                locked_by="",
+                locked_until=None,
+            )
+            if give_up:
+                logger.error("Inbox dropped update_id=%s after %s attempts: %s", item.update_id, new_attempts, exc)
+            else:
+                logger.exception("Inbox update_id=%s failed (attempt %s)", item.update_id, new_attempts)
+            continue
+
+        stats["ok"] += 1
+
+    if count_pending:
+        stats["pending"] = WebhookInboxUpdate.objects.filter(processed_at__isnull=True).count()
+    return stats
+
+
+def prune_inbox_updates(*, keep_days: int = INBOX_KEEP_DAYS, batch_size: int = 1000) -> int:
+    """Удаляет пачками обработанные апдейты старше keep_days дней. Возвращает число удалённых."""
+    stale = WebhookInboxUpdate.objects.filter(processed_at__lt=timezone.now() - timedelta(days=keep_days))
+    deleted = 0
+    while True:
+        pks = list(stale.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += WebhookInboxUpdate.objects.filter(pk__in=pks).delete()[0]
@@ -5,4 +5,5 @@ from typing import Optional
 class BusinessConnection:
     user_id: Optional[int] = None
     user_chat_id: Optional[int] = None
-    username: Optional[str] = None
\ No newline at end of file
+    username: Optional[str] = None
+    is_enabled: bool = True
\ No newline at end of file
@@ -0,0 +1,257 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+
+from .config import (
+    LIVE_HEARTBEAT_SECONDS,
+    LIVE_PEERS_REFRESH_SECONDS,
+    LIVE_QUEUE_SIZE,
+    LIVE_RETRY_MS,
+    LIVE_SOCKET_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+# Событие в очереди подписчика: он отстал и потерял события — клиент должен перечитать чат
+RESYNC = object()
+
+
+@dataclass(eq=False)
+class Subscription:
+    chat_id: int
+    business_connection_id: str | None
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(LIVE_QUEUE_SIZE))
+    overflowed: bool = False
+
+    def matches(self, event: dict) -> bool:
+        if event["chat_id"] != self.chat_id:
+            return False
+        return self.business_connection_id is None or event["business_connection_id"] == self.business_connection_id
+
+
+class LiveUpdateHub:
+    """
+    Подписки SSE-подключений этого процесса на изменения сообщений чата.
+    publish() можно вызывать из любого потока; события доставляются в event loop подписчика.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+
+    def subscribe(self, chat_id: int, business_connection_id: str | None = None) -> Subscription:
+        subscription = Subscription(int(chat_id), business_connection_id or None, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self) -> bool:
+        with self._lock:
+            return bool(self._subscriptions)
+
+    def publish(self, event: dict) -> None:
+        with self._lock:
+            targets = [s for s in self._subscriptions if s.matches(event)]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(_enqueue, subscription, event)
+            except RuntimeError:
+                # loop уже закрыт — подключение завершилось
+                self.unsubscribe(subscription)
+
+
+def _enqueue(subscription: Subscription, event: dict) -> None:
+    """Backpressure: медленному клиенту события не копятся без предела, а заменяются одним resync."""
+    if subscription.overflowed:
+        return
+    if subscription.queue.full():
+        subscription.overflowed = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(RESYNC)
+        return
+    subscription.queue.put_nowait(event)
+
+
+hub = LiveUpdateHub()
+
+
+class _PeerProtocol(asyncio.DatagramProtocol):
+    def datagram_received(self, data, addr):
+        try:
+            hub.publish(json.loads(data))
+        except (ValueError, KeyError):
+            logger.debug("Bad live update datagram: %r", data[:100])
+
+
+class _PeerListener:
+    """Unix-сокет процесса в LIVE_SOCKET_DIR: через него приходят события из других процессов."""
+
+    def __init__(self):
+        self.path: Path | None = None
+        self._loop = None
+        self._transport = None
+
+    async def ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Первый поток в процессе (или event loop сменился) — сокет слушает текущий loop
+        self._loop = loop
+        if self._transport is not None:
+            try:
+                self._transport.close()
+            except RuntimeError:
+                # прежний loop уже закрыт вместе с сокетом
+                pass
+            self._transport = None
+        path = Path(LIVE_SOCKET_DIR) / f"{os.getpid()}.sock"
+        self.path = path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.unlink(missing_ok=True)
+            self._transport, _ = await loop.create_datagram_endpoint(
+                _PeerProtocol, local_addr=str(path), family=socket.AF_UNIX,
+            )
+        except OSError as exc:
+            logger.warning("Live updates from other processes disabled (%s)", exc)
+            return
+        atexit.register(path.unlink, missing_ok=True)
+
+
+peer_listener = _PeerListener()
+
+
+class _PeerDirectory:
+    """
+    Кэш списка сокетов других процессов: каталог читается заново, только когда изменилось его mtime
+    (сокет появился или удалён) или прошло LIVE_PEERS_REFRESH_SECONDS. Без SSE-процессов публикация
+    обходится одним stat.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._checked_at = 0.0
+        self._peers: list[Path] = []
+
+    def peers(self) -> list[Path]:
+        directory = Path(LIVE_SOCKET_DIR)
+        try:
+            key = (directory, directory.stat().st_mtime_ns)
+        except OSError:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            if key == self._key and now - self._checked_at < LIVE_PEERS_REFRESH_SECONDS:
+                return self._peers
+        peers = [path for path in directory.glob("*.sock") if path != peer_listener.path]
+        with self._lock:
+            self._key, self._checked_at, self._peers = key, now, peers
+        return peers
+
+
+peer_directory = _PeerDirectory()
+
+
+def _fan_out(event: dict) -> None:
+    peers = peer_directory.peers()
+    if not peers:
+        return
+    data = json.dumps(event).encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for path in peers:
+            try:
+                sock.sendto(data, str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Процесс завершился, не убрав сокет
+                path.unlink(missing_ok=True)
+            except OSError as exc:
+                logger.debug("Live update to %s failed: %s", path, exc)
+
+
+def publish_message_update(*, chat_id, message_id, business_connection_id=None, created=False) -> None:
+    """
+    Сообщение сохранено (created) или изменено: SSE-подключения этого и других процессов получат событие.
+    Новое сообщение клиент добавляет сверху, изменённое — только заменяет уже показанную строку.
+    """
+    event = {
+        "chat_id": int(chat_id),
+        "message_id": int(message_id),
+        "business_connection_id": business_connection_id or None,
+        "created": bool(created),
+    }
+    if hub.has_subscribers():
+        hub.publish(event)
+    _fan_out(event)
+
+
+def publish_on_commit(*, chat_id, message_id, business_connection_id=None, created=False) -> None:
+    transaction.on_commit(
+        partial(
+            publish_message_update,
+            chat_id=chat_id,
+            message_id=message_id,
+            business_connection_id=business_connection_id,
+            created=created,
+        ),
+        robust=True,
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def chat_event_stream(chat_id, business_connection_id, render):
+    """
+    Поток SSE для открытого чата. render(message_id) — синхронная функция, возвращающая HTML строки
+    или None (сообщение не видно пользователю); вызывается в потоке через sync_to_async.
+    PermissionDenied из render — доступ к чату отозван: клиент получает revoked, поток завершается.
+    Раз в LIVE_HEARTBEAT_SECONDS без событий отправляется комментарий, чтобы прокси не рвали соединение.
+    """
+    await peer_listener.ensure_started()
+    subscription = hub.subscribe(chat_id, business_connection_id)
+    render_row = sync_to_async(render)
+    try:
+        yield f"retry: {LIVE_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), LIVE_HEARTBEAT_SECONDS)
+            except TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if event is RESYNC:
+                subscription.overflowed = False
+                yield _sse("resync", {})
+                continue
+            try:
+                html = await render_row(event["message_id"])
+            except PermissionDenied:
+                yield _sse("revoked", {})
+                return
+            if html:
+                yield _sse(
+                    "message",
+                    {"message_id": event["message_id"], "created": event["created"], "html": html},
+                )
+    finally:
+        hub.unsubscribe(subscription)
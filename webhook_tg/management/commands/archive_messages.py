@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from webhook_tg.archive import archive_messages
+from webhook_tg.config import MESSAGE_ARCHIVE_AFTER_DAYS
+
+
+class Command(BaseCommand):
+    help = "Переносит старые сообщения из БД в сжатые файлы-сегменты архива (по месяцам)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=MESSAGE_ARCHIVE_AFTER_DAYS,
+            help=f"Архивировать сообщения старше стольких дней (default: {MESSAGE_ARCHIVE_AFTER_DAYS})",
+        )
+        parser.add_argument(
+            "--segment-size",
+            type=int,
+            default=50000,
+            help="Сколько сообщений в одном сегменте (default: 50000)",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for month, count in archive_messages(
+            older_than_days=options["older_than_days"],
+            segment_size=options["segment_size"],
+        ):
+            total += count
+            self.stdout.write(f"{month}: archived={count}")
+        self.stdout.write(self.style.SUCCESS(f"Archive: archived={total}"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from webhook_tg.query_plans import CANONICAL_QUERIES, explain, full_scans
+
+
+class Command(BaseCommand):
+    help = "Проверяет планы основных запросов приложения: ошибка, если какой-то читает таблицу целиком."
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, build in CANONICAL_QUERIES.items():
+            # SET LOCAL в PostgreSQL действует до конца транзакции
+            with transaction.atomic():
+                plan = explain(build())
+            scans = full_scans(plan)
+            status = self.style.ERROR("FULL SCAN") if scans else self.style.SUCCESS("ok")
+            self.stdout.write(f"{name}: {status}")
+            for line in plan:
+                self.stdout.write(f"    {line}")
+            if scans:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f"Полный просмотр таблицы в запросах: {', '.join(failed)}")
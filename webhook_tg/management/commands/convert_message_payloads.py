@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from webhook_tg.payloads import convert_legacy_payloads
+
+
+class Command(BaseCommand):
+    help = "Переносит старые Message.payload (repr) в сжатую таблицу MessagePayload. Можно прерывать и запускать снова."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Сколько сообщений переносить за одну транзакцию (default: 500)",
+        )
+        parser.add_argument(
+            "--vacuum",
+            action="store_true",
+            help="После переноса выполнить VACUUM (SQLite), чтобы файл БД уменьшился",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for converted, last_pk in convert_legacy_payloads(batch_size=options["batch_size"]):
+            total += converted
+            self.stdout.write(f"converted={total} last_pk={last_pk}")
+        self.stdout.write(self.style.SUCCESS(f"Payloads: converted={total}"))
+
+        if options["vacuum"]:
+            if connection.vendor != "sqlite":
+                self.stdout.write("VACUUM пропущен: не SQLite")
+                return
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write(self.style.SUCCESS("VACUUM done"))
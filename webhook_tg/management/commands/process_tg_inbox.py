@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webhook_tg.inbox import process_inbox
+from webhook_tg.outbox import default_worker_id
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает апдейты из очереди WebhookInboxUpdate (режим WEBHOOK_INBOX_MODE)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=100,
+            help="Размер пачки апдейтов за один проход (default: 100)",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Работать постоянно, опрашивая очередь",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.5,
+            help="Пауза в секундах, когда очередь пуста (default: 0.5)",
+        )
+        parser.add_argument(
+            "--count",
+            action="store_true",
+            help="Считать размер очереди (полный COUNT по таблице) после каждого прохода",
+        )
+
+    def handle(self, *args, **options):
+        worker_id = default_worker_id()
+        while True:
+            stats = process_inbox(limit=options["limit"], worker_id=worker_id, count_pending=options["count"])
+            if stats["processed"] or not options["loop"]:
+                line = (
+                    f"Inbox: processed={stats['processed']} ok={stats['ok']} "
+                    f"failed={stats['failed']} skipped={stats['skipped']}"
+                )
+                if stats["pending"] is not None:
+                    line += f" pending={stats['pending']}"
+                self.stdout.write(self.style.SUCCESS(line))
+            if not options["loop"]:
+                return
+            if not stats["processed"]:
+                time.sleep(options["interval"])
@@ -15,10 +15,10 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        stats = process_outbox(limit=options["limit"])
+        stats = process_outbox(limit=options["limit"], count_pending=True)
         self.stdout.write(
             self.style.SUCCESS(
                 f"Outbox: processed={stats['processed']} sent={stats['sent']} "
-                f"failed={stats['failed']} pending={stats['pending']}"
+                f"failed={stats['failed']} deferred={stats['deferred']} pending={stats['pending']}"
             )
         )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from webhook_tg.config import INBOX_KEEP_DAYS
+from webhook_tg.inbox import prune_inbox_updates
+
+
+class Command(BaseCommand):
+    help = "Удаляет обработанные апдейты WebhookInboxUpdate старше INBOX_KEEP_DAYS дней."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=INBOX_KEEP_DAYS,
+            help=f"Хранить обработанные апдейты столько дней (default: {INBOX_KEEP_DAYS})",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк удалять за один запрос (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_inbox_updates(keep_days=options["days"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"WebhookInboxUpdate: deleted={deleted}"))
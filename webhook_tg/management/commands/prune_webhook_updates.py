@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from webhook_tg.idempotency import prune_webhook_updates
+
+
+class Command(BaseCommand):
+    help = "Удаляет записи WebhookUpdate ниже окна идемпотентности (WEBHOOK_UPDATE_WINDOW)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк удалять за один запрос (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_webhook_updates(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"WebhookUpdate: deleted={deleted}"))
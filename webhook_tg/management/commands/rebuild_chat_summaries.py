@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from webhook_tg.chat_summaries import rebuild_chat_summaries
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сводки переписок (ChatSummary) по сохранённым сообщениям."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько строк читать и записывать за раз (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        chats = rebuild_chat_summaries(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Chat summaries: chats={chats}"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from webhook_tg.search import fts_available, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс сообщений (SQLite FTS5) по уже сохранённым данным."
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError("FTS-таблицы нет: нужна SQLite и миграция 0022_message_fts")
+        indexed = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Search index: messages={indexed}"))
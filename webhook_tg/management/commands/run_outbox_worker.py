@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+
+from webhook_tg.config import OUTBOX_LEASE_SECONDS, TELEGRAM_SENDING_PROCESSES
+from webhook_tg.outbox import default_worker_id, process_outbox
+from webhook_tg.rate_limit import rate_limiter
+from webhook_tg.wakeup import WakeupListener
+
+
+class Command(BaseCommand):
+    help = (
+        "Постоянно работающий воркер TelegramOutbox. Берёт сообщения пачками в аренду и отправляет "
+        "их пулом потоков; несколько таких процессов можно запускать параллельно — тогда их число "
+        "(вместе с процессами webhook при inline-отправке) нужно указать в TELEGRAM_SENDING_PROCESSES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Сколько сообщений брать в аренду за раз (default: 50)",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="Потоков отправки (default: 4)",
+        )
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=OUTBOX_LEASE_SECONDS,
+            help=f"Срок аренды в секундах (default: {OUTBOX_LEASE_SECONDS})",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Сколько ждать сигнала о новых сообщениях, когда очередь пуста (default: 1.0)",
+        )
+
+    def handle(self, *args, **options):
+        worker_id = default_worker_id()
+        wakeup = WakeupListener()
+        self.stdout.write(
+            f"Outbox worker {worker_id} started, global budget {rate_limiter.global_rate:g} msg/s "
+            f"(TELEGRAM_SENDING_PROCESSES={TELEGRAM_SENDING_PROCESSES})"
+        )
+        # Размер очереди (COUNT по таблице) — только в подробном выводе (-v 2), не на каждом проходе
+        count_pending = options["verbosity"] >= 2
+        while True:
+            stats = process_outbox(
+                limit=options["batch_size"],
+                threads=options["threads"],
+                worker_id=worker_id,
+                lease_seconds=options["lease"],
+                count_pending=count_pending,
+            )
+            if not stats["claimed"]:
+                wakeup.wait(options["interval"])
+                continue
+            line = (
+                f"Outbox: claimed={stats['claimed']} sent={stats['sent']} failed={stats['failed']} "
+                f"deferred={stats['deferred']} lost={stats['lost']}"
+            )
+            if stats["pending"] is not None:
+                line += f" pending={stats['pending']}"
+            self.stdout.write(line)
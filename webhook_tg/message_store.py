@@ -0,0 +1,204 @@
+from functools import partial
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .chat_summaries import record_message
+from .live_updates import publish_on_commit
+from .models import Message
+from .payloads import save_message_payloads
+from .recent_messages import CachedMessage, recent_messages
+
+# Поля, которые upsert перезаписывает при повторном сообщении с тем же (chat_id, message_id)
+UPSERT_FIELDS = (
+    "business_connection_id",
+    "username_from",
+    "first_name",
+    "text",
+    "file_id",
+    "file_type",
+    "caption",
+)
+# Прежнее содержимое, которое нужно уведомлению о редактировании
+PREVIOUS_FIELDS = ("text", "caption", "file_id", "file_type")
+
+
+def _column(name: str) -> str:
+    return connection.ops.quote_name(Message._meta.get_field(name).column)
+
+
+def _upsert_sql() -> tuple[str, list]:
+    table = connection.ops.quote_name(Message._meta.db_table)
+    insert_columns = ["chat_id", "message_id", "created_at", *UPSERT_FIELDS]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(_column(c) for c in insert_columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(insert_columns))}) "
+        f"ON CONFLICT ({_column('chat_id')}, {_column('message_id')}) DO UPDATE SET "
+        + ", ".join(f"{_column(c)} = EXCLUDED.{_column(c)}" for c in UPSERT_FIELDS)
+    )
+    return sql, insert_columns
+
+
+def _insert_new_sql(count: int) -> tuple[str, list]:
+    table = connection.ops.quote_name(Message._meta.db_table)
+    insert_columns = ["chat_id", "message_id", "created_at", *UPSERT_FIELDS]
+    row = f"({', '.join(['%s'] * len(insert_columns))})"
+    sql = (
+        f"INSERT INTO {table} ({', '.join(_column(c) for c in insert_columns)}) "
+        f"VALUES {', '.join([row] * count)} "
+        f"ON CONFLICT ({_column('chat_id')}, {_column('message_id')}) DO NOTHING"
+    )
+    return sql, insert_columns
+
+
+# Строк в одном INSERT: держимся ниже лимита переменных SQLite (10 колонок на строку)
+_INSERT_CHUNK_ROWS = 500
+
+
+def insert_new_messages(messages: list[dict], *, created_at) -> list[tuple[int, dict]]:
+    """
+    Вставляет сообщения, которых ещё нет, и возвращает (pk, values) только реально вставленных.
+    Уже существующую строку не трогает: её могла изменить правка из другого процесса,
+    а здесь лежит более старая версия.
+    """
+    if not messages:
+        return []
+    adapted_at = connection.ops.adapt_datetimefield_value(created_at)
+    keys = {(values["chat_id"], values["message_id"]): values for values in messages}
+    with connection.cursor() as cursor:
+        if connection.features.can_return_rows_from_bulk_insert:
+            inserted = []
+            for start in range(0, len(messages), _INSERT_CHUNK_ROWS):
+                chunk = messages[start:start + _INSERT_CHUNK_ROWS]
+                sql, columns = _insert_new_sql(len(chunk))
+                params = [
+                    adapted_at if column == "created_at" else values.get(column)
+                    for values in chunk
+                    for column in columns
+                ]
+                cursor.execute(
+                    f"{sql} RETURNING {_column('id')}, {_column('chat_id')}, {_column('message_id')}",
+                    params,
+                )
+                inserted += [(pk, keys[(chat_id, message_id)]) for pk, chat_id, message_id in cursor.fetchall()]
+            return inserted
+
+        sql, columns = _insert_new_sql(1)
+        inserted = []
+        for values in messages:
+            cursor.execute(sql, [adapted_at if c == "created_at" else values.get(c) for c in columns])
+            if cursor.rowcount:
+                pk = Message.objects.filter(
+                    chat_id=values["chat_id"], message_id=values["message_id"]
+                ).values_list("pk", flat=True).get()
+                inserted.append((pk, values))
+        return inserted
+
+
+def _previous_select_sql() -> str:
+    table = connection.ops.quote_name(Message._meta.db_table)
+    return (
+        f"SELECT {', '.join(_column(c) for c in PREVIOUS_FIELDS)} FROM {table} "
+        f"WHERE {_column('chat_id')} = %s AND {_column('message_id')} = %s"
+    )
+
+
+def _save_payload(pk, payload) -> None:
+    if payload is not None:
+        save_message_payloads([(pk, payload)])
+
+
+def remember_message(values: dict, *, created_at) -> None:
+    """После коммита кладёт сохранённую версию сообщения в recent_messages."""
+    entry = CachedMessage(
+        business_connection_id=values.get("business_connection_id"),
+        text=values.get("text"),
+        caption=values.get("caption"),
+        file_id=values.get("file_id"),
+        file_type=values.get("file_type"),
+        created_at=created_at,
+    )
+    transaction.on_commit(
+        partial(recent_messages.put, values["chat_id"], values["message_id"], entry),
+        robust=True,
+    )
+
+
+def _after_upsert(values: dict, previous: dict | None, *, created_at) -> dict | None:
+    """Сводка переписки (ChatSummary) в той же транзакции, строка в открытые чаты админки — после коммита."""
+    record_message(values, previous, created_at=created_at)
+    publish_on_commit(
+        chat_id=values["chat_id"],
+        message_id=values["message_id"],
+        business_connection_id=values.get("business_connection_id"),
+        created=previous is None,
+    )
+    return previous
+
+
+def _returning_pk(cursor, sql: str, params: list, chat_id, message_id) -> int:
+    if connection.features.can_return_columns_from_insert:
+        cursor.execute(f"{sql} RETURNING {_column('id')}", params)
+        return cursor.fetchone()[0]
+    cursor.execute(sql, params)
+    return Message.objects.filter(chat_id=chat_id, message_id=message_id).values_list("pk", flat=True).get()
+
+
+def upsert_message(*, chat_id, message_id, payload=None, **values) -> dict | None:
+    """
+    Вставляет или обновляет Message по (chat_id, message_id) и возвращает прежние
+    text/caption/file_id/file_type (None — сообщения раньше не было).
+    payload (сырой апдейт) пишется отдельной строкой в MessagePayload.
+
+    PostgreSQL: один запрос INSERT … ON CONFLICT … RETURNING, прежние значения читаются
+    из CTE — она видит снимок таблицы до изменения.
+    SQLite: RETURNING там отдаёт только новые значения, поэтому прежние берутся из recent_messages,
+    а при промахе читаются SELECT'ом в той же транзакции; запись — одним INSERT … ON CONFLICT.
+    """
+    upsert_sql, insert_columns = _upsert_sql()
+    now = timezone.now()
+    row_values = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "created_at": connection.ops.adapt_datetimefield_value(now),
+        **{field: values.get(field) for field in UPSERT_FIELDS},
+    }
+    params = [row_values[c] for c in insert_columns]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            previous_columns = ", ".join(f"(SELECT {_column(c)} FROM prev)" for c in PREVIOUS_FIELDS)
+            cursor.execute(
+                f"WITH prev AS ({_previous_select_sql()}) {upsert_sql} "
+                f"RETURNING (SELECT count(*) FROM prev), {_column('id')}, {_column('created_at')}, "
+                f"{previous_columns}",
+                [chat_id, message_id, *params],
+            )
+            existed, pk, created_at, *previous = cursor.fetchone()
+            _save_payload(pk, payload)
+            remember_message(row_values, created_at=created_at)
+            previous = dict(zip(PREVIOUS_FIELDS, previous)) if existed else None
+            return _after_upsert(row_values, previous, created_at=created_at)
+
+        cached = recent_messages.get(chat_id, message_id)
+        if cached is not None:
+            if payload is None:
+                cursor.execute(upsert_sql, params)
+            else:
+                _save_payload(_returning_pk(cursor, upsert_sql, params, chat_id, message_id), payload)
+            remember_message(row_values, created_at=cached.created_at)
+            previous = {field: getattr(cached, field) for field in PREVIOUS_FIELDS}
+            return _after_upsert(row_values, previous, created_at=cached.created_at)
+
+        with transaction.atomic():
+            cursor.execute(_previous_select_sql(), [chat_id, message_id])
+            previous = cursor.fetchone()
+            if payload is None:
+                cursor.execute(upsert_sql, params)
+            else:
+                _save_payload(_returning_pk(cursor, upsert_sql, params, chat_id, message_id), payload)
+    if previous is None:
+        remember_message(row_values, created_at=now)
+        return _after_upsert(row_values, None, created_at=now)
+    # created_at существующей строки здесь неизвестен — в кэш её не кладём
+    return _after_upsert(row_values, dict(zip(PREVIOUS_FIELDS, previous)), created_at=None)
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0014_bot_outgoing_message"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookInboxUpdate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "update_id",
+                    models.BigIntegerField(blank=True, null=True, unique=True, verbose_name="Telegram update_id"),
+                ),
+                ("payload", models.JSONField(verbose_name="Апдейт Telegram")),
+                ("received_at", models.DateTimeField(auto_now_add=True, verbose_name="Получено")),
+                (
+                    "processed_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True, verbose_name="Обработано"),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Попыток обработки")),
+                ("last_error", models.TextField(blank=True, default="", verbose_name="Последняя ошибка")),
+            ],
+            options={
+                "verbose_name": "Входящий апдейт (очередь)",
+                "verbose_name_plural": "Входящие апдейты (очередь)",
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0015_webhook_inbox_update"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramBusinessConnection",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "connection_id",
+                    models.CharField(max_length=255, unique=True, verbose_name="Business connection id"),
+                ),
+                ("user_id", models.BigIntegerField(blank=True, null=True, verbose_name="User id владельца")),
+                (
+                    "user_chat_id",
+                    models.BigIntegerField(blank=True, null=True, verbose_name="Chat id владельца с ботом"),
+                ),
+                (
+                    "username",
+                    models.CharField(blank=True, max_length=255, null=True, verbose_name="Username владельца"),
+                ),
+                ("is_enabled", models.BooleanField(default=True, verbose_name="Подключение активно")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Обновлено")),
+            ],
+            options={
+                "verbose_name": "Business-подключение",
+                "verbose_name_plural": "Business-подключения",
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0017_telegramoutbox_lease"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="telegramoutbox",
+            name="method",
+            field=models.CharField(
+                choices=[
+                    ("sendMessage", "sendMessage"),
+                    ("sendPhoto", "sendPhoto"),
+                    ("sendAudio", "sendAudio"),
+                    ("sendVideo", "sendVideo"),
+                    ("sendDocument", "sendDocument"),
+                    ("sendMediaGroup", "sendMediaGroup"),
+                ],
+                max_length=32,
+                verbose_name="Метод Telegram API",
+            ),
+        ),
+    ]
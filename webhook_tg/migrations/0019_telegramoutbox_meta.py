@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0018_alter_telegramoutbox_method"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="telegramoutbox",
+            name="meta",
+            field=models.JSONField(blank=True, default=dict, verbose_name="Служебные данные"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0019_telegramoutbox_meta"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MessagePayload",
+            fields=[
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="raw_payload",
+                        serialize=False,
+                        to="webhook_tg.message",
+                        verbose_name="Сообщение",
+                    ),
+                ),
+                ("data", models.BinaryField(verbose_name="Сжатый JSON")),
+            ],
+            options={
+                "verbose_name": "Payload сообщения",
+                "verbose_name_plural": "Payload сообщений",
+            },
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="payload",
+            field=models.TextField(blank=True, default="", null=True, verbose_name="payload (устаревшее)"),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0020_message_payload"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["chat_id", "business_connection_id", "message_id"], name="wtg_msg_chat_conn_msg_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["chat_id", "business_connection_id", "-created_at"], name="wtg_msg_chat_conn_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertg",
+            index=models.Index(fields=["user_id"], name="wtg_usertg_user_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertg",
+            index=models.Index(fields=["chat_id", "username", "first_name"], name="wtg_usertg_chat_names_idx"),
+        ),
+    ]
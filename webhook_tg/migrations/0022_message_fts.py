@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# Полнотекстовый индекс сообщений (SQLite FTS5, external content): хранит только индекс,
+# сами тексты остаются в webhook_tg_message. Синхронизируется триггерами.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS webhook_tg_message_fts USING fts5(
+        text, caption, username_from, first_name,
+        content='webhook_tg_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS webhook_tg_message_fts_ai AFTER INSERT ON webhook_tg_message BEGIN
+        INSERT INTO webhook_tg_message_fts(rowid, text, caption, username_from, first_name)
+        VALUES (new.id, new.text, new.caption, new.username_from, new.first_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS webhook_tg_message_fts_ad AFTER DELETE ON webhook_tg_message BEGIN
+        INSERT INTO webhook_tg_message_fts(webhook_tg_message_fts, rowid, text, caption, username_from, first_name)
+        VALUES ('delete', old.id, old.text, old.caption, old.username_from, old.first_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS webhook_tg_message_fts_au
+    AFTER UPDATE OF text, caption, username_from, first_name ON webhook_tg_message BEGIN
+        INSERT INTO webhook_tg_message_fts(webhook_tg_message_fts, rowid, text, caption, username_from, first_name)
+        VALUES ('delete', old.id, old.text, old.caption, old.username_from, old.first_name);
+        INSERT INTO webhook_tg_message_fts(rowid, text, caption, username_from, first_name)
+        VALUES (new.id, new.text, new.caption, new.username_from, new.first_name);
+    END
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS webhook_tg_message_fts_au",
+    "DROP TRIGGER IF EXISTS webhook_tg_message_fts_ad",
+    "DROP TRIGGER IF EXISTS webhook_tg_message_fts_ai",
+    "DROP TABLE IF EXISTS webhook_tg_message_fts",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        # FTS5 есть только в SQLite; на других БД админка ищет обычным LIKE
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0021_query_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SQL), _run(DROP_SQL)),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0023_message_chat_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatSummary",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("chat_id", models.BigIntegerField(verbose_name="Chat id")),
+                (
+                    "business_connection_id",
+                    models.CharField(blank=True, default="", max_length=255, verbose_name="Business connection id"),
+                ),
+                ("message_count", models.PositiveIntegerField(default=0, verbose_name="Сообщений")),
+                ("photo_count", models.PositiveIntegerField(default=0, verbose_name="Фото")),
+                ("video_count", models.PositiveIntegerField(default=0, verbose_name="Видео")),
+                ("audio_count", models.PositiveIntegerField(default=0, verbose_name="Аудио")),
+                ("document_count", models.PositiveIntegerField(default=0, verbose_name="Документов")),
+                ("last_message_id", models.IntegerField(blank=True, null=True, verbose_name="Последнее сообщение")),
+                ("last_message_at", models.DateTimeField(blank=True, null=True, verbose_name="Последняя активность")),
+                (
+                    "last_username",
+                    models.CharField(
+                        blank=True, max_length=255, null=True, verbose_name="Username последнего отправителя"
+                    ),
+                ),
+                (
+                    "last_first_name",
+                    models.CharField(blank=True, max_length=255, null=True, verbose_name="Имя последнего отправителя"),
+                ),
+                ("last_text", models.TextField(blank=True, default="", verbose_name="Последнее сообщение (начало)")),
+            ],
+            options={
+                "verbose_name": "Переписка",
+                "verbose_name_plural": "Переписки",
+                "indexes": [models.Index(fields=["-last_message_at", "-id"], name="wtg_chatsum_last_at_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("chat_id", "business_connection_id"),
+                        name="webhook_tg_chat_summary_chat_conn_uniq",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webhook_tg", "0024_chat_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookinboxupdate",
+            name="locked_until",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Аренда до"),
+        ),
+        migrations.AddField(
+            model_name="webhookinboxupdate",
+            name="locked_by",
+            field=models.CharField(blank=True, default="", max_length=128, verbose_name="Воркер"),
+        ),
+    ]
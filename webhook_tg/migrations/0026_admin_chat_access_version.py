@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("webhook_tg", "0025_webhook_inbox_lease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdminChatAccessVersion",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="admin_chat_access_version",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0, verbose_name="Версия")),
+            ],
+            options={
+                "verbose_name": "Версия доступа к чатам",
+                "verbose_name_plural": "Версии доступа к чатам",
+            },
+        ),
+    ]
@@ -28,6 +28,26 @@ class AdminChatFilter(models.Model):
         return f"{self.user.username} → chat_id={self.chat_id}{conn}"
 
 
+class AdminChatAccessVersion(models.Model):
+    """Версия набора AdminChatFilter пользователя: растёт при каждом изменении, по ней процессы сверяют свой кэш."""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="admin_chat_access_version",
+        verbose_name="Пользователь",
+    )
+    version = models.PositiveBigIntegerField(verbose_name="Версия", default=0)
+
+    class Meta:
+        verbose_name = "Версия доступа к чатам"
+        verbose_name_plural = "Версии доступа к чатам"
+
+    def __str__(self):
+        return f"{self.user_id}: {self.version}"
+
+
 class UserTg(models.Model):
     user_id = models.IntegerField(verbose_name="User Id пользователя")
     chat_id = models.IntegerField(verbose_name="Chat Id пользователя с ботом")
@@ -40,6 +60,12 @@ class UserTg(models.Model):
     class Meta:
         verbose_name = "Пользователь бота"
         verbose_name_plural = "Пользователи бота"
+        indexes = [
+            # init_user_bot: get_or_create по user_id
+            models.Index(fields=["user_id"], name="wtg_usertg_user_id_idx"),
+            # Получатель в журнале исходящих: username и first_name читаются прямо из индекса
+            models.Index(fields=["chat_id", "username", "first_name"], name="wtg_usertg_chat_names_idx"),
+        ]
 
 class FileType(models.TextChoices):
     """Тип медиафайла в сообщении."""
@@ -50,6 +76,10 @@ class FileType(models.TextChoices):
     DOCUMENT = "DOCUMENT", "Документ"
 
 
+# Подписи типов файлов: словарь собирается один раз, а не из FileType.choices на каждое сообщение
+FILE_TYPE_LABELS = dict(FileType.choices)
+
+
 class WebhookUpdate(models.Model):
     update_id = models.BigIntegerField(verbose_name="Telegram update_id", unique=True, db_index=True)
     processed_at = models.DateTimeField(verbose_name="Обработано", auto_now_add=True)
@@ -62,6 +92,45 @@ class WebhookUpdate(models.Model):
         return str(self.update_id)
 
 
+class WebhookInboxUpdate(models.Model):
+    """Сырой апдейт Telegram, принятый webhook'ом в режиме inbox и ожидающий обработки воркером."""
+
+    update_id = models.BigIntegerField(verbose_name="Telegram update_id", unique=True, null=True, blank=True)
+    payload = models.JSONField(verbose_name="Апдейт Telegram")
+    received_at = models.DateTimeField(verbose_name="Получено", auto_now_add=True)
+    processed_at = models.DateTimeField(verbose_name="Обработано", null=True, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(verbose_name="Попыток обработки", default=0)
+    last_error = models.TextField(verbose_name="Последняя ошибка", blank=True, default="")
+    locked_until = models.DateTimeField(verbose_name="Аренда до", null=True, blank=True)
+    locked_by = models.CharField(verbose_name="Воркер", max_length=128, blank=True, default="")
+
+    class Meta:
+        verbose_name = "Входящий апдейт (очередь)"
+        verbose_name_plural = "Входящие апдейты (очередь)"
+
+    def __str__(self):
+        return f"{self.update_id} (attempts={self.attempts})"
+
+
+class TelegramBusinessConnection(models.Model):
+    """Локальная копия business-подключения: заполняется из апдейтов business_connection."""
+
+    connection_id = models.CharField(verbose_name="Business connection id", max_length=255, unique=True)
+    user_id = models.BigIntegerField(verbose_name="User id владельца", null=True, blank=True)
+    user_chat_id = models.BigIntegerField(verbose_name="Chat id владельца с ботом", null=True, blank=True)
+    username = models.CharField(verbose_name="Username владельца", max_length=255, blank=True, null=True)
+    is_enabled = models.BooleanField(verbose_name="Подключение активно", default=True)
+    updated_at = models.DateTimeField(verbose_name="Обновлено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Business-подключение"
+        verbose_name_plural = "Business-подключения"
+
+    def __str__(self):
+        who = f"@{self.username}" if self.username else str(self.user_id)
+        return f"{self.connection_id} → {who}"
+
+
 class EditNotificationSent(models.Model):
     """Deprecated: заменено на TelegramOutbox с dedup_key."""
 
@@ -88,6 +157,7 @@ class TelegramOutbox(models.Model):
         SEND_AUDIO = "sendAudio", "sendAudio"
         SEND_VIDEO = "sendVideo", "sendVideo"
         SEND_DOCUMENT = "sendDocument", "sendDocument"
+        SEND_MEDIA_GROUP = "sendMediaGroup", "sendMediaGroup"
 
     chat_id = models.BigIntegerField(verbose_name="Chat id")
     method = models.CharField(
@@ -96,6 +166,7 @@ class TelegramOutbox(models.Model):
         choices=Method.choices,
     )
     payload = models.JSONField(verbose_name="Тело запроса (без chat_id)")
+    meta = models.JSONField(verbose_name="Служебные данные", default=dict, blank=True)
     dedup_key = models.CharField(
         verbose_name="Ключ дедупликации",
         max_length=128,
@@ -106,6 +177,8 @@ class TelegramOutbox(models.Model):
     attempts = models.PositiveIntegerField(verbose_name="Попыток отправки", default=0)
     next_attempt_at = models.DateTimeField(verbose_name="Следующая попытка", db_index=True)
     last_error = models.TextField(verbose_name="Последняя ошибка", blank=True, default="")
+    locked_until = models.DateTimeField(verbose_name="Аренда до", null=True, blank=True, db_index=True)
+    locked_by = models.CharField(verbose_name="Воркер", max_length=128, blank=True, default="")
     created_at = models.DateTimeField(verbose_name="Создано", auto_now_add=True)
 
     class Meta:
@@ -146,7 +219,8 @@ class Message(models.Model):
         null=True,
     )
     caption = models.TextField(verbose_name="Текст к файлу", blank=True, null=True)
-    payload = models.TextField(verbose_name="payload", default="", blank=True, null=True)
+    # Устаревшее: сырой апдейт теперь в MessagePayload, старые значения переносит convert_message_payloads
+    payload = models.TextField(verbose_name="payload (устаревшее)", default="", blank=True, null=True)
     created_at = models.DateTimeField(verbose_name="Создано", auto_now_add=True, null=True, blank=True)
 
     def __str__(self):
@@ -161,3 +235,71 @@ class Message(models.Model):
                 name="webhook_tg_message_chat_message_id_uniq",
             ),
         ]
+        indexes = [
+            # Уведомления об удалении: chat_id, business_connection_id, message_id IN (…)
+            models.Index(fields=["chat_id", "business_connection_id", "message_id"], name="wtg_msg_chat_conn_msg_idx"),
+            # Чат в админке: сообщения одного чата и подключения по убыванию created_at
+            models.Index(fields=["chat_id", "business_connection_id", "-created_at"], name="wtg_msg_chat_conn_created_idx"),
+            # Чат в админке без фильтра по подключению: keyset-пагинация по (created_at, id)
+            models.Index(fields=["chat_id", "-created_at", "-id"], name="wtg_msg_chat_created_id_idx"),
+        ]
+
+
+class MessagePayload(models.Model):
+    """Сырой апдейт сообщения: сжатый zlib канонический JSON, читается только по запросу."""
+
+    message = models.OneToOneField(
+        Message,
+        verbose_name="Сообщение",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="raw_payload",
+    )
+    data = models.BinaryField(verbose_name="Сжатый JSON")
+
+    class Meta:
+        verbose_name = "Payload сообщения"
+        verbose_name_plural = "Payload сообщений"
+
+    def __str__(self):
+        return f"payload {self.message_id} ({len(self.data)} B)"
+
+
+class ChatSummary(models.Model):
+    """
+    Сводка по переписке (chat_id + business-подключение) для списка чатов в админке.
+    Обновляется инкрементально при сохранении сообщений (chat_summaries), заполняется заново
+    командой rebuild_chat_summaries.
+    """
+
+    chat_id = models.BigIntegerField(verbose_name="Chat id")
+    # Пустая строка вместо NULL: иначе уникальность по (chat_id, подключение) не работает для сообщений без подключения
+    business_connection_id = models.CharField(verbose_name="Business connection id", max_length=255, blank=True, default="")
+    message_count = models.PositiveIntegerField(verbose_name="Сообщений", default=0)
+    photo_count = models.PositiveIntegerField(verbose_name="Фото", default=0)
+    video_count = models.PositiveIntegerField(verbose_name="Видео", default=0)
+    audio_count = models.PositiveIntegerField(verbose_name="Аудио", default=0)
+    document_count = models.PositiveIntegerField(verbose_name="Документов", default=0)
+    last_message_id = models.IntegerField(verbose_name="Последнее сообщение", null=True, blank=True)
+    last_message_at = models.DateTimeField(verbose_name="Последняя активность", null=True, blank=True)
+    last_username = models.CharField(verbose_name="Username последнего отправителя", max_length=255, blank=True, null=True)
+    last_first_name = models.CharField(verbose_name="Имя последнего отправителя", max_length=255, blank=True, null=True)
+    last_text = models.TextField(verbose_name="Последнее сообщение (начало)", blank=True, default="")
+
+    class Meta:
+        verbose_name = "Переписка"
+        verbose_name_plural = "Переписки"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_id", "business_connection_id"],
+                name="webhook_tg_chat_summary_chat_conn_uniq",
+            ),
+        ]
+        indexes = [
+            # Список переписок в админке: страница по убыванию последней активности
+            models.Index(fields=["-last_message_at", "-id"], name="wtg_chatsum_last_at_idx"),
+        ]
+
+    def __str__(self):
+        who = f"@{self.last_username}" if self.last_username else (self.last_first_name or "")
+        return f"{self.chat_id} {who}".strip()
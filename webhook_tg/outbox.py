@@ -1,15 +1,24 @@
 import hashlib
 import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta
+from functools import partial
 
-from django.db import IntegrityError, transaction
-from django.db.models import F
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 
 from env import OWNER_CHAT_ID
 
+from .config import OUTBOX_INLINE_DELIVERY, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_RATE_WAIT_SECONDS
+from .deleted_messages import DELETED_REPORT_KEY, write_deleted_report
 from .models import TelegramOutbox
-from .telegram import dispatch_telegram_request, tg_send_message
+from .rate_limit import rate_limiter
+from .telegram import UPLOAD_KEY, UPLOAD_MISSING_ERROR, dispatch_telegram_request, tg_send_message
+from .wakeup import notify_outbox_worker
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +31,7 @@ PERMANENT_SEND_ERRORS = (
     "bot was blocked by the user",
     "user is deactivated",
     "chat not found",
+    UPLOAD_MISSING_ERROR,
 )
 
 
@@ -41,6 +51,17 @@ def edit_notification_dedup_key(msg) -> str | None:
     return f"edit:{editor_id}:{edit_date}:{text_hash}"
 
 
+def edit_coalesce_key(recipient, chat_id, message_id) -> str:
+    """Ключ ожидающего уведомления о правках одного сообщения, в которое сливаются новые правки."""
+    return f"edit-coalesce:{recipient}:{chat_id}:{message_id}"
+
+
+def deleted_notification_dedup_key(business_connection_id, chat_id, message_id) -> str:
+    # business_connection_id бывает длинным — в ключ кладём его хеш, чтобы уложиться в 128 символов
+    connection_hash = hashlib.sha256((business_connection_id or "").encode()).hexdigest()[:16]
+    return f"delete:{connection_hash}:{chat_id}:{message_id}"
+
+
 def _next_attempt_at(attempts: int):
     delay = min(INITIAL_BACKOFF_SECONDS * (2 ** attempts), MAX_BACKOFF_SECONDS)
     return timezone.now() + timedelta(seconds=delay)
@@ -65,80 +86,274 @@ def enqueue_outbox(
     method: str,
     payload: dict,
     dedup_key: str | None = None,
+    deliver_now: bool | None = None,
+    delay_seconds: float = 0,
+    meta: dict | None = None,
 ) -> None:
+    """
+    Кладёт сообщение в очередь. При deliver_now (по умолчанию OUTBOX_INLINE_DELIVERY) после коммита
+    транзакции сообщение сразу отправляется из этого процесса; строка в очереди остаётся страховкой.
+    delay_seconds откладывает первую попытку (отложенные сообщения inline не отправляются).
+    """
     if not chat_id:
         return
 
+    if deliver_now is None:
+        deliver_now = OUTBOX_INLINE_DELIVERY and delay_seconds <= 0
+
     defaults = {
         "chat_id": chat_id,
         "method": method,
         "payload": payload,
-        "next_attempt_at": timezone.now(),
+        "meta": meta or {},
+        "next_attempt_at": timezone.now() + timedelta(seconds=delay_seconds),
     }
 
     try:
         with transaction.atomic():
             if dedup_key:
-                TelegramOutbox.objects.get_or_create(
+                item, created = TelegramOutbox.objects.get_or_create(
                     dedup_key=dedup_key,
                     defaults=defaults,
                 )
-                return
-            TelegramOutbox.objects.create(dedup_key=None, **defaults)
+            else:
+                item, created = TelegramOutbox.objects.create(dedup_key=None, **defaults), True
+            if created:
+                after_commit = partial(_deliver_inline, item.pk) if deliver_now else notify_outbox_worker
+                transaction.on_commit(after_commit, robust=True)
     except IntegrityError:
         logger.debug("Outbox dedup skip: %s", dedup_key)
 
 
-def process_outbox(*, limit: int = 50) -> dict:
+def _deliver_inline(pk: int) -> None:
+    """Быстрый путь: отправка сразу после коммита. При временной ошибке строку подхватит воркер."""
+    items = claim_outbox_batch(worker_id=f"inline:{default_worker_id()}", limit=1, pks=[pk])
+    if not items:
+        return
+    item = items[0]
+    # Вызывающий код не ждёт лимитов: если чат занят, сообщение уйдёт через воркер
+    ok, error, wait = _deliver(item, max_wait=0)
+
+    if ok or wait > 0 or _is_permanent_send_error(error) or rate_limiter.paused_for(item.chat_id) > 0:
+        _finalize(item, ok, error, wait, _empty_stats())
+        return
+
+    # Попытку не засчитываем и backoff не ставим: воркер сразу повторит отправку
+    TelegramOutbox.objects.filter(pk=pk, locked_by=item.locked_by).update(
+        last_error=(error or "unknown error")[:1000],
+        locked_by="",
+        locked_until=None,
+    )
+    logger.warning("Outbox inline send failed id=%s chat_id=%s error=%s", pk, item.chat_id, error)
+    notify_outbox_worker()
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _unlocked(now) -> Q:
+    return Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+
+
+def claim_outbox_batch(
+    *,
+    worker_id: str,
+    limit: int,
+    lease_seconds: int = OUTBOX_LEASE_SECONDS,
+    pks: list | None = None,
+) -> list:
+    """
+    Атомарно берёт в аренду до limit готовых к отправке сообщений (или только строки pks).
+    UPDATE повторно проверяет, что аренды нет или она истекла, поэтому одну строку
+    не получат два воркера; строки упавшего воркера возвращаются в очередь по истечении аренды.
+    """
     now = timezone.now()
-    stats = {"processed": 0, "sent": 0, "failed": 0, "pending": 0}
+    lease_until = now + timedelta(seconds=lease_seconds)
+    candidates = TelegramOutbox.objects.filter(_unlocked(now), next_attempt_at__lte=now)
+    if pks is not None:
+        candidates = candidates.filter(pk__in=pks)
+    candidate_ids = list(
+        candidates.order_by("next_attempt_at", "created_at", "pk").values_list("pk", flat=True)[:limit]
+    )
+    if not candidate_ids:
+        return []
 
-    pending_ids = list(
-        TelegramOutbox.objects.filter(next_attempt_at__lte=now)
-        .order_by("created_at")
-        .values_list("pk", flat=True)[:limit]
+    TelegramOutbox.objects.filter(_unlocked(now), pk__in=candidate_ids).update(
+        locked_by=worker_id,
+        locked_until=lease_until,
+    )
+    return list(
+        TelegramOutbox.objects.filter(pk__in=candidate_ids, locked_by=worker_id, locked_until=lease_until)
+        .order_by("next_attempt_at", "created_at", "pk")
     )
-    stats["pending"] = TelegramOutbox.objects.filter(next_attempt_at__lte=now).count()
 
-    for pk in pending_ids:
-        item = TelegramOutbox.objects.filter(pk=pk).first()
-        if item is None or item.next_attempt_at > now:
-            continue
 
-        stats["processed"] += 1
+def _deliver(item: TelegramOutbox, max_wait: float | None = None) -> tuple[bool, str, float]:
+    """Отправка одного сообщения: (ok, error, wait). wait > 0 — отправку нужно отложить на столько секунд."""
+    if max_wait is None:
+        max_wait = OUTBOX_MAX_RATE_WAIT_SECONDS
+    wait = rate_limiter.acquire(item.chat_id, max_wait=max_wait)
+    if wait > 0:
+        return False, "", wait
+    report = (item.payload or {}).get(DELETED_REPORT_KEY)
+    if report is None:
         ok, error = dispatch_telegram_request(item.method, item.chat_id, item.payload)
-        if ok:
-            item.delete()
-            stats["sent"] += 1
-            logger.info("Outbox sent id=%s method=%s chat_id=%s", pk, item.method, item.chat_id)
-            continue
-
-        if _is_permanent_send_error(error):
-            logger.warning(
-                "Outbox dropped id=%s chat_id=%s permanent error=%s",
-                pk,
-                item.chat_id,
-                error,
-            )
-            item.delete()
-            stats["failed"] += 1
-            continue
-
-        new_attempts = item.attempts + 1
-        TelegramOutbox.objects.filter(pk=pk).update(
-            attempts=F("attempts") + 1,
-            last_error=(error or "unknown error")[:1000],
-            next_attempt_at=_next_attempt_at(new_attempts),
-        )
-        stats["failed"] += 1
-        if new_attempts == OWNER_ALERT_AFTER_ATTEMPTS:
-            _notify_owner_outbox_failed(item, error)
+        return ok, error, 0.0
+
+    # Отчёт о массовом удалении собирается перед каждой попыткой и живёт только на время отправки
+    try:
+        path = write_deleted_report(report, report["message_ids"])
+    except Exception as exc:
+        # Ошибка сборки — неудачная попытка этой строки (повтор по расписанию), а не падение всей пачки чата
+        logger.exception("Outbox deleted report build failed id=%s chat_id=%s", item.pk, item.chat_id)
+        return False, f"deleted report build failed: {exc}", 0.0
+    payload = {key: value for key, value in item.payload.items() if key != DELETED_REPORT_KEY}
+    payload[UPLOAD_KEY] = {"field": "document", "path": path, "filename": f"deleted_{report['chat']['id']}.txt"}
+    try:
+        ok, error = dispatch_telegram_request(item.method, item.chat_id, payload)
+    finally:
+        os.remove(path)
+    return ok, error, 0.0
+
+
+def _deliver_chat(items: list) -> list:
+    """Сообщения одного чата отправляются последовательно, чтобы сохранить порядок. Выполняется в пуле потоков."""
+    try:
+        return [_deliver(item) for item in items]
+    finally:
+        connections.close_all()
+
+
+def _remove_upload(item: TelegramOutbox) -> None:
+    """Временный файл для загрузки (строки, поставленные до сборки отчётов в воркере) больше не нужен."""
+    upload = (item.payload or {}).get(UPLOAD_KEY)
+    if not upload:
+        return
+    try:
+        os.remove(upload["path"])
+    except OSError:
+        pass
+
+
+def _empty_stats() -> dict:
+    return {"claimed": 0, "processed": 0, "sent": 0, "failed": 0, "deferred": 0, "lost": 0, "pending": None}
+
+
+def _lost_lease(item: TelegramOutbox, stats: dict) -> None:
+    # Аренда истекла и строку забрал другой воркер: итог этой попытки не записываем, строка теперь его
+    stats["lost"] += 1
+    logger.warning("Outbox lease lost id=%s chat_id=%s worker=%s", item.pk, item.chat_id, item.locked_by)
+
+
+def _finalize(item: TelegramOutbox, ok: bool, error: str, wait: float, stats: dict) -> None:
+    pk = item.pk
+    # Каждое изменение строки проверяет владельца: 0 затронутых строк — аренда потеряна
+    owned = TelegramOutbox.objects.filter(pk=pk, locked_by=item.locked_by)
+    released = {"locked_by": "", "locked_until": None}
+
+    if wait > 0:
+        if not owned.update(next_attempt_at=timezone.now() + timedelta(seconds=wait), **released):
+            _lost_lease(item, stats)
+            return
+        stats["deferred"] += 1
+        return
+
+    stats["processed"] += 1
+    if ok:
+        if not owned.delete()[0]:
+            _lost_lease(item, stats)
+            return
+        _remove_upload(item)
+        stats["sent"] += 1
+        logger.info("Outbox sent id=%s method=%s chat_id=%s", pk, item.method, item.chat_id)
+        return
+
+    if _is_permanent_send_error(error):
         logger.warning(
-            "Outbox retry scheduled id=%s method=%s chat_id=%s error=%s",
+            "Outbox dropped id=%s chat_id=%s permanent error=%s",
             pk,
-            item.method,
             item.chat_id,
             error,
         )
+        if not owned.delete()[0]:
+            _lost_lease(item, stats)
+            return
+        _remove_upload(item)
+        stats["failed"] += 1
+        return
+
+    retry_after = rate_limiter.paused_for(item.chat_id)
+    if retry_after > 0:
+        # 429: ждём ровно retry_after, это не ошибка доставки и не повод для backoff
+        updated = owned.update(
+            last_error=(error or "")[:1000],
+            next_attempt_at=timezone.now() + timedelta(seconds=retry_after),
+            **released,
+        )
+        if not updated:
+            _lost_lease(item, stats)
+            return
+        stats["deferred"] += 1
+        logger.info("Outbox throttled id=%s chat_id=%s retry_after=%.1fs", pk, item.chat_id, retry_after)
+        return
+
+    new_attempts = item.attempts + 1
+    updated = owned.update(
+        attempts=F("attempts") + 1,
+        last_error=(error or "unknown error")[:1000],
+        next_attempt_at=_next_attempt_at(new_attempts),
+        **released,
+    )
+    if not updated:
+        _lost_lease(item, stats)
+        return
+    stats["failed"] += 1
+    if new_attempts == OWNER_ALERT_AFTER_ATTEMPTS:
+        _notify_owner_outbox_failed(item, error)
+    logger.warning(
+        "Outbox retry scheduled id=%s method=%s chat_id=%s error=%s",
+        pk,
+        item.method,
+        item.chat_id,
+        error,
+    )
+
+
+def process_outbox(
+    *,
+    limit: int = 50,
+    threads: int = 1,
+    worker_id: str | None = None,
+    lease_seconds: int = OUTBOX_LEASE_SECONDS,
+    count_pending: bool = False,
+) -> dict:
+    """Отправляет пачку арендованных сообщений. pending (COUNT готовых к отправке) — только при count_pending=True."""
+    stats = _empty_stats()
+
+    items = claim_outbox_batch(
+        worker_id=worker_id or default_worker_id(),
+        limit=limit,
+        lease_seconds=lease_seconds,
+    )
+    stats["claimed"] = len(items)
+
+    by_chat: dict = {}
+    for item in items:
+        by_chat.setdefault(item.chat_id, []).append(item)
+
+    if threads > 1 and len(by_chat) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = {pool.submit(_deliver_chat, chat_items): chat_items for chat_items in by_chat.values()}
+            for future in as_completed(futures):
+                for item, result in zip(futures[future], future.result()):
+                    _finalize(item, *result, stats)
+    else:
+        for chat_items in by_chat.values():
+            for item in chat_items:
+                _finalize(item, *_deliver(item), stats)
 
+    if count_pending:
+        now = timezone.now()
+        stats["pending"] = TelegramOutbox.objects.filter(_unlocked(now), next_attempt_at__lte=now).count()
     return stats
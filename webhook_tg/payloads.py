@@ -0,0 +1,73 @@
+import ast
+import json
+import zlib
+
+from django.db import transaction
+
+from .models import Message, MessagePayload
+
+_COMPRESS_LEVEL = 6
+
+
+def encode_payload(payload) -> bytes:
+    """Канонический JSON (ключи отсортированы, без пробелов), сжатый zlib."""
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return zlib.compress(canonical.encode("utf-8"), _COMPRESS_LEVEL)
+
+
+def decode_payload(data) -> dict | str | None:
+    if not data:
+        return None
+    return json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+
+
+def parse_legacy_payload(text: str):
+    """Старый Message.payload — str(dict) из Python. Нераспознанный текст сохраняется как есть."""
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def save_message_payloads(pairs) -> None:
+    """pairs — (pk сообщения, апдейт). Одним запросом INSERT … ON CONFLICT."""
+    rows = [MessagePayload(message_id=pk, data=encode_payload(payload)) for pk, payload in pairs]
+    if rows:
+        MessagePayload.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["message"],
+            update_fields=["data"],
+        )
+
+
+def load_message_payload(message: Message):
+    """Сырой апдейт сообщения: из MessagePayload, для ещё не перенесённых строк — из старого поля."""
+    data = MessagePayload.objects.filter(message_id=message.pk).values_list("data", flat=True).first()
+    if data is not None:
+        return decode_payload(data)
+    legacy = Message.objects.filter(pk=message.pk).values_list("payload", flat=True).first()
+    return parse_legacy_payload(legacy) if legacy else None
+
+
+def convert_legacy_payloads(*, batch_size: int = 500):
+    """
+    Переносит старые Message.payload в MessagePayload пачками, каждая — своей транзакцией.
+    Перенесённые строки очищаются, поэтому прерванный перенос продолжается с того же места.
+    Генератор: после каждой пачки отдаёт (число строк, последний pk).
+    """
+    legacy = Message.objects.exclude(payload="").exclude(payload__isnull=True)
+    last_pk = 0
+    while True:
+        batch = list(legacy.filter(pk__gt=last_pk).order_by("pk").values_list("pk", "payload")[:batch_size])
+        if not batch:
+            return
+        with transaction.atomic():
+            # Если payload уже записан новым кодом, он свежее старого — не трогаем
+            MessagePayload.objects.bulk_create(
+                [MessagePayload(message_id=pk, data=encode_payload(parse_legacy_payload(text))) for pk, text in batch],
+                ignore_conflicts=True,
+            )
+            Message.objects.filter(pk__in=[pk for pk, _ in batch]).update(payload="")
+        last_pk = batch[-1][0]
+        yield len(batch), last_pk
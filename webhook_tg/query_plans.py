@@ -0,0 +1,58 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatSummary, Message, TelegramOutbox, UserTg, WebhookUpdate
+
+# Основные запросы приложения в том виде, в каком их строят views, admin и outbox
+CANONICAL_QUERIES = {
+    "deleted_lookup": lambda: Message.objects.filter(
+        message_id__in=[1, 2, 3],
+        business_connection_id="conn",
+        chat_id=1,
+    ).only("message_id", "text", "caption", "file_id", "file_type", "created_at"),
+    "admin_chat_view": lambda: Message.objects.filter(
+        chat_id=1,
+        business_connection_id="conn",
+    ).order_by("-created_at"),
+    "admin_chat_acl": lambda: Message.objects.filter(
+        Q(chat_id__in=[1, 2]) | Q(business_connection_id="conn", chat_id__in=[3, 4]),
+    ).order_by("-created_at")[:50],
+    "admin_chat_page": lambda: Message.objects.filter(
+        Q(created_at__lt=timezone.now()) | Q(created_at=timezone.now(), id__lt=1),
+        chat_id=1,
+        created_at__isnull=False,
+    ).order_by("-created_at", "-id")[:51],
+    "message_by_key": lambda: Message.objects.filter(chat_id=1, message_id=1),
+    "outgoing_recipients": lambda: UserTg.objects.filter(chat_id__in=[1, 2, 3]).values_list(
+        "chat_id", "username", "first_name"
+    ),
+    "init_user_bot": lambda: UserTg.objects.filter(user_id=1),
+    "webhook_update_window": lambda: WebhookUpdate.objects.filter(update_id__gte=1, processed_at__gte=timezone.now()),
+    "chat_summary_by_key": lambda: ChatSummary.objects.filter(chat_id=1, business_connection_id="conn"),
+    "outbox_due": lambda: TelegramOutbox.objects.filter(next_attempt_at__lte=timezone.now()).order_by("next_attempt_at"),
+}
+
+# SQLite: SCAN — проход по всей таблице или всему индексу (SEARCH — поиск по ключу).
+# PostgreSQL: Seq Scan при выключенном enable_seqscan — подходящего индекса нет
+_SQLITE_FULL_SCAN = re.compile(r"^\s*SCAN (?!CONSTANT ROW)")
+_POSTGRES_FULL_SCAN = re.compile(r"Seq Scan on (\S+)")
+
+
+def explain(queryset) -> list[str]:
+    """План выполнения запроса: строки EXPLAIN QUERY PLAN (SQLite) или EXPLAIN (PostgreSQL)."""
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {sql}", params)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    pattern = _POSTGRES_FULL_SCAN if connection.vendor == "postgresql" else _SQLITE_FULL_SCAN
+    return [line for line in plan if pattern.search(line)]
@@ -0,0 +1,151 @@
+import threading
+import time
+
+from .config import (
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE_PER_SECOND,
+    TELEGRAM_GLOBAL_RATE_PER_SECOND,
+    TELEGRAM_GROUP_RATE_PER_MINUTE,
+    TELEGRAM_RATE_MAX_CHATS,
+    TELEGRAM_RATE_SWEEP_SECONDS,
+    TELEGRAM_SENDING_PROCESSES,
+)
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + max(0.0, now - self.updated_at) * self.rate >= self.capacity
+
+
+class TelegramRateLimiter:
+    """
+    Лимиты Telegram Bot API в рамках процесса: общий бюджет сообщений в секунду,
+    бюджет на чат (для групп — в минуту) и паузы по retry_after из ответов 429.
+    Бюджеты делятся на processes — число процессов, отправляющих сообщения параллельно.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = TELEGRAM_GLOBAL_RATE_PER_SECOND,
+        chat_rate: float = TELEGRAM_CHAT_RATE_PER_SECOND,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        group_rate_per_minute: float = TELEGRAM_GROUP_RATE_PER_MINUTE,
+        processes: int = TELEGRAM_SENDING_PROCESSES,
+        sweep_seconds: float = TELEGRAM_RATE_SWEEP_SECONDS,
+        max_chats: int = TELEGRAM_RATE_MAX_CHATS,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        processes = max(1, processes)
+        self.global_rate = global_rate / processes
+        self.chat_rate = chat_rate / processes
+        # Запас чата не меньше одного сообщения, иначе в чат нельзя будет написать вовсе
+        self.chat_burst = max(1.0, chat_burst / processes)
+        self.group_rate = group_rate_per_minute / 60 / processes
+        self.sweep_seconds = sweep_seconds
+        self.max_chats = max_chats
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            now = self._clock()
+            self._global = TokenBucket(self.global_rate, max(1.0, self.global_rate), now)
+            self._chats: dict[int, TokenBucket] = {}
+            self._paused_until: dict[int, float] = {}
+            self._next_sweep_at = now + self.sweep_seconds
+            self._sweep_above = self.max_chats
+
+    def _sweep(self, now: float) -> None:
+        """Удаляет полные бакеты и истёкшие паузы. Вызывается под self._lock."""
+        if now < self._next_sweep_at and len(self._chats) + len(self._paused_until) <= self._sweep_above:
+            return
+        self._next_sweep_at = now + self.sweep_seconds
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.is_full(now)}
+        self._paused_until = {chat_id: until for chat_id, until in self._paused_until.items() if until > now}
+        # Если активных чатов и после очистки больше предела, следующая очистка по размеру — при удвоении,
+        # иначе каждый вызов проходил бы по всем бакетам
+        self._sweep_above = max(self.max_chats, 2 * (len(self._chats) + len(self._paused_until)))
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные chat_id — группы и каналы, у них лимит в минуту
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def pause_chat(self, chat_id, seconds: float) -> None:
+        """Telegram ответил 429 с retry_after: до его истечения этому чату не пишем."""
+        if not chat_id or seconds <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._sweep(now)
+            until = now + seconds
+            chat_id = int(chat_id)
+            self._paused_until[chat_id] = max(until, self._paused_until.get(chat_id, 0.0))
+
+    def paused_for(self, chat_id) -> float:
+        if not chat_id:
+            return 0.0
+        with self._lock:
+            until = self._paused_until.get(int(chat_id))
+            return max(0.0, until - self._clock()) if until else 0.0
+
+    def acquire(self, chat_id, *, max_wait: float = 1.0) -> float:
+        """
+        Резервирует отправку в чат. 0 — можно отправлять сейчас.
+        Положительное значение — через сколько секунд чат освободится; отправку нужно отложить.
+        Короткие ожидания (общий бюджет, бюджет чата до max_wait) выдерживаются здесь же.
+        """
+        chat_id = int(chat_id)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._sweep(now)
+                paused_until = self._paused_until.get(chat_id)
+                if paused_until is not None:
+                    if paused_until > now:
+                        return paused_until - now
+                    del self._paused_until[chat_id]
+
+                chat_bucket = self._chat_bucket(chat_id, now)
+                chat_wait = chat_bucket.wait_time(now)
+                if chat_wait > max_wait:
+                    return chat_wait
+                wait = max(chat_wait, self._global.wait_time(now))
+                if wait <= 0:
+                    chat_bucket.consume(now)
+                    self._global.consume(now)
+                    return 0.0
+            self._sleep(wait)
+
+
+rate_limiter = TelegramRateLimiter()
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from .config import RECENT_MESSAGE_CACHE_BYTES
+
+# Примерные накладные расходы на запись: ключ, dataclass, узел OrderedDict
+_ENTRY_OVERHEAD_BYTES = 300
+
+
+@dataclass(frozen=True, slots=True)
+class CachedMessage:
+    business_connection_id: str | None
+    text: str | None
+    caption: str | None
+    file_id: str | None
+    file_type: str | None
+    created_at: datetime | None
+
+
+def _entry_size(entry: CachedMessage) -> int:
+    size = _ENTRY_OVERHEAD_BYTES
+    for value in (entry.business_connection_id, entry.text, entry.caption, entry.file_id, entry.file_type):
+        if value:
+            size += len(value)
+    return size
+
+
+class RecentMessageCache:
+    """
+    LRU недавно сохранённых сообщений по (chat_id, message_id) с бюджетом в байтах. Потокобезопасный.
+    Кэш свой у каждого процесса: правку, обработанную другим воркером, он не видит, поэтому
+    включается (max_bytes > 0) только при одном пишущем процессе. С max_bytes = 0 ничего не хранит.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _pop(self, key) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= _entry_size(entry)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, chat_id, message_id) -> CachedMessage | None:
+        if not self.enabled:
+            return None
+        key = (int(chat_id), int(message_id))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get_many(self, chat_id, message_ids) -> dict[int, CachedMessage]:
+        found = {}
+        if not self.enabled:
+            return found
+        chat_id = int(chat_id)
+        with self._lock:
+            for message_id in message_ids:
+                key = (chat_id, int(message_id))
+                entry = self._data.get(key)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(key)
+                self.hits += 1
+                found[key[1]] = entry
+        return found
+
+    def put(self, chat_id, message_id, entry: CachedMessage) -> None:
+        if not self.enabled:
+            return
+        size = _entry_size(entry)
+        key = (int(chat_id), int(message_id))
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= _entry_size(evicted)
+                self.evictions += 1
+
+    def discard(self, chat_id, message_id) -> None:
+        with self._lock:
+            self._pop((int(chat_id), int(message_id)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Счётчики для подбора RECENT_MESSAGE_CACHE_BYTES под воркер."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+recent_messages = RecentMessageCache(RECENT_MESSAGE_CACHE_BYTES)
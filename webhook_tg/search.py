@@ -0,0 +1,103 @@
+import html
+import re
+
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Message, TelegramBusinessConnection
+
+FTS_TABLE = "webhook_tg_message_fts"
+# Маркеры совпадений в snippet(): не встречаются в тексте, после экранирования заменяются на <mark>
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+_SNIPPET_TOKENS = 16
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_fts_ready: dict[str, bool] = {}
+
+
+def fts_available() -> bool:
+    """Есть ли FTS-таблица в текущей БД (SQLite после миграции 0022)."""
+    if connection.vendor != "sqlite":
+        return False
+    alias = connection.alias
+    if alias not in _fts_ready:
+        _fts_ready[alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_ready[alias]
+
+
+def fts_query(term: str) -> str | None:
+    """Строка поиска → выражение MATCH: все слова обязательны, каждое ищется по префиксу."""
+    words = _WORD.findall(term or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _exact_match(term: str) -> Q | None:
+    """Точное совпадение с message_id или известным business_connection_id, как в старом поиске."""
+    term = term.strip()
+    if term.isdigit():
+        return Q(message_id=int(term)) | Q(business_connection_id=term)
+    if TelegramBusinessConnection.objects.filter(connection_id=term).exists():
+        return Q(business_connection_id=term)
+    return None
+
+
+def search_messages(queryset, term: str):
+    """
+    Сообщения, найденные FTS5, с аннотациями fts_rank (bm25, меньше — лучше) и fts_snippet.
+    FTS-таблица присоединяется к сообщениям один раз: SQLite идёт по совпадениям MATCH
+    и достаёт сообщения по первичному ключу, rank и snippet берутся из той же строки индекса.
+    Строка, похожая на message_id или business_connection_id, ищется ещё и точным совпадением —
+    тогда без аннотаций (OR с MATCH в одном JOIN SQLite не выполнит), в обычном порядке списка.
+    None — в строке нет слов для полнотекстового поиска.
+    """
+    match = fts_query(term)
+    if match is None:
+        return None
+    exact = _exact_match(term)
+    if exact is not None:
+        matched = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        return queryset.filter(Q(pk__in=matched) | exact)
+
+    table = connection.ops.quote_name(Message._meta.db_table)
+    fts = connection.ops.quote_name(FTS_TABLE)
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f"{fts}.rowid = {table}.id", f"{fts} MATCH %s"],
+        params=[match],
+    ).annotate(
+        fts_rank=RawSQL(f"{fts}.rank", []),
+        fts_snippet=RawSQL(
+            f"snippet({fts}, -1, %s, %s, '…', {_SNIPPET_TOKENS})",
+            [_MARK_START, _MARK_END],
+        ),
+    )
+
+
+def is_ranked(queryset) -> bool:
+    """Несёт ли queryset аннотацию fts_rank, т. е. прошёл ли поиск через FTS."""
+    return "fts_rank" in queryset.query.annotations
+
+
+RANK_ORDERING = (F("fts_rank").asc(nulls_last=True),)
+
+
+def highlight_html(snippet: str) -> str:
+    """Фрагмент из snippet() → безопасный HTML с <mark> вокруг совпадений."""
+    return (
+        html.escape(snippet)
+        .replace(_MARK_START, "<mark>")
+        .replace(_MARK_END, "</mark>")
+        .replace("\n", "<br>")
+    )
+
+
+def rebuild_search_index() -> int:
+    """Перестраивает FTS-индекс по всем сообщениям. Возвращает число проиндексированных строк."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return Message.objects.count()
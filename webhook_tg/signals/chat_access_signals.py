@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from webhook_tg.chat_access import invalidate_chat_access
+from webhook_tg.models import AdminChatFilter
+
+
+@receiver(pre_save, sender=AdminChatFilter)
+def invalidate_previous_owner(sender, instance, raw=False, **kwargs):
+    # фильтр могли переназначить другому пользователю — у прежнего доступ тоже меняется
+    if raw or instance.pk is None:
+        return
+    previous_user_id = AdminChatFilter.objects.filter(pk=instance.pk).values_list("user_id", flat=True).first()
+    if previous_user_id is not None and previous_user_id != instance.user_id:
+        invalidate_chat_access(previous_user_id)
+
+
+@receiver(post_save, sender=AdminChatFilter)
+@receiver(post_delete, sender=AdminChatFilter)
+def invalidate_owner(sender, instance, **kwargs):
+    invalidate_chat_access(instance.user_id)
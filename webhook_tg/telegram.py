@@ -4,22 +4,75 @@ import requests
 
 from env import TOKEN_BOT
 import html
+from .config import TELEGRAM_DEFAULT_TIMEOUT, TELEGRAM_METHOD_TIMEOUTS, TELEGRAM_POOL_SIZE
+from .http_pool import PooledSessions
 from .inner_models.BusinessConnection import BusinessConnection
 from .bot_outgoing_log import log_bot_outgoing
+from .rate_limit import rate_limiter
 
 logger = logging.getLogger(__name__)
 
 api_tg_url = f"https://api.telegram.org/bot{TOKEN_BOT}"
 
 
-def dispatch_telegram_request(method: str, chat_id, payload: dict, timeout: int = 5) -> tuple[bool, str]:
+class TelegramClient:
+    """Клиент Bot API поверх пула keep-alive соединений с таймаутами (connect, read) по методам."""
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        pool_size: int = TELEGRAM_POOL_SIZE,
+        default_timeout=TELEGRAM_DEFAULT_TIMEOUT,
+        method_timeouts: dict | None = None,
+    ):
+        self.base_url = base_url
+        self.default_timeout = default_timeout
+        self.method_timeouts = dict(method_timeouts or {})
+        self._sessions = PooledSessions(pool_size=pool_size)
+
+    def timeout_for(self, method: str):
+        return self.method_timeouts.get(method, self.default_timeout)
+
+    def post(self, method: str, *, json=None, data=None, files=None, timeout=None) -> requests.Response:
+        return self._sessions.session().post(
+            f"{self.base_url}/{method}",
+            json=json,
+            data=data,
+            files=files,
+            timeout=timeout if timeout is not None else self.timeout_for(method),
+        )
+
+
+client = TelegramClient(api_tg_url, method_timeouts=TELEGRAM_METHOD_TIMEOUTS)
+
+
+# Ключ payload с файлом для multipart-загрузки: {"field": "document", "path": ..., "filename": ...}
+UPLOAD_KEY = "upload"
+UPLOAD_MISSING_ERROR = "upload file not found"
+
+
+def _post_upload(method: str, body: dict, upload: dict, timeout) -> requests.Response:
+    data = {key: value for key, value in body.items() if key != UPLOAD_KEY}
+    with open(upload["path"], "rb") as file:
+        files = {upload["field"]: (upload.get("filename") or "file", file)}
+        return client.post(method, data=data, files=files, timeout=timeout)
+
+
+def dispatch_telegram_request(method: str, chat_id, payload: dict, timeout=None) -> tuple[bool, str]:
     if not chat_id:
         return False, "empty chat_id"
 
-    url = f"{api_tg_url}/{method}"
     body = {"chat_id": chat_id, **payload}
+    upload = payload.get(UPLOAD_KEY)
     try:
-        response = requests.post(url, json=body, timeout=timeout)
+        if upload:
+            response = _post_upload(method, body, upload, timeout)
+        else:
+            response = client.post(method, json=body, timeout=timeout)
+    except FileNotFoundError:
+        logger.error("%s chat_id=%s: %s %s", method, chat_id, UPLOAD_MISSING_ERROR, upload.get("path"))
+        return False, UPLOAD_MISSING_ERROR
     except requests.RequestException as exc:
         logger.error("%s failed chat_id=%s: %s", method, chat_id, exc)
         return False, str(exc)
@@ -33,6 +86,9 @@ def dispatch_telegram_request(method: str, chat_id, payload: dict, timeout: int
 
     if not result.get("ok"):
         error = str(result.get("description") or result)
+        retry_after = (result.get("parameters") or {}).get("retry_after")
+        if retry_after:
+            rate_limiter.pause_chat(chat_id, retry_after)
         logger.error("%s API error chat_id=%s status=%s response=%s", method, chat_id, response.status_code, result)
         return False, error
 
@@ -40,7 +96,7 @@ def dispatch_telegram_request(method: str, chat_id, payload: dict, timeout: int
     return True, ""
 
 
-def tg_send_message(chat_id: str, text: str, timeout: int = 5) -> bool:
+def tg_send_message(chat_id: str, text: str, timeout=None) -> bool:
     if not chat_id:
         return False
     if text is None:
@@ -58,21 +114,37 @@ def tg_send_message(chat_id: str, text: str, timeout: int = 5) -> bool:
     )
     return ok
 
-def get_business_connection(msg) -> BusinessConnection:
-    url = f"{api_tg_url}/getBusinessConnection"
-    body = {}
-    body['business_connection_id'] = msg.get("business_connection_id")
-    ans = requests.post(url, json=body).json()
-    print("business_connection", ans)
-    user_chat_id = ans.get("result").get("user_chat_id")
-    user_id = ans.get("result", {}).get("user", {}).get("id")
-    username = ans.get("result", {}).get("user", {}).get("username")
+def fetch_business_connection(business_connection_id: str, timeout=None) -> BusinessConnection | None:
+    """Запрашивает getBusinessConnection. None — если Telegram не ответил или вернул ошибку."""
+    if not business_connection_id:
+        return None
+
+    body = {"business_connection_id": business_connection_id}
+    try:
+        ans = client.post("getBusinessConnection", json=body, timeout=timeout).json()
+    except (requests.RequestException, ValueError) as exc:
+        logger.error("getBusinessConnection failed id=%s: %s", business_connection_id, exc)
+        return None
+
+    logger.debug("getBusinessConnection id=%s response=%s", business_connection_id, ans)
+    result = ans.get("result")
+    if not result:
+        logger.error("getBusinessConnection API error id=%s response=%s", business_connection_id, ans)
+        return None
+    return business_connection_from_result(result)
+
+
+def business_connection_from_result(result: dict) -> BusinessConnection:
+    """BusinessConnection из объекта Telegram (ответ getBusinessConnection или апдейт business_connection)."""
+    user = result.get("user") or {}
     return BusinessConnection(
-        user_chat_id = user_chat_id,
-        user_id = user_id,
-        username = username
+        user_chat_id=result.get("user_chat_id"),
+        user_id=user.get("id"),
+        username=user.get("username"),
+        is_enabled=result.get("is_enabled", True),
     )
 
+
 def _media_payload(caption: str) -> dict:
     payload = {}
     if caption:
@@ -82,7 +154,7 @@ def _media_payload(caption: str) -> dict:
     return payload
 
 
-def send_photo(chat_id, photo_id: str, caption: str = "", timeout: int = 5) -> bool:
+def send_photo(chat_id, photo_id: str, caption: str = "", timeout=None) -> bool:
     """Отправка фото по file_id. caption — подпись к фото (HTML)."""
     if not chat_id or not photo_id:
         return False
@@ -91,7 +163,7 @@ def send_photo(chat_id, photo_id: str, caption: str = "", timeout: int = 5) -> b
     return ok
 
 
-def send_audio(chat_id, audio_file_id: str, caption: str = "", timeout: int = 5) -> bool:
+def send_audio(chat_id, audio_file_id: str, caption: str = "", timeout=None) -> bool:
     """Отправка аудио/голоса по file_id."""
     if not chat_id or not audio_file_id:
         return False
@@ -100,7 +172,7 @@ def send_audio(chat_id, audio_file_id: str, caption: str = "", timeout: int = 5)
     return ok
 
 
-def send_video(chat_id, video_file_id: str, caption: str = "", timeout: int = 5) -> bool:
+def send_video(chat_id, video_file_id: str, caption: str = "", timeout=None) -> bool:
     """Отправка видео по file_id."""
     if not chat_id or not video_file_id:
         return False
@@ -109,7 +181,7 @@ def send_video(chat_id, video_file_id: str, caption: str = "", timeout: int = 5)
     return ok
 
 
-def send_document(chat_id, document_file_id: str, caption: str = "", timeout: int = 5) -> bool:
+def send_document(chat_id, document_file_id: str, caption: str = "", timeout=None) -> bool:
     """Отправка документа по file_id."""
     if not chat_id or not document_file_id:
         return False
@@ -121,7 +193,6 @@ def send_document(chat_id, document_file_id: str, caption: str = "", timeout: in
 def send_photo_bytes(chat_id, image_bytes: bytes, caption: str = "", timeout: int = 60) -> bool:
     if not chat_id or not image_bytes:
         return False
-    url = f"{api_tg_url}/sendPhoto"
     data = {"chat_id": chat_id}
     if caption:
         data["caption"] = caption
@@ -130,7 +201,7 @@ def send_photo_bytes(chat_id, image_bytes: bytes, caption: str = "", timeout: in
     last_exc = None
     for attempt in range(3):
         try:
-            response = requests.post(url, data=data, files=files, timeout=timeout)
+            response = client.post("sendPhoto", data=data, files=files, timeout=timeout)
             result = response.json()
             if result.get("ok"):
                 log_bot_outgoing(chat_id=chat_id, method="sendPhoto")
@@ -147,3 +218,16 @@ def send_photo_bytes(chat_id, image_bytes: bytes, caption: str = "", timeout: in
             )
     logger.error("sendPhoto bytes failed chat_id=%s: %s", chat_id, last_exc)
     return False
+
+
+# Telegram принимает в альбом от 2 до 10 элементов
+MEDIA_GROUP_MAX_ITEMS = 10
+
+
+def input_media(media_type: str, file_id: str, caption: str = "") -> dict:
+    """InputMedia для sendMediaGroup (media_type: photo, video, audio, document)."""
+    item = {"type": media_type, "media": file_id}
+    if caption:
+        item["caption"] = caption
+        item["parse_mode"] = "HTML"
+    return item
@@ -1,12 +1,28 @@
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import quote
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 from unittest.mock import patch
+from pathlib import Path
 import json
+import os
+import tempfile
 
 from .config import START_PHOTO_ID, START_TEXT
-from .models import Message, FileType
+from .models import BotOutgoingMessage, Message, FileType, WebhookUpdate, WebhookInboxUpdate, TelegramBusinessConnection, TelegramOutbox
 from .outbox import process_outbox
+from .payloads import load_message_payload
+from .inbox import claim_inbox_batch, process_inbox, prune_inbox_updates
+from .business_connections import clear_business_connection_cache
+from .chat_summaries import rebuild_chat_summaries
+from .idempotency import acquire_webhook_update, clear_update_window
+from .rate_limit import TelegramRateLimiter, rate_limiter
+from .recent_messages import CachedMessage, RecentMessageCache, recent_messages
 
-TELEGRAM_REQUESTS_PATCH = "webhook_tg.telegram.requests.post"
+TELEGRAM_REQUESTS_PATCH = "webhook_tg.telegram.requests.Session.post"
 
 
 def make_business_message_payload(
@@ -123,10 +139,15 @@ def get_post_call_args(call):
 
 
 class NoTelegramApiTestCase(TestCase):
-    """Базовый класс: мокаем все вызовы к Telegram API (requests.post в webhook_tg.telegram)."""
+    """Базовый класс: мокаем все вызовы к Telegram API (Session.post пула webhook_tg.telegram)."""
 
     def setUp(self):
         super().setUp()
+        clear_business_connection_cache()
+        recent_messages.clear()
+        clear_update_window()
+        rate_limiter.reset()
+        cache.clear()
         self._requests_patcher = patch(TELEGRAM_REQUESTS_PATCH)
         self.mock_post = self._requests_patcher.start()
         # Для get_business_connection: вызывается .json() у ответа
@@ -141,6 +162,13 @@ class NoTelegramApiTestCase(TestCase):
         self._requests_patcher.stop()
         super().tearDown()
 
+    def deliver_outbox(self):
+        """Отправляет всё из outbox, как будто Telegram принял каждое сообщение и лимиты не мешают."""
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {"message_id": 1}}
+        unlimited = TelegramRateLimiter(global_rate=1000, chat_rate=1000, chat_burst=1000)
+        with patch("webhook_tg.outbox.rate_limiter", unlimited):
+            return process_outbox(limit=1000)
+
 
 class WebhookStartTests(NoTelegramApiTestCase):
     """Тесты обработки /start: проверяем URL и JSON, передаваемые в requests.post."""
@@ -149,11 +177,13 @@ class WebhookStartTests(NoTelegramApiTestCase):
         """При /start вызывается requests.post с URL sendPhoto и верным json (chat_id, caption, photo)."""
         chat_id = 900001
         payload = make_start_payload(chat_id=chat_id)
-        response = self.client.post(
-            "/webhook_tg/",
-            data=json.dumps(payload),
-            content_type="application/json",
-        )
+        # Отправка уходит после коммита транзакции апдейта
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/webhook_tg/",
+                data=json.dumps(payload),
+                content_type="application/json",
+            )
         self.assertEqual(response.status_code, 200)
         self.assertTrue(self.mock_post.called, "requests.post должен быть вызван при /start")
 
@@ -217,7 +247,7 @@ class WebhookBusinessMessageTests(NoTelegramApiTestCase):
         self.assertEqual(msg.message_id, message_id)
 
     def test_business_message_saves_payload(self):
-        """При создании business_message в Message записывается payload (исходный dict сообщения)."""
+        """При создании business_message исходный dict сообщения сжатым JSON уходит в MessagePayload."""
         message_id = 100019
         username_from = "payload_user"
         text = "payload test text"
@@ -233,10 +263,8 @@ class WebhookBusinessMessageTests(NoTelegramApiTestCase):
         )
         self.assertEqual(response.status_code, 200)
         msg = Message.objects.get(chat_id=300001, message_id=message_id)
-        self.assertIsNotNone(msg.payload, "payload должен быть записан")
-        self.assertIn(str(message_id), msg.payload)
-        self.assertIn(username_from, msg.payload)
-        self.assertIn(text, msg.payload)
+        self.assertFalse(msg.payload, "В горячей таблице payload больше не хранится")
+        self.assertEqual(load_message_payload(msg), payload["business_message"])
 
     def test_business_message_without_text_uses_default_caption(self):
         """business_message без text (например голосовое) сохраняется с текстом по умолчанию."""
@@ -503,6 +531,8 @@ class WebhookDeletedBusinessMessageTests(NoTelegramApiTestCase):
             content_type="application/json",
         )
         self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.mock_post.call_args_list[1:], "Уведомления уходят через outbox, не из webhook")
+        self.deliver_outbox()
 
         send_message_calls = [
             c for c in self.mock_post.call_args_list
@@ -542,6 +572,8 @@ class WebhookDeletedBusinessMessageTests(NoTelegramApiTestCase):
             content_type="application/json",
         )
         self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.mock_post.call_args_list[1:], "Уведомления уходят через outbox, не из webhook")
+        self.deliver_outbox()
 
         send_message_calls = [
             c for c in self.mock_post.call_args_list
@@ -553,8 +585,8 @@ class WebhookDeletedBusinessMessageTests(NoTelegramApiTestCase):
         self.assertIn("удалил(а)", notification_text)
         self.assertIn("текст не сохранён", notification_text)
 
-    def test_deleted_more_than_20_sends_20_individual_messages_then_summary(self):
-        """Если удалено больше 20 сообщений: 20 отдельных sendMessage и один с текстом «больше 20»."""
+    def test_deleted_more_than_20_sends_one_document_report(self):
+        """Если удалено больше 20 сообщений: вместо отдельных уведомлений — один sendDocument с отчётом."""
         chat_id = 900030
         user_chat_id_notification = 950003
         self.mock_post.return_value.json.return_value = {
@@ -563,32 +595,109 @@ class WebhookDeletedBusinessMessageTests(NoTelegramApiTestCase):
                 "user": {"id": chat_id},
             }
         }
+        Message.objects.create(
+            message_id=600105,
+            chat_id=chat_id,
+            business_connection_id="test_conn_del_001",
+            text="lost text 600105",
+        )
+        Message.objects.create(
+            message_id=600106,
+            chat_id=chat_id,
+            business_connection_id="test_conn_del_001",
+            file_id="lost_photo",
+            file_type=FileType.PHOTO,
+        )
         message_ids = list(range(600100, 600125))
         payload = make_deleted_business_messages_payload(
             message_ids=message_ids,
             chat_id=chat_id,
         )
-        response = self.client.post(
-            "/webhook_tg/",
-            data=json.dumps(payload),
-            content_type="application/json",
-        )
-        self.assertEqual(response.status_code, 200)
-        send_message_calls = [
-            c for c in self.mock_post.call_args_list
-            if get_post_call_args(c)[0] and "sendMessage" in str(get_post_call_args(c)[0])
-        ]
-        self.assertEqual(
-            len(send_message_calls), 21,
-            "Должно быть 20 сообщений об удалённых + 1 сводное",
+        with tempfile.TemporaryDirectory() as reports_dir, \
+                patch("webhook_tg.deleted_messages.DELETED_REPORTS_DIR", Path(reports_dir)):
+            response = self.client.post(
+                "/webhook_tg/",
+                data=json.dumps(payload),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(os.listdir(reports_dir), [], "Во время обработки апдейта файл не создаётся")
+
+            uploaded = {}
+
+            def capture_upload(url, **kwargs):
+                if kwargs.get("files"):
+                    uploaded["data"] = kwargs["data"]
+                    uploaded["content"] = kwargs["files"]["document"][1].read().decode()
+                return self.mock_post.return_value
+
+            self.mock_post.side_effect = capture_upload
+            self.deliver_outbox()
+            self.assertEqual(os.listdir(reports_dir), [], "Файл отчёта удаляется после отправки")
+
+        sent_urls = [str(get_post_call_args(c)[0]) for c in self.mock_post.call_args_list[1:]]
+        self.assertEqual(len(sent_urls), 1)
+        self.assertIn("sendDocument", sent_urls[0])
+        self.assertEqual(uploaded["data"]["chat_id"], user_chat_id_notification)
+        self.assertIn("25", uploaded["data"]["caption"])
+        report_text = uploaded["content"]
+        self.assertIn("удалил(а) 25 сообщений", report_text)
+        self.assertIn("lost text 600105", report_text)
+        self.assertIn("file_id=lost_photo", report_text)
+        self.assertIn("id=600124", report_text)
+
+    def test_failed_report_send_leaves_no_file(self):
+        chat_id = 950004
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 950005, "user": {"id": chat_id}},
+        }
+        payload = make_deleted_business_messages_payload(message_ids=list(range(600200, 600225)), chat_id=chat_id)
+        with tempfile.TemporaryDirectory() as reports_dir, \
+                patch("webhook_tg.deleted_messages.DELETED_REPORTS_DIR", Path(reports_dir)):
+            self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+            self.mock_post.return_value.json.return_value = {"ok": False, "description": "Bad Gateway"}
+            stats = process_outbox()
+            self.assertEqual(os.listdir(reports_dir), [])
+
+        self.assertEqual(stats["failed"], 1)
+        item = TelegramOutbox.objects.get(chat_id=950005)
+        self.assertNotIn("upload", item.payload, "Путь к файлу в очереди не хранится")
+
+    def test_report_build_error_fails_only_its_row(self):
+        from .outbox import enqueue_outbox
+
+        chat_id = 950006
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 950007, "user": {"id": chat_id}},
+        }
+        payload = make_deleted_business_messages_payload(message_ids=list(range(600300, 600325)), chat_id=chat_id)
+        self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+        enqueue_outbox(
+            chat_id=950007,
+            method=TelegramOutbox.Method.SEND_MESSAGE,
+            payload={"text": "после отчёта"},
+            deliver_now=False,
         )
-        for i in range(20):
-            _, body = get_post_call_args(send_message_calls[i])
-            self.assertEqual(body.get("chat_id"), user_chat_id_notification)
-            self.assertIn("удалил(а) сообщение", body.get("text", ""))
-        _, summary_body = get_post_call_args(send_message_calls[20])
-        self.assertIn("больше 20", summary_body.get("text", ""))
-        self.assertIn("25", summary_body.get("text", ""))
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {}}
+
+        with patch("webhook_tg.outbox.write_deleted_report", side_effect=OSError("disk full")):
+            stats = process_outbox()
+
+        self.assertEqual((stats["failed"], stats["sent"]), (1, 1))
+        item = TelegramOutbox.objects.get(chat_id=950007)
+        self.assertEqual(item.attempts, 1)
+        self.assertIn("disk full", item.last_error)
+
+    def test_large_deletion_lookup_is_chunked(self):
+        """Поиск удалённых идёт пачками, а не одним message_id__in на тысячи значений."""
+        from .deleted_messages import iter_deleted_messages
+
+        Message.objects.create(message_id=5, chat_id=900031, business_connection_id="c", text="five")
+        with patch("webhook_tg.deleted_messages.DELETED_LOOKUP_CHUNK_SIZE", 2):
+            with self.assertNumQueries(3):
+                found = list(iter_deleted_messages(900031, "c", [1, 2, 3, 4, 5]))
+        self.assertEqual([mid for mid, _ in found], [1, 2, 3, 4, 5])
+        self.assertEqual(found[4][1].text, "five")
 
 
 class WebhookIdempotencyTests(NoTelegramApiTestCase):
@@ -622,6 +731,51 @@ class WebhookIdempotencyTests(NoTelegramApiTestCase):
         self.assertEqual(msg.text, "first")
         self.assertFalse(self.mock_post.called)
 
+    def test_non_numeric_update_id_is_acknowledged_without_processing(self):
+        payload = make_business_message_payload(message_id=100051, username_from="bad_id_user", text="x")
+        payload["update_id"] = "abc"
+
+        for inbox_mode in (False, True):
+            with patch("webhook_tg.views.WEBHOOK_INBOX_MODE", inbox_mode):
+                response = self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+
+        self.assertFalse(Message.objects.filter(message_id=100051).exists())
+        self.assertFalse(WebhookInboxUpdate.objects.exists())
+        response = self.client.post("/webhook_tg/", data=json.dumps([1, 2]), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+
+
+class WebhookUpdateTransactionTests(NoTelegramApiTestCase):
+    """Апдейт обрабатывается одной транзакцией: либо всё, либо ничего."""
+
+    def test_failed_update_rolls_back_marker_and_message(self):
+        payload = make_business_message_payload(message_id=100060, username_from="tx_user", text="first")
+        payload["update_id"] = 9011
+
+        with patch("webhook_tg.views.report_who_update_event", side_effect=AssertionError("не должен вызываться")):
+            with patch("webhook_tg.write_behind.upsert_message", side_effect=RuntimeError("disk full")):
+                with self.assertRaises(RuntimeError):
+                    self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+
+        self.assertFalse(WebhookUpdate.objects.filter(update_id=9011).exists())
+        self.assertFalse(Message.objects.filter(chat_id=300001, message_id=100060).exists())
+
+        # Повтор того же update_id от Telegram обрабатывается заново
+        self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+        self.assertTrue(Message.objects.filter(chat_id=300001, message_id=100060).exists())
+
+    def test_side_effects_run_only_after_commit(self):
+        payload = make_start_payload(chat_id=900011)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+            self.assertFalse(self.mock_post.called)
+
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.mock_post.called)
+
 
 class WebhookCompositeMessageKeyTests(NoTelegramApiTestCase):
     """message_id уникален внутри chat_id, но может повторяться в разных чатах."""
@@ -661,3 +815,1600 @@ class WebhookCompositeMessageKeyTests(NoTelegramApiTestCase):
         msg_b = Message.objects.get(chat_id=300202, message_id=shared_message_id)
         self.assertEqual(msg_a.text, "chat A")
         self.assertEqual(msg_b.text, "chat B")
+
+
+class WebhookInboxModeTests(NoTelegramApiTestCase):
+    """В режиме inbox webhook только сохраняет апдейт, обработка — в process_inbox."""
+
+    def _post(self, payload):
+        with patch("webhook_tg.views.WEBHOOK_INBOX_MODE", True):
+            return self.client.post(
+                "/webhook_tg/",
+                data=json.dumps(payload),
+                content_type="application/json",
+            )
+
+    def test_webhook_only_stores_update(self):
+        payload = make_business_message_payload(message_id=100060, text="inbox text")
+        payload["update_id"] = 9201
+
+        response = self._post(payload)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookInboxUpdate.objects.filter(update_id=9201).count(), 1)
+        self.assertFalse(Message.objects.filter(message_id=100060).exists())
+        self.assertFalse(self.mock_post.called)
+
+    def test_duplicate_update_id_stored_once(self):
+        payload = make_business_message_payload(message_id=100061, text="first")
+        payload["update_id"] = 9202
+        self._post(payload)
+        payload["business_message"]["text"] = "second attempt"
+        self._post(payload)
+
+        self.assertEqual(WebhookInboxUpdate.objects.filter(update_id=9202).count(), 1)
+        process_inbox()
+        self.assertEqual(Message.objects.get(chat_id=300001, message_id=100061).text, "first")
+
+    def test_process_inbox_runs_handlers_and_marks_processed(self):
+        payload = make_business_message_payload(message_id=100062, text="from worker")
+        payload["update_id"] = 9203
+        self._post(payload)
+
+        stats = process_inbox()
+
+        self.assertEqual(stats["ok"], 1)
+        self.assertEqual(Message.objects.get(chat_id=300001, message_id=100062).text, "from worker")
+        self.assertIsNotNone(WebhookInboxUpdate.objects.get(update_id=9203).processed_at)
+        self.assertEqual(process_inbox()["processed"], 0)
+
+    def test_failed_update_is_retried(self):
+        payload = make_business_message_payload(message_id=100063, text="boom")
+        payload["update_id"] = 9204
+        self._post(payload)
+
+        with patch("webhook_tg.views.create_message", side_effect=RuntimeError("db locked")):
+            stats = process_inbox()
+
+        self.assertEqual(stats["failed"], 1)
+        item = WebhookInboxUpdate.objects.get(update_id=9204)
+        self.assertIsNone(item.processed_at)
+        self.assertEqual(item.attempts, 1)
+        self.assertIn("db locked", item.last_error)
+
+        process_inbox()
+        self.assertTrue(Message.objects.filter(chat_id=300001, message_id=100063).exists())
+
+    def test_leased_update_is_not_taken_by_another_worker(self):
+        payload = make_business_message_payload(message_id=100064, text="leased")
+        payload["update_id"] = 9205
+        self._post(payload)
+
+        claimed = claim_inbox_batch(worker_id="worker-a", limit=10)
+
+        self.assertEqual([item.update_id for item in claimed], [9205])
+        self.assertEqual(claim_inbox_batch(worker_id="worker-b", limit=10), [])
+        self.assertEqual(process_inbox(worker_id="worker-b")["processed"], 0)
+        self.assertFalse(Message.objects.filter(message_id=100064).exists())
+
+    def test_update_with_lost_lease_is_skipped(self):
+        payload = make_business_message_payload(message_id=100065, text="stolen")
+        payload["update_id"] = 9206
+        self._post(payload)
+
+        def steal(*args, **kwargs):
+            WebhookInboxUpdate.objects.filter(update_id=9206).update(locked_by="worker-b")
+
+        with patch("webhook_tg.views.prepare_update", side_effect=steal):
+            stats = process_inbox(worker_id="worker-a")
+
+        self.assertEqual(stats["skipped"], 1)
+        self.assertIsNone(WebhookInboxUpdate.objects.get(update_id=9206).processed_at)
+        self.assertFalse(Message.objects.filter(message_id=100065).exists())
+
+    def test_pending_count_is_optional(self):
+        self.assertIsNone(process_inbox()["pending"])
+        self.assertEqual(process_inbox(count_pending=True)["pending"], 0)
+
+    def test_prune_removes_old_processed_updates(self):
+        old = WebhookInboxUpdate.objects.create(
+            update_id=9207, payload={}, processed_at=timezone.now() - timedelta(days=30)
+        )
+        fresh = WebhookInboxUpdate.objects.create(update_id=9208, payload={}, processed_at=timezone.now())
+        pending = WebhookInboxUpdate.objects.create(update_id=9209, payload={})
+
+        self.assertEqual(prune_inbox_updates(keep_days=7, batch_size=1), 1)
+        self.assertEqual(
+            set(WebhookInboxUpdate.objects.values_list("pk", flat=True)), {fresh.pk, pending.pk}
+        )
+        self.assertFalse(WebhookInboxUpdate.objects.filter(pk=old.pk).exists())
+
+
+class BusinessConnectionCacheTests(NoTelegramApiTestCase):
+    """Подключения берутся из апдейтов business_connection и кэша, а не из getBusinessConnection."""
+
+    def _post(self, payload):
+        return self.client.post(
+            "/webhook_tg/",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def _business_connection_calls(self):
+        return [
+            c for c in self.mock_post.call_args_list
+            if "getBusinessConnection" in str(get_post_call_args(c)[0])
+        ]
+
+    def test_business_connection_update_is_stored_and_used(self):
+        self._post({
+            "update_id": 9301,
+            "business_connection": {
+                "id": "test_conn_del_001",
+                "user": {"id": 910001, "username": "owner"},
+                "user_chat_id": 910001,
+                "date": 1000000,
+                "is_enabled": True,
+            },
+        })
+        self.assertTrue(TelegramBusinessConnection.objects.filter(connection_id="test_conn_del_001").exists())
+
+        clear_business_connection_cache()
+        payload = make_deleted_business_messages_payload(message_ids=[600301], chat_id=900301)
+        payload["update_id"] = 9302
+        self._post(payload)
+        self.deliver_outbox()
+
+        self.assertEqual(self._business_connection_calls(), [])
+        send_calls = [c for c in self.mock_post.call_args_list if "sendMessage" in str(get_post_call_args(c)[0])]
+        self.assertEqual(get_post_call_args(send_calls[0])[1].get("chat_id"), 910001)
+
+    def test_cold_miss_calls_api_once(self):
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 920001, "user": {"id": 920001}},
+        }
+        for update_id, message_id in ((9311, 600311), (9312, 600312)):
+            payload = make_deleted_business_messages_payload(message_ids=[message_id], chat_id=900311)
+            payload["update_id"] = update_id
+            self._post(payload)
+
+        self.assertEqual(len(self._business_connection_calls()), 1)
+        row = TelegramBusinessConnection.objects.get(connection_id="test_conn_del_001")
+        self.assertEqual(row.user_chat_id, 920001)
+
+    def test_connection_is_fetched_before_the_update_transaction(self):
+        from .views import handle_update, prepare_update
+
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 920011, "user": {"id": 920011}},
+        }
+        payload = make_deleted_business_messages_payload(message_ids=[600321], chat_id=900321)
+
+        handle_update(payload)
+        self.assertEqual(self._business_connection_calls(), [], "Внутри транзакции апдейта Telegram не вызывается")
+
+        prepare_update(payload)
+        self.assertEqual(len(self._business_connection_calls()), 1)
+
+    def test_disabled_connection_is_cached_and_skipped(self):
+        TelegramBusinessConnection.objects.create(
+            connection_id="test_conn_del_001", user_id=920021, user_chat_id=920021, is_enabled=False,
+        )
+        for update_id, message_id in ((9331, 600331), (9332, 600332)):
+            payload = make_deleted_business_messages_payload(message_ids=[message_id], chat_id=900331)
+            payload["update_id"] = update_id
+            self._post(payload)
+        self.deliver_outbox()
+
+        self.assertEqual(self._business_connection_calls(), [], "Отключённое подключение не перезапрашивается")
+        self.assertFalse(
+            [c for c in self.mock_post.call_args_list if "sendMessage" in str(get_post_call_args(c)[0])],
+            "Уведомления по отключённому подключению не отправляются",
+        )
+
+    def test_unknown_connection_is_cached_until_business_connection_update(self):
+        self.mock_post.return_value.json.return_value = {"ok": False, "description": "Bad Request"}
+        for update_id, message_id in ((9341, 600341), (9342, 600342)):
+            payload = make_deleted_business_messages_payload(message_ids=[message_id], chat_id=900341)
+            payload["update_id"] = update_id
+            self._post(payload)
+        self.assertEqual(len(self._business_connection_calls()), 1, "Отрицательный ответ кэшируется")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._post({
+                "update_id": 9343,
+                "business_connection": {
+                    "id": "test_conn_del_001",
+                    "user": {"id": 920041},
+                    "user_chat_id": 920041,
+                    "date": 1000000,
+                    "is_enabled": True,
+                },
+            })
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {}}
+        payload = make_deleted_business_messages_payload(message_ids=[600343], chat_id=900341)
+        payload["update_id"] = 9344
+        self._post(payload)
+        self.deliver_outbox()
+
+        send_calls = [c for c in self.mock_post.call_args_list if "sendMessage" in str(get_post_call_args(c)[0])]
+        self.assertEqual([get_post_call_args(c)[1].get("chat_id") for c in send_calls], [920041])
+
+
+class TelegramClientTests(NoTelegramApiTestCase):
+    """Запросы идут через общий пул соединений с таймаутами по методам."""
+
+    def test_per_method_timeouts(self):
+        from .config import TELEGRAM_METHOD_TIMEOUTS
+        from .telegram import tg_send_message
+
+        tg_send_message(900401, "hello")
+        tg_send_message(900401, "hello", timeout=1)
+
+        first, second = self.mock_post.call_args_list
+        self.assertEqual(first[1]["timeout"], TELEGRAM_METHOD_TIMEOUTS["sendMessage"])
+        self.assertEqual(second[1]["timeout"], 1)
+
+    def test_session_is_reused_per_thread(self):
+        from .telegram import client
+
+        self.assertIs(client._sessions.session(), client._sessions.session())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TelegramRateLimiterTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = TelegramRateLimiter(
+            global_rate=2,
+            chat_rate=1,
+            chat_burst=1,
+            group_rate_per_minute=20,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+        )
+
+    def test_per_chat_budget_defers_second_message(self):
+        self.assertEqual(self.limiter.acquire(1, max_wait=0.1), 0)
+        self.assertAlmostEqual(self.limiter.acquire(1, max_wait=0.1), 1.0)
+        self.assertEqual(self.limiter.acquire(2, max_wait=0.1), 0)
+
+    def test_global_budget_waits_instead_of_deferring(self):
+        for chat_id in (1, 2, 3):
+            self.assertEqual(self.limiter.acquire(chat_id, max_wait=0.1), 0)
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+    def test_retry_after_pauses_only_that_chat(self):
+        self.limiter.pause_chat(1, 7)
+        self.assertAlmostEqual(self.limiter.acquire(1), 7.0)
+        self.assertEqual(self.limiter.acquire(2), 0)
+        self.clock.now += 7
+        self.assertEqual(self.limiter.acquire(1), 0)
+
+    def test_idle_buckets_and_expired_pauses_are_evicted(self):
+        limiter = TelegramRateLimiter(
+            chat_rate=1,
+            chat_burst=1,
+            sweep_seconds=60,
+            max_chats=3,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+        )
+        for chat_id in (1, 2, 3):
+            limiter.acquire(chat_id, max_wait=0)
+        limiter.pause_chat(4, 5)
+        self.assertEqual(len(limiter._chats) + len(limiter._paused_until), 4)
+
+        self.clock.now += 10
+        limiter.acquire(5, max_wait=0)
+
+        self.assertEqual(set(limiter._chats), {5}, "Полные бакеты удалены, бакет текущего чата создан заново")
+        self.assertEqual(limiter._paused_until, {})
+
+    def test_active_buckets_survive_sweep(self):
+        self.limiter.acquire(1, max_wait=0)
+        self.limiter.acquire(2, max_wait=0)
+        self.clock.now += 61
+        self.limiter.acquire(2, max_wait=0)
+        self.clock.now += 0.5
+        self.limiter._next_sweep_at = self.clock.now
+        self.limiter.acquire(3, max_wait=0)
+
+        self.assertNotIn(1, self.limiter._chats)
+        self.assertIn(2, self.limiter._chats)
+        self.assertAlmostEqual(self.limiter.acquire(2, max_wait=0), 0.5)
+
+    def test_budget_is_split_between_processes(self):
+        limiter = TelegramRateLimiter(
+            global_rate=30,
+            chat_rate=1,
+            chat_burst=3,
+            processes=3,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+        )
+
+        self.assertEqual(limiter.global_rate, 10)
+        self.assertAlmostEqual(limiter.chat_rate, 1 / 3)
+        self.assertEqual(limiter.acquire(1, max_wait=0), 0)
+        self.assertAlmostEqual(limiter.acquire(1, max_wait=0), 3.0)
+
+
+class OutboxRateLimitTests(NoTelegramApiTestCase):
+    def _enqueue(self, chat_id, text):
+        from .outbox import enqueue_outbox
+
+        enqueue_outbox(
+            chat_id=chat_id,
+            method=TelegramOutbox.Method.SEND_MESSAGE,
+            payload={"text": text},
+        )
+
+    def test_429_pauses_chat_for_retry_after_without_backoff(self):
+        self._enqueue(900501, "throttled")
+        self.mock_post.return_value.json.return_value = {
+            "ok": False,
+            "error_code": 429,
+            "description": "Too Many Requests: retry after 12",
+            "parameters": {"retry_after": 12},
+        }
+
+        stats = process_outbox()
+
+        self.assertEqual(stats["deferred"], 1)
+        item = TelegramOutbox.objects.get(chat_id=900501)
+        self.assertEqual(item.attempts, 0)
+        delay = (item.next_attempt_at - item.created_at).total_seconds()
+        self.assertGreater(delay, 10)
+        self.assertLess(delay, 14)
+
+    def test_burst_to_one_chat_is_spread_out(self):
+        for i in range(5):
+            self._enqueue(900502, f"message {i}")
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {}}
+
+        with patch("webhook_tg.outbox.OUTBOX_MAX_RATE_WAIT_SECONDS", 0):
+            stats = process_outbox()
+
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["deferred"], 2)
+        self.assertEqual(TelegramOutbox.objects.filter(chat_id=900502).count(), 2)
+
+
+class OutboxLeaseTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        from .outbox import enqueue_outbox
+
+        for i in range(4):
+            enqueue_outbox(
+                chat_id=900600 + i,
+                method=TelegramOutbox.Method.SEND_MESSAGE,
+                payload={"text": f"lease {i}"},
+            )
+
+    def test_workers_do_not_claim_same_rows(self):
+        from .outbox import claim_outbox_batch
+
+        first = claim_outbox_batch(worker_id="worker-a", limit=3)
+        second = claim_outbox_batch(worker_id="worker-b", limit=3)
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({item.pk for item in first} & {item.pk for item in second})
+
+    def test_expired_lease_is_reclaimed(self):
+        from django.utils import timezone
+        from .outbox import claim_outbox_batch
+
+        claimed = claim_outbox_batch(worker_id="crashed", limit=4)
+        self.assertEqual(claim_outbox_batch(worker_id="worker-b", limit=4), [])
+
+        TelegramOutbox.objects.filter(pk__in=[item.pk for item in claimed]).update(locked_until=timezone.now())
+        self.assertEqual(len(claim_outbox_batch(worker_id="worker-b", limit=4)), 4)
+
+    def test_failed_send_releases_lease(self):
+        self.mock_post.return_value.json.return_value = {"ok": False, "description": "Bad Gateway"}
+
+        stats = process_outbox(worker_id="worker-a")
+
+        self.assertEqual(stats["claimed"], 4)
+        self.assertEqual(stats["failed"], 4)
+        self.assertFalse(TelegramOutbox.objects.exclude(locked_by="").exists())
+        self.assertFalse(TelegramOutbox.objects.filter(locked_until__isnull=False).exists())
+
+    def test_result_is_not_written_after_lease_is_lost(self):
+        from .outbox import _finalize, _empty_stats, claim_outbox_batch
+
+        item = claim_outbox_batch(worker_id="worker-a", limit=1)[0]
+        TelegramOutbox.objects.filter(pk=item.pk).update(locked_by="worker-b")
+        stats = _empty_stats()
+
+        _finalize(item, True, "", 0.0, stats)
+        _finalize(item, False, "Bad Gateway", 0.0, stats)
+
+        self.assertEqual(stats["lost"], 2)
+        self.assertEqual(stats["sent"], 0)
+        row = TelegramOutbox.objects.get(pk=item.pk)
+        self.assertEqual((row.locked_by, row.attempts), ("worker-b", 0))
+
+    def test_pending_count_is_optional(self):
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {}}
+        TelegramOutbox.objects.filter(chat_id=900603).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(process_outbox(limit=0)["pending"])
+        self.assertEqual(process_outbox(limit=1, count_pending=True)["pending"], 2)
+
+
+class OutboxInlineDeliveryTests(NoTelegramApiTestCase):
+    def _enqueue(self, **kwargs):
+        from .outbox import enqueue_outbox
+
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_outbox(
+                chat_id=900701,
+                method=TelegramOutbox.Method.SEND_MESSAGE,
+                payload={"text": "fast path"},
+                **kwargs,
+            )
+
+    def test_sent_right_after_commit(self):
+        self.mock_post.return_value.json.return_value = {"ok": True, "result": {}}
+
+        self._enqueue(deliver_now=True)
+
+        self.assertEqual(len(self.mock_post.call_args_list), 1)
+        self.assertFalse(TelegramOutbox.objects.exists())
+
+    @patch("webhook_tg.outbox.notify_outbox_worker")
+    def test_failure_keeps_row_for_worker(self, mock_notify):
+        self.mock_post.return_value.json.return_value = {"ok": False, "description": "Bad Gateway"}
+
+        self._enqueue(deliver_now=True)
+
+        item = TelegramOutbox.objects.get(chat_id=900701)
+        self.assertEqual(item.attempts, 0)
+        self.assertEqual(item.locked_by, "")
+        self.assertIn("Bad Gateway", item.last_error)
+        mock_notify.assert_called_once()
+
+    @patch("webhook_tg.outbox.notify_outbox_worker")
+    def test_without_inline_only_wakes_worker(self, mock_notify):
+        self._enqueue(deliver_now=False)
+
+        self.assertFalse(self.mock_post.called)
+        self.assertTrue(TelegramOutbox.objects.filter(chat_id=900701).exists())
+        mock_notify.assert_called_once()
+
+    @patch("webhook_tg.outbox.notify_outbox_worker")
+    def test_default_leaves_delivery_to_worker(self, mock_notify):
+        self._enqueue()
+
+        self.assertFalse(self.mock_post.called, "Поток запроса webhook не ждёт Telegram")
+        mock_notify.assert_called_once()
+
+
+class WakeupTests(TestCase):
+    def test_listener_is_woken_by_notify(self):
+        from .wakeup import WakeupListener
+
+        listener = WakeupListener(("127.0.0.1", 0))
+        try:
+            address = listener._sock.getsockname()
+            with patch("webhook_tg.wakeup.WAKEUP_ADDRESS", address):
+                from .wakeup import notify_outbox_worker
+
+                notify_outbox_worker()
+            self.assertTrue(listener.wait(1.0))
+            self.assertFalse(listener.wait(0.01))
+        finally:
+            listener.close()
+
+
+class DeletedNotificationOutboxTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 950801, "user": {"id": 950801}},
+        }
+
+    def _post(self, payload):
+        return self.client.post(
+            "/webhook_tg/",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_redelivered_deletion_is_not_notified_twice(self):
+        payload = make_deleted_business_messages_payload(message_ids=[600801, 600802], chat_id=900801)
+        payload["update_id"] = 9801
+        self._post(payload)
+        # Тот же набор удалений в другом апдейте (например, после очистки WebhookUpdate)
+        payload["update_id"] = 9802
+        self._post(payload)
+
+        self.assertEqual(TelegramOutbox.objects.filter(chat_id=950801).count(), 2)
+
+    def test_deleted_photo_is_enqueued_as_send_photo(self):
+        Message.objects.create(
+            message_id=600803,
+            chat_id=900802,
+            business_connection_id="test_conn_del_001",
+            text="",
+            file_id="photo_deleted",
+            file_type=FileType.PHOTO,
+        )
+        payload = make_deleted_business_messages_payload(message_ids=[600803], chat_id=900802)
+        payload["update_id"] = 9803
+        self._post(payload)
+
+        item = TelegramOutbox.objects.get(chat_id=950801)
+        self.assertEqual(item.method, TelegramOutbox.Method.SEND_PHOTO)
+        self.assertEqual(item.payload["photo"], "photo_deleted")
+        self.assertIn("удалил(а) сообщение", item.payload["caption"])
+
+
+class DeletedMediaAlbumTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 950901, "user": {"id": 950901}},
+        }
+
+    def _delete(self, message_ids, chat_id):
+        payload = make_deleted_business_messages_payload(message_ids=message_ids, chat_id=chat_id)
+        self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+
+    def _create(self, message_id, chat_id, file_type, file_id=None, text=""):
+        Message.objects.create(
+            message_id=message_id,
+            chat_id=chat_id,
+            business_connection_id="test_conn_del_001",
+            text=text,
+            file_id=file_id,
+            file_type=file_type,
+        )
+
+    def test_photos_and_videos_are_grouped_into_album(self):
+        self._create(1, 900901, FileType.PHOTO, "photo_1")
+        self._create(2, 900901, FileType.VIDEO, "video_2")
+        self._create(3, 900901, FileType.UNKNOWN, text="plain text")
+        self._create(4, 900901, FileType.PHOTO, "photo_4")
+
+        self._delete([1, 2, 3, 4], 900901)
+
+        self.assertEqual(TelegramOutbox.objects.count(), 2)
+        album = TelegramOutbox.objects.get(method=TelegramOutbox.Method.SEND_MEDIA_GROUP)
+        self.assertEqual(
+            [(item["type"], item["media"]) for item in album.payload["media"]],
+            [("photo", "photo_1"), ("video", "video_2"), ("photo", "photo_4")],
+        )
+        self.assertIn("id=2", album.payload["media"][1]["caption"])
+        self.assertTrue(TelegramOutbox.objects.filter(method=TelegramOutbox.Method.SEND_MESSAGE).exists())
+
+        self.deliver_outbox()
+        urls = [str(get_post_call_args(c)[0]) for c in self.mock_post.call_args_list]
+        self.assertEqual(sum("sendMediaGroup" in url for url in urls), 1)
+
+    def test_albums_are_split_by_ten_and_single_item_sent_alone(self):
+        for mid in range(1, 12):
+            self._create(mid, 900902, FileType.PHOTO, f"photo_{mid}")
+
+        with patch("webhook_tg.views.DELETED_DOCUMENT_THRESHOLD", 50):
+            self._delete(list(range(1, 12)), 900902)
+
+        album = TelegramOutbox.objects.get(method=TelegramOutbox.Method.SEND_MEDIA_GROUP)
+        self.assertEqual(len(album.payload["media"]), 10)
+        single = TelegramOutbox.objects.get(method=TelegramOutbox.Method.SEND_PHOTO)
+        self.assertEqual(single.payload["photo"], "photo_11")
+
+
+@patch("webhook_tg.views.EDIT_COALESCE_WINDOW_SECONDS", 5)
+class EditCoalescingTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 951001, "user": {"id": 951001}},
+        }
+        Message.objects.create(
+            message_id=401001,
+            chat_id=501001,
+            username_from="typo_user",
+            text="helo wrld",
+            business_connection_id="test_conn_edit_001",
+        )
+
+    def _edit(self, update_id, text, edit_date):
+        payload = make_edited_business_message_payload(
+            message_id=401001,
+            username_from="typo_user",
+            new_text=text,
+            chat_id=501001,
+            user_id=601001,
+        )
+        payload["update_id"] = update_id
+        payload["edited_business_message"]["edit_date"] = edit_date
+        self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+
+    def test_rapid_edits_merge_into_one_notification(self):
+        self._edit(9401, "hello wrld", 2000001)
+        self._edit(9402, "hello world", 2000002)
+        self._edit(9403, "hello world!", 2000003)
+
+        item = TelegramOutbox.objects.get()
+        self.assertEqual(item.meta["edits"], 3)
+        self.assertIn("helo wrld", item.payload["text"])
+        self.assertIn("hello world!", item.payload["text"])
+        self.assertIn("правок: 3", item.payload["text"])
+
+        self.assertEqual(self.deliver_outbox()["sent"], 0, "До конца окна уведомление не отправляется")
+        TelegramOutbox.objects.update(next_attempt_at=item.created_at)
+        self.assertEqual(self.deliver_outbox()["sent"], 1)
+
+    def test_edit_while_previous_is_sending_gets_own_row(self):
+        self._edit(9411, "hello wrld", 2000001)
+        TelegramOutbox.objects.update(locked_by="worker-a", locked_until=timezone.now() + timedelta(seconds=60))
+        self._edit(9412, "hello world", 2000002)
+
+        self.assertEqual(TelegramOutbox.objects.count(), 2)
+
+    def test_later_edits_merge_into_row_started_while_sending(self):
+        self._edit(9431, "hello wrld", 2000001)
+        TelegramOutbox.objects.update(locked_by="worker-a", locked_until=timezone.now() + timedelta(seconds=60))
+        self._edit(9432, "hello world", 2000002)
+        self._edit(9433, "hello world!", 2000003)
+
+        self.assertEqual(TelegramOutbox.objects.count(), 2)
+        fresh = TelegramOutbox.objects.get(locked_by="")
+        self.assertEqual(fresh.meta["edits"], 2)
+        self.assertIn("hello world!", fresh.payload["text"])
+
+    def test_concurrent_first_edits_are_merged_not_dropped(self):
+        from . import views
+
+        self._edit(9441, "hello wrld", 2000001)
+        # Вторая правка не видит строку первой (параллельная транзакция), её INSERT упирается в dedup_key
+        real_pending_edit = views._pending_edit
+        calls = []
+
+        def pending_edit(key):
+            calls.append(key)
+            return None if len(calls) == 1 else real_pending_edit(key)
+
+        with patch("webhook_tg.views._pending_edit", side_effect=pending_edit):
+            self._edit(9442, "hello world", 2000002)
+
+        item = TelegramOutbox.objects.get()
+        self.assertEqual(item.meta["edits"], 2)
+        self.assertIn("hello world", item.payload["text"])
+        self.assertEqual(len(calls), 2)
+
+    def test_edit_after_expired_lease_merges_and_releases_row(self):
+        self._edit(9421, "hello wrld", 2000001)
+        TelegramOutbox.objects.update(locked_by="worker-a", locked_until=timezone.now() - timedelta(seconds=1))
+        self._edit(9422, "hello world", 2000002)
+
+        item = TelegramOutbox.objects.get()
+        self.assertEqual(item.meta["edits"], 2)
+        self.assertIn("hello world", item.payload["text"])
+        self.assertEqual((item.locked_by, item.locked_until), ("", None))
+
+
+class UpsertMessageTests(TestCase):
+    def test_insert_returns_none_and_update_returns_previous(self):
+        from .message_store import upsert_message
+
+        self.assertIsNone(upsert_message(chat_id=501101, message_id=1, text="first", file_type=FileType.UNKNOWN))
+        created_at = Message.objects.get(chat_id=501101, message_id=1).created_at
+
+        previous = upsert_message(
+            chat_id=501101,
+            message_id=1,
+            text="second",
+            caption="cap",
+            file_id="photo_1",
+            file_type=FileType.PHOTO,
+        )
+
+        self.assertEqual(
+            previous,
+            {"text": "first", "caption": None, "file_id": None, "file_type": FileType.UNKNOWN},
+        )
+        msg = Message.objects.get(chat_id=501101, message_id=1)
+        self.assertEqual((msg.text, msg.file_id, msg.file_type), ("second", "photo_1", FileType.PHOTO))
+        self.assertEqual(msg.created_at, created_at, "created_at не перезаписывается при обновлении")
+
+    def test_edit_update_uses_two_statements(self):
+        from .message_store import upsert_message
+
+        upsert_message(chat_id=501102, message_id=1, text="first", file_type=FileType.UNKNOWN)
+        # SELECT прежней версии + INSERT … ON CONFLICT (+ SAVEPOINT/RELEASE вокруг них) + UPDATE сводки чата
+        with self.assertNumQueries(5):
+            upsert_message(chat_id=501102, message_id=1, text="second", file_type=FileType.UNKNOWN)
+
+
+@patch("webhook_tg.write_behind.WriteBehindQueue._ensure_thread")
+class WriteBehindTests(NoTelegramApiTestCase):
+    def test_batch_keeps_last_version_of_message(self, _thread):
+        from .write_behind import WriteBehindQueue
+
+        queue = WriteBehindQueue()
+        queue.submit_message({"chat_id": 502001, "message_id": 1, "text": "draft"})
+        queue.submit_message({"chat_id": 502001, "message_id": 1, "text": "final"})
+        queue.submit_outgoing({"chat_id": 502001, "method": "sendMessage"})
+        self.assertFalse(Message.objects.filter(chat_id=502001).exists())
+
+        with self.assertNumQueries(5):  # SAVEPOINT, INSERT сообщений, bulk_create журнала, сводка чата, RELEASE
+            self.assertEqual(queue.flush(), 2)
+
+        self.assertEqual(Message.objects.get(chat_id=502001, message_id=1).text, "final")
+        self.assertTrue(BotOutgoingMessage.objects.filter(chat_id=502001, method="sendMessage").exists())
+
+    def test_batch_does_not_overwrite_row_edited_by_another_process(self, _thread):
+        from .message_store import upsert_message
+        from .models import ChatSummary
+        from .write_behind import WriteBehindQueue
+
+        queue = WriteBehindQueue()
+        queue.submit_message({"chat_id": 502003, "message_id": 1, "text": "original"})
+        queue.submit_message({"chat_id": 502003, "message_id": 2, "text": "второе"})
+        # Другой процесс уже записал сообщение и его правку
+        upsert_message(chat_id=502003, message_id=1, text="original")
+        upsert_message(chat_id=502003, message_id=1, text="edited")
+
+        self.assertEqual(queue.flush(), 2)
+
+        self.assertEqual(Message.objects.get(chat_id=502003, message_id=1).text, "edited")
+        self.assertEqual(Message.objects.get(chat_id=502003, message_id=2).text, "второе")
+        self.assertEqual(ChatSummary.objects.get(chat_id=502003).message_count, 2)
+
+    def test_full_queue_writes_synchronously(self, _thread):
+        from .write_behind import WriteBehindQueue
+
+        queue = WriteBehindQueue(max_pending=1)
+        queue.submit_message({"chat_id": 502002, "message_id": 1, "text": "old"})
+        queue.submit_message({"chat_id": 502002, "message_id": 1, "text": "new"})
+
+        self.assertEqual(Message.objects.get(chat_id=502002, message_id=1).text, "new")
+        self.assertEqual(queue.flush(), 0)
+
+    @patch("webhook_tg.write_behind.WRITE_BEHIND_ENABLED", True)
+    def test_edit_flushes_queued_message_first(self, _thread):
+        from .write_behind import message_writer
+
+        payload = make_business_message_payload(message_id=100070, text="original")
+        payload["update_id"] = 9021
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+        self.assertFalse(Message.objects.filter(chat_id=300001, message_id=100070).exists())
+
+        self.mock_post.return_value.json.return_value = {"result": {"user_chat_id": 951002, "user": {"id": 951002}}}
+        edit = make_edited_business_message_payload(message_id=100070, new_text="changed", chat_id=300001)
+        edit["update_id"] = 9022
+        self.client.post("/webhook_tg/", data=json.dumps(edit), content_type="application/json")
+
+        self.assertEqual(Message.objects.get(chat_id=300001, message_id=100070).text, "changed")
+        self.assertIn("original", TelegramOutbox.objects.get().payload["text"])
+        self.assertEqual(message_writer.flush(), 0)
+
+
+class RecentMessageCacheTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        # Режим одного пишущего процесса: кэш включён
+        patcher = patch.object(recent_messages, "max_bytes", 1024 * 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_cache_stores_nothing(self):
+        disabled = RecentMessageCache(max_bytes=0)
+        disabled.put(1, 1, self._entry("a"))
+        self.assertIsNone(disabled.get(1, 1))
+        self.assertEqual(disabled.get_many(1, [1]), {})
+
+    def _entry(self, text, business_connection_id="test_conn_del_001"):
+        return CachedMessage(business_connection_id, text, None, None, FileType.UNKNOWN, timezone.now())
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        from .recent_messages import _entry_size
+
+        cache = RecentMessageCache(max_bytes=2 * _entry_size(self._entry("a" * 100)))
+        cache.put(1, 1, self._entry("a" * 100))
+        cache.put(1, 2, self._entry("b" * 100))
+        self.assertIsNotNone(cache.get(1, 1))
+        cache.put(1, 3, self._entry("c" * 100))
+
+        self.assertIsNone(cache.get(1, 2))
+        self.assertIsNotNone(cache.get(1, 1))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"], stats["evictions"]), (2, 2, 1, 1))
+        self.assertLessEqual(stats["bytes"], cache.max_bytes)
+
+    def test_committed_upsert_populates_cache_and_edit_skips_select(self):
+        from .message_store import upsert_message
+
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_message(chat_id=502101, message_id=1, text="first", file_type=FileType.UNKNOWN)
+        self.assertEqual(recent_messages.get(502101, 1).text, "first")
+
+        # Без SELECT: только INSERT … ON CONFLICT и UPDATE сводки чата
+        with self.assertNumQueries(2):
+            previous = upsert_message(chat_id=502101, message_id=1, text="second", file_type=FileType.UNKNOWN)
+        self.assertEqual(previous["text"], "first")
+
+    def test_deleted_lookup_reads_cache_before_db(self):
+        from .deleted_messages import iter_deleted_messages
+
+        recent_messages.put(900001, 1, self._entry("из кэша"))
+        recent_messages.put(900001, 2, self._entry("чужое подключение", business_connection_id="other"))
+        Message.objects.create(
+            chat_id=900001, message_id=2, text="из БД", business_connection_id="test_conn_del_001",
+        )
+
+        with self.assertNumQueries(1):
+            found = dict(iter_deleted_messages(900001, "test_conn_del_001", [1, 2, 3]))
+
+        self.assertEqual(found[1].text, "из кэша")
+        self.assertEqual(found[2].text, "из БД")
+        self.assertIsNone(found[3])
+
+
+class WebhookUpdateWindowTests(NoTelegramApiTestCase):
+    def _acquire(self, update_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return acquire_webhook_update(update_id)
+
+    def test_duplicates_and_old_ids_rejected_in_process_without_db(self):
+        self.assertTrue(self._acquire(50000))
+        self.assertTrue(self._acquire(49990), "Небольшое опоздание внутри окна допустимо")
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self._acquire(50000))
+            self.assertFalse(self._acquire(50000 - 1000))
+
+    def test_db_watermark_rejects_ids_below_window(self):
+        WebhookUpdate.objects.create(update_id=60000)
+
+        self.assertFalse(self._acquire(59000))
+        self.assertTrue(self._acquire(59001))
+        self.assertFalse(WebhookUpdate.objects.filter(update_id=59000).exists())
+
+    def test_old_watermark_ignored_after_update_id_reset(self):
+        WebhookUpdate.objects.create(update_id=70000)
+        WebhookUpdate.objects.update(processed_at=timezone.now() - timedelta(days=8))
+
+        self.assertTrue(self._acquire(100))
+
+    def test_prune_removes_rows_below_window_in_batches(self):
+        from django.core.management import call_command
+
+        WebhookUpdate.objects.bulk_create(WebhookUpdate(update_id=i) for i in range(80000, 82001))
+        old = WebhookUpdate.objects.create(update_id=90000)
+        WebhookUpdate.objects.filter(pk=old.pk).update(processed_at=timezone.now() - timedelta(days=8))
+
+        call_command("prune_webhook_updates", "--batch-size", "300", stdout=StringIO())
+
+        remaining = WebhookUpdate.objects.values_list("update_id", flat=True)
+        self.assertEqual((min(remaining), max(remaining), len(remaining)), (81001, 82000, 1000))
+        self.assertFalse(self._acquire(81000), "Удалённые id по-прежнему отбрасываются")
+
+
+class MessagePayloadConversionTests(TestCase):
+    def test_legacy_repr_payloads_converted_in_resumable_batches(self):
+        from django.core.management import call_command
+        from .models import MessagePayload
+
+        raw = {"message_id": 1, "text": "привет", "from": {"is_bot": False}, "photo": None}
+        for message_id in range(1, 6):
+            Message.objects.create(chat_id=503001, message_id=message_id, payload=str({**raw, "message_id": message_id}))
+        broken = Message.objects.create(chat_id=503001, message_id=6, payload="{'text': 'обрезан")
+
+        out = StringIO()
+        call_command("convert_message_payloads", "--batch-size", "2", stdout=out)
+        self.assertIn("converted=6", out.getvalue())
+
+        self.assertFalse(Message.objects.exclude(payload="").exists())
+        self.assertEqual(MessagePayload.objects.count(), 6)
+        first = Message.objects.get(chat_id=503001, message_id=1)
+        self.assertEqual(load_message_payload(first), raw)
+        self.assertEqual(load_message_payload(broken), "{'text': 'обрезан")
+
+        out = StringIO()
+        call_command("convert_message_payloads", stdout=out)
+        self.assertIn("converted=0", out.getvalue())
+
+    def test_payload_compressed_smaller_than_repr(self):
+        from .payloads import decode_payload, encode_payload
+
+        payload = make_business_message_payload(text="текст " * 50)["business_message"]
+        data = encode_payload(payload)
+        self.assertLess(len(data), len(str(payload).encode()) // 2)
+        self.assertEqual(decode_payload(data), payload)
+
+
+class MessageArchiveTests(NoTelegramApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        for patcher in (
+            patch("webhook_tg.archive.MESSAGE_ARCHIVE_DIR", Path(self._tmp.name)),
+            patch("webhook_tg.archive.BLOCK_RECORDS", 2),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _message(self, message_id, text, days_ago, chat_id=900001):
+        from .message_store import upsert_message
+
+        upsert_message(
+            chat_id=chat_id,
+            message_id=message_id,
+            business_connection_id="test_conn_del_001",
+            text=text,
+            file_type=FileType.UNKNOWN,
+            payload={"message_id": message_id, "text": text},
+        )
+        Message.objects.filter(chat_id=chat_id, message_id=message_id).update(
+            created_at=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_old_messages_moved_to_segments_and_found_on_delete(self):
+        from django.core.management import call_command
+        from .archive import message_archive
+        from .deleted_messages import iter_deleted_messages
+        from .models import MessagePayload
+
+        for message_id in range(1, 6):
+            self._message(message_id, f"старое {message_id}", days_ago=400)
+        self._message(6, "чуть новее", days_ago=300)
+        self._message(7, "свежее", days_ago=1)
+        self._message(1, "другой чат", days_ago=400, chat_id=900002)
+
+        out = StringIO()
+        call_command("archive_messages", "--older-than-days", "200", "--segment-size", "4", stdout=out)
+        self.assertIn("archived=7", out.getvalue())
+
+        self.assertEqual(list(Message.objects.values_list("message_id", flat=True)), [7])
+        self.assertEqual(MessagePayload.objects.count(), 1)
+        self.assertGreaterEqual(len(list(Path(self._tmp.name).glob("*/*.idx"))), 3)
+
+        found = dict(iter_deleted_messages(900001, "test_conn_del_001", [1, 4, 6, 7, 99]))
+        self.assertEqual(found[1].text, "старое 1")
+        self.assertEqual(found[4].text, "старое 4")
+        self.assertEqual(found[6].text, "чуть новее")
+        self.assertLess(found[4].created_at, timezone.now() - timedelta(days=399))
+        self.assertEqual(found[7].text, "свежее")
+        self.assertIsNone(found[99])
+
+        self.assertIsNone(dict(iter_deleted_messages(900001, "other_conn", [1]))[1])
+        record = message_archive.find_many(900002, [1])[1]
+        self.assertEqual(record["payload"], {"message_id": 1, "text": "другой чат"})
+
+    def test_segment_list_is_cached_and_narrowed_by_chat(self):
+        from django.core.management import call_command
+        from .archive import MessageArchive, _Segment
+
+        for message_id in range(1, 4):
+            self._message(message_id, f"старое {message_id}", days_ago=400)
+        self._message(1, "другой чат", days_ago=400, chat_id=900002)
+        call_command("archive_messages", "--older-than-days", "200", "--segment-size", "3", stdout=StringIO())
+
+        archive = MessageArchive()
+        with patch.object(_Segment, "find", autospec=True, side_effect=_Segment.find) as find:
+            self.assertEqual(archive.find_many(900002, [1])[1]["text"], "другой чат")
+        self.assertEqual(find.call_count, 1, "Сегменты без chat_id в диапазоне ключей не читаются")
+
+        with patch("pathlib.Path.glob") as glob:
+            self.assertEqual(archive.find_many(900001, [2])[2]["text"], "старое 2")
+        glob.assert_not_called()
+
+        self._message(9, "новое в архиве", days_ago=400)
+        call_command("archive_messages", "--older-than-days", "200", stdout=StringIO())
+        self.assertEqual(archive.find_many(900001, [9])[9]["text"], "новое в архиве")
+
+    def test_rearchived_message_returns_latest_version_and_dropped_segments_close(self):
+        from django.core.management import call_command
+        from .archive import MessageArchive
+
+        self._message(5, "первая версия", days_ago=400)
+        call_command("archive_messages", "--older-than-days", "200", stdout=StringIO())
+        archive = MessageArchive()
+        old_segment = archive._current_segments()[0]
+
+        self._message(5, "вторая версия", days_ago=400)
+        call_command("archive_messages", "--older-than-days", "200", stdout=StringIO())
+        self.assertEqual(archive.find_many(900001, [5])[5]["text"], "вторая версия")
+
+        for path in Path(self._tmp.name).glob("*/000001.*"):
+            path.unlink()
+        os.utime(next(Path(self._tmp.name).iterdir()), ns=(1, 1))
+        self.assertEqual(archive.find_many(900001, [5])[5]["text"], "вторая версия")
+        self.assertTrue(old_segment._index.closed)
+
+    def test_edit_of_archived_message_reports_previous_text(self):
+        from django.core.management import call_command
+
+        self.mock_post.return_value.json.return_value = {
+            "result": {"user_chat_id": 951101, "user": {"id": 951101}},
+        }
+        self._message(5, "архивный текст", days_ago=400)
+        call_command("archive_messages", "--older-than-days", "200", stdout=StringIO())
+
+        payload = make_edited_business_message_payload(
+            message_id=5,
+            username_from="typo_user",
+            new_text="исправленный текст",
+            business_connection_id="test_conn_del_001",
+            chat_id=900001,
+            user_id=601101,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/webhook_tg/", data=json.dumps(payload), content_type="application/json")
+
+        texts = " ".join(item.payload.get("text", "") for item in TelegramOutbox.objects.all())
+        self.assertIn("архивный текст", texts)
+
+
+class QueryPlanTests(TestCase):
+    def test_canonical_queries_use_indexes(self):
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("check_query_plans", stdout=out)
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+    def test_unindexed_filter_reported_as_full_scan(self):
+        from .query_plans import explain, full_scans
+
+        self.assertTrue(full_scans(explain(Message.objects.filter(text="x"))))
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.admin = User.objects.create_superuser("search_admin", "a@example.com", "pass")
+        self.client.force_login(self.admin)
+        Message.objects.create(chat_id=504001, message_id=1, text="Встречаемся завтра у <b>фонтана</b>", username_from="anna")
+        Message.objects.create(chat_id=504001, message_id=2, text="фонтан фонтан фонтан", username_from="boris")
+        Message.objects.create(chat_id=504002, message_id=3, text="ничего общего", username_from="fontan_fan")
+
+    def test_admin_search_uses_fts_ranked_and_highlighted(self):
+        # Без search_fields LIKE-поиск ничего бы не нашёл: результаты только из FTS
+        with patch("webhook_tg.admin.MessageAdmin.search_fields", ()):
+            response = self.client.get("/admin/webhook_tg/message/", {"q": "фонт"})
+
+        self.assertEqual(response.status_code, 200)
+        results = list(response.context["cl"].result_list)
+        self.assertEqual([m.message_id for m in results], [2, 1], "Сначала самое релевантное")
+        content = response.content.decode()
+        self.assertIn("<mark>фонтана</mark>", content)
+        self.assertIn("&lt;b&gt;", content, "Текст сообщения экранируется")
+
+    def test_punctuation_only_search_falls_back_to_like(self):
+        for params in ({"q": "!!!"}, {"q": "!!!", "chat_id": "504001"}):
+            response = self.client.get("/admin/webhook_tg/message/", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context["cl"].result_count, 0)
+
+    def test_search_joins_fts_table_once(self):
+        from .search import search_messages
+
+        sql = str(search_messages(Message.objects.all(), "фонт").query)
+        self.assertEqual(sql.count("MATCH"), 1, sql)
+
+    def test_message_id_search_keeps_exact_match_without_rank(self):
+        response = self.client.get("/admin/webhook_tg/message/", {"q": "3"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m.message_id for m in response.context["cl"].result_list], [3])
+
+    def test_trigger_keeps_index_in_sync_with_upsert(self):
+        from .message_store import upsert_message
+        from .search import search_messages
+
+        upsert_message(chat_id=504001, message_id=2, text="теперь про море", file_type=FileType.UNKNOWN)
+
+        self.assertEqual([m.message_id for m in search_messages(Message.objects.all(), "фонтан")], [1])
+        self.assertEqual([m.message_id for m in search_messages(Message.objects.all(), "море")], [2])
+
+    def test_chat_view_filters_by_search(self):
+        response = self.client.get("/admin/webhook_tg/message/", {"chat_id": "504001", "q": "завтра"})
+
+        self.assertEqual(response.context["cl"].result_count, 1)
+        self.assertIn("<mark>завтра</mark>", str(response.context["wu_chat_html"]))
+
+    def test_rebuild_command(self):
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("rebuild_message_search", stdout=out)
+        self.assertIn("messages=3", out.getvalue())
+
+
+@patch("webhook_tg.admin.CHAT_PAGE_SIZE", 20)
+class AdminChatPaginationTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        cache.clear()
+        self.admin = User.objects.create_superuser("chat_admin", "c@example.com", "pass")
+        self.client.force_login(self.admin)
+        base = timezone.now()
+        Message.objects.bulk_create(
+            Message(chat_id=505001, message_id=i, text=f"msg {i}", business_connection_id="conn_a")
+            for i in range(1, 51)
+        )
+        # Несколько сообщений с одинаковым created_at — курсор должен различать их по id
+        for i in range(1, 51):
+            Message.objects.filter(chat_id=505001, message_id=i).update(created_at=base - timedelta(minutes=i // 2))
+        Message.objects.filter(chat_id=505001, message_id__in=[49, 50]).update(created_at=None)
+        Message.objects.create(chat_id=505002, message_id=1, text="другой чат")
+        rebuild_chat_summaries()
+
+    def _texts(self, html):
+        import re
+
+        return re.findall(r"msg \d+", str(html))
+
+    def test_chat_mode_counts_from_summary_and_skips_regular_list(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get("/admin/webhook_tg/message/", {"chat_id": "505001"})
+
+        self.assertEqual(response.context["cl"].result_count, 50)
+        self.assertContains(response, "50 сообщений")
+        message_queries = [q["sql"] for q in captured.captured_queries if 'FROM "webhook_tg_message"' in q["sql"]]
+        self.assertFalse([sql for sql in message_queries if "COUNT(" in sql], "COUNT по сообщениям не выполняется")
+        self.assertEqual(len(message_queries), 2, "Только заголовок и первая страница чата")
+
+    def test_chat_loads_first_page_then_pages_by_cursor(self):
+        response = self.client.get("/admin/webhook_tg/message/", {"chat_id": "505001"})
+        self.assertEqual(response.context["cl"].result_count, 50)
+        seen = self._texts(response.context["wu_chat_html"])
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(seen[0], "msg 1")
+
+        page_url = response.context["wu_chat_page_url"]
+        cursor = response.context["wu_chat_next_cursor"]
+        pages = 1
+        while cursor:
+            data = self.client.get(f"{page_url}&cursor={quote(cursor)}").json()
+            seen += self._texts(data["html"])
+            cursor = data["next_cursor"]
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(seen), 50)
+        self.assertEqual(len(set(seen)), 50)
+        self.assertEqual(seen[-2:], ["msg 50", "msg 49"], "Сообщения без даты — в конце")
+
+    def test_page_query_count_does_not_depend_on_chat_size(self):
+        response = self.client.get("/admin/webhook_tg/message/", {"chat_id": "505001"})
+        url = response.context["wu_chat_page_url"]
+        cursor = response.context["wu_chat_next_cursor"]
+        # сессия, пользователь, одна страница сообщений
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(f"{url}&cursor={quote(cursor)}").status_code, 200)
+
+    def test_page_respects_chat_filters_for_staff(self):
+        from django.contrib.auth.models import Permission, User
+
+        staff = User.objects.create_user("chat_staff", password="pass", is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename="view_message"))
+        self.client.force_login(staff)
+
+        data = self.client.get("/admin/webhook_tg/message/chat-page/", {"chat_id": "505001"}).json()
+        self.assertEqual(data, {"html": "", "next_cursor": None})
+
+
+class LiveUpdatesTests(TestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.socket_dir.cleanup)
+        patcher = patch("webhook_tg.live_updates.LIVE_SOCKET_DIR", Path(self.socket_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _collect(self, publish, *, chat_id=506001, business_connection_id=None, expect=1):
+        """Подписывается в event loop, вызывает publish() из другого потока и ждёт expect событий."""
+        import asyncio
+        import threading
+
+        from .live_updates import hub
+
+        async def run():
+            subscription = hub.subscribe(chat_id, business_connection_id)
+            try:
+                thread = threading.Thread(target=publish)
+                thread.start()
+                await asyncio.to_thread(thread.join)
+                return [await asyncio.wait_for(subscription.queue.get(), 1) for _ in range(expect)]
+            finally:
+                hub.unsubscribe(subscription)
+
+        return asyncio.run(run())
+
+    def test_publish_reaches_matching_subscription_only(self):
+        from .live_updates import publish_message_update
+
+        def publish():
+            publish_message_update(chat_id=506002, message_id=1)
+            publish_message_update(chat_id=506001, message_id=2, business_connection_id="conn_b")
+            publish_message_update(chat_id=506001, message_id=3, business_connection_id="conn_a", created=True)
+
+        events = self._collect(publish, business_connection_id="conn_a")
+        self.assertEqual(
+            events,
+            [{"chat_id": 506001, "message_id": 3, "business_connection_id": "conn_a", "created": True}],
+        )
+
+    def test_slow_subscriber_gets_single_resync(self):
+        from .live_updates import RESYNC, publish_message_update
+
+        with patch("webhook_tg.live_updates.LIVE_QUEUE_SIZE", 3):
+            events = self._collect(
+                lambda: [publish_message_update(chat_id=506001, message_id=i) for i in range(10)],
+            )
+        self.assertIs(events[0], RESYNC)
+
+    def test_upsert_publishes_after_commit(self):
+        from .live_updates import hub
+        from .message_store import upsert_message
+
+        with patch.object(hub, "has_subscribers", return_value=True), patch.object(hub, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                upsert_message(chat_id=506003, message_id=1, text="first", business_connection_id="conn_a")
+                publish.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                upsert_message(chat_id=506003, message_id=1, text="second", business_connection_id="conn_a")
+
+        self.assertEqual([call.args[0]["created"] for call in publish.call_args_list], [True, False])
+        self.assertEqual(publish.call_args.args[0]["business_connection_id"], "conn_a")
+
+    def test_event_reaches_other_process_socket(self):
+        import socket
+
+        from .live_updates import publish_message_update
+
+        directory = Path(self.socket_dir.name)
+        stale = directory / "999999999.sock"
+        stale.touch()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as peer:
+            peer.bind(str(directory / "1.sock"))
+            peer.settimeout(1)
+            publish_message_update(chat_id=506004, message_id=7)
+            self.assertEqual(json.loads(peer.recv(4096))["message_id"], 7)
+        self.assertFalse(stale.exists(), "Сокет завершившегося процесса удаляется")
+
+    def test_stream_sends_heartbeat_and_rendered_rows(self):
+        import asyncio
+
+        from .live_updates import chat_event_stream, hub
+
+        async def run():
+            stream = chat_event_stream(506005, None, lambda message_id: f"<div>{message_id}</div>")
+            chunks = [await anext(stream)]
+            chunks.append(await anext(stream))
+            hub.publish({"chat_id": 506005, "message_id": 9, "business_connection_id": None, "created": True})
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        with patch("webhook_tg.live_updates.LIVE_HEARTBEAT_SECONDS", 0.01):
+            retry, heartbeat, message = asyncio.run(run())
+
+        self.assertTrue(retry.startswith("retry: "))
+        self.assertEqual(heartbeat, ": ping\n\n")
+        self.assertTrue(message.startswith("event: message\n"))
+        self.assertEqual(json.loads(message.split("data: ", 1)[1])["html"], "<div>9</div>")
+        self.assertFalse(hub.has_subscribers())
+
+    def test_stream_ends_when_access_is_revoked(self):
+        import asyncio
+
+        from django.core.exceptions import PermissionDenied
+
+        from .live_updates import chat_event_stream, hub
+
+        def render(message_id):
+            raise PermissionDenied
+
+        async def run():
+            stream = chat_event_stream(506006, None, render)
+            await anext(stream)
+            hub.publish({"chat_id": 506006, "message_id": 1, "business_connection_id": None, "created": True})
+            chunks = [chunk async for chunk in stream]
+            return chunks
+
+        self.assertEqual(asyncio.run(run()), ["event: revoked\ndata: {}\n\n"])
+        self.assertFalse(hub.has_subscribers())
+
+    def test_peer_list_is_not_rescanned_without_directory_changes(self):
+        from .live_updates import _fan_out
+
+        directory = Path(self.socket_dir.name)
+        _fan_out({"chat_id": 1})
+        with patch.object(Path, "glob") as glob:
+            _fan_out({"chat_id": 1})
+        glob.assert_not_called()
+
+        (directory / "2.sock").touch()
+        (directory / "3.sock").touch()
+        os.utime(directory, ns=(0, 0))
+        _fan_out({"chat_id": 1})
+        self.assertFalse((directory / "2.sock").exists(), "Новые сокеты видны сразу после изменения каталога")
+
+    def test_live_view_requires_asgi(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser("live_admin", "l@example.com", "pass"))
+        self.assertEqual(self.client.get("/admin/webhook_tg/message/chat-live/").status_code, 400)
+        self.assertEqual(self.client.get("/admin/webhook_tg/message/chat-live/", {"chat_id": "506001"}).status_code, 204)
+
+
+class ChatSummaryTests(NoTelegramApiTestCase):
+    def _upsert(self, message_id, **values):
+        from .message_store import upsert_message
+
+        values.setdefault("business_connection_id", "conn_a")
+        values.setdefault("file_type", FileType.UNKNOWN)
+        return upsert_message(chat_id=507001, message_id=message_id, **values)
+
+    def test_write_path_keeps_counters_and_last_message(self):
+        from .models import ChatSummary
+
+        self._upsert(1, text="привет", username_from="alice")
+        self._upsert(2, text="", file_id="ph_1", file_type=FileType.PHOTO, first_name="Bob")
+        self._upsert(3, text="ещё", username_from="alice", business_connection_id=None)
+
+        summary = ChatSummary.objects.get(chat_id=507001, business_connection_id="conn_a")
+        self.assertEqual((summary.message_count, summary.photo_count), (2, 1))
+        self.assertEqual((summary.last_message_id, summary.last_first_name, summary.last_text), (2, "Bob", "[Фото]"))
+        self.assertIsNotNone(summary.last_message_at)
+        self.assertEqual(ChatSummary.objects.get(chat_id=507001, business_connection_id="").message_count, 1)
+
+        # Правка последнего сообщения меняет превью и счётчики медиа, повторная запись не считается новой
+        self._upsert(2, text="", file_id="vid_1", file_type=FileType.VIDEO, first_name="Bob")
+        self._upsert(1, text="изменено", username_from="alice")
+        summary.refresh_from_db()
+        self.assertEqual(
+            (summary.message_count, summary.photo_count, summary.video_count, summary.last_text),
+            (2, 0, 1, "[Видео]"),
+        )
+
+    def test_write_behind_batch_updates_summary(self):
+        from .models import ChatSummary
+        from .write_behind import WriteBehindQueue
+
+        queue = WriteBehindQueue(flush_interval=60, max_rows=100, max_pending=100)
+        with patch.object(WriteBehindQueue, "_ensure_thread"):
+            for message_id in (1, 2, 3):
+                queue.submit_message(
+                    {"chat_id": 507002, "message_id": message_id, "text": f"m{message_id}", "file_type": FileType.UNKNOWN}
+                )
+            queue.flush()
+
+        summary = ChatSummary.objects.get(chat_id=507002)
+        self.assertEqual((summary.message_count, summary.last_message_id, summary.last_text), (3, 3, "m3"))
+
+    def test_rebuild_matches_incremental_summary(self):
+        from django.core.management import call_command
+
+        from .models import ChatSummary
+
+        self._upsert(1, text="a")
+        self._upsert(2, text="b", file_id="doc", file_type=FileType.DOCUMENT)
+        Message.objects.create(chat_id=507003, message_id=1, text="старое", created_at=None)
+        expected = list(ChatSummary.objects.order_by("chat_id").values("chat_id", "message_count", "document_count", "last_text"))
+
+        ChatSummary.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_chat_summaries", stdout=out)
+
+        self.assertIn("chats=2", out.getvalue())
+        rebuilt = list(ChatSummary.objects.order_by("chat_id").values("chat_id", "message_count", "document_count", "last_text"))
+        self.assertEqual(rebuilt[0], expected[0])
+        self.assertEqual(rebuilt[1]["last_text"], "старое")
+
+    def test_conversations_admin_pages_with_one_query(self):
+        from django.contrib.auth.models import User
+
+        from .models import ChatSummary
+
+        ChatSummary.objects.bulk_create(
+            ChatSummary(chat_id=508000 + i, message_count=i, last_username=f"user{i}", last_message_at=timezone.now())
+            for i in range(120)
+        )
+        self.client.force_login(User.objects.create_superuser("conv_admin", "c@example.com", "pass"))
+
+        # сессия, пользователь, COUNT по сводке, страница сводки
+        with self.assertNumQueries(4):
+            response = self.client.get("/admin/webhook_tg/chatsummary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "@user119")
+        self.assertContains(response, "?chat_id=508119")
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_superuser("list_admin", "l@example.com", "pass"))
+
+    def _queries(self, url, params=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in captured.captured_queries]
+
+    def test_outgoing_recipients_resolved_with_one_query_per_page(self):
+        from .models import UserTg
+
+        def add_rows(start, count):
+            for chat_id in range(start, start + count):
+                UserTg.objects.create(user_id=chat_id, chat_id=chat_id, username=f"user{chat_id}")
+                BotOutgoingMessage.objects.create(chat_id=chat_id, method="sendMessage")
+
+        add_rows(510000, 3)
+        _, few = self._queries("/admin/webhook_tg/botoutgoingmessage/")
+        add_rows(510100, 40)
+        response, many = self._queries("/admin/webhook_tg/botoutgoingmessage/")
+
+        self.assertEqual(len(many), len(few))
+        self.assertContains(response, "@user510139")
+
+    def test_message_filters_do_not_scan_distinct_values(self):
+        from .models import ChatSummary
+
+        Message.objects.create(chat_id=510201, message_id=1, text="первый", username_from="alice")
+        Message.objects.create(chat_id=510202, message_id=1, text="второй", username_from="bob")
+        ChatSummary.objects.create(chat_id=510201, last_username="alice")
+
+        response, queries = self._queries("/admin/webhook_tg/message/")
+        self.assertFalse([sql for sql in queries if "DISTINCT" in sql.upper()])
+        self.assertContains(response, '<option value="510201">@alice</option>', html=True)
+
+        response = self.client.get("/admin/webhook_tg/message/", {"chat_id__exact": "510202"})
+        self.assertEqual([m.chat_id for m in response.context["cl"].result_list], [510202])
+        response = self.client.get("/admin/webhook_tg/message/", {"username_from__exact": "alice"})
+        self.assertEqual([m.username_from for m in response.context["cl"].result_list], ["alice"])
+
+    def test_unfiltered_changelist_uses_estimated_count(self):
+        from .admin_lists import estimated_row_count
+
+        from django.db import connection
+
+        BotOutgoingMessage.objects.bulk_create(
+            BotOutgoingMessage(chat_id=510300 + i, method="sendMessage") for i in range(5)
+        )
+        self.assertIsNone(estimated_row_count(BotOutgoingMessage), "Без статистики ANALYZE оценки нет")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.assertEqual(estimated_row_count(BotOutgoingMessage), 5)
+
+        with patch("webhook_tg.admin_lists.ESTIMATED_COUNT_MIN_ROWS", 1):
+            response, queries = self._queries("/admin/webhook_tg/botoutgoingmessage/")
+        self.assertFalse([sql for sql in queries if "COUNT(" in sql.upper()])
+        self.assertGreaterEqual(response.context["cl"].result_count, 5)
+
+        response = self.client.get("/admin/webhook_tg/botoutgoingmessage/", {"method": "sendMessage"})
+        self.assertEqual(response.context["cl"].result_count, 5, "С фильтром считается точно")
+
+
+    def test_overestimated_count_is_clamped_to_real_pages(self):
+        BotOutgoingMessage.objects.bulk_create(
+            BotOutgoingMessage(chat_id=510400 + i, method="sendMessage") for i in range(150)
+        )
+        url = "/admin/webhook_tg/botoutgoingmessage/"
+        with patch("webhook_tg.admin_lists.ESTIMATED_COUNT_MIN_ROWS", 1), \
+                patch("webhook_tg.admin_lists.estimated_row_count", return_value=100000):
+            response = self.client.get(url, {"p": "2"})
+            self.assertEqual(response.context["cl"].paginator.num_pages, 2, "Неполная страница — последняя")
+            self.assertEqual(len(response.context["cl"].result_list), 50)
+
+            response = self.client.get(url, {"p": "500"})
+            self.assertEqual(response.status_code, 200, "Без редиректа на ?e=1")
+            self.assertEqual(response.context["cl"].paginator.num_pages, 2)
+            self.assertEqual(len(response.context["cl"].result_list), 50)
+
+    def test_outgoing_changelist_filters_by_date_without_distinct_scan(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        BotOutgoingMessage.objects.create(chat_id=510500, method="sendMessage")
+        since = (timezone.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/admin/webhook_tg/botoutgoingmessage/", {"sent_at__gte": since, "method__exact": "sendMessage"}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["cl"].result_list), 1)
+        self.assertFalse([q["sql"] for q in queries.captured_queries if "DISTINCT" in q["sql"]])
+
+
+class AdminChatAccessTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import Permission, User
+
+        cache.clear()
+        self.staff = User.objects.create_user("acl_staff", password="pass", is_staff=True)
+        self.staff.user_permissions.add(Permission.objects.get(codename="view_message"))
+        self.client.force_login(self.staff)
+        Message.objects.bulk_create([
+            Message(chat_id=511001, message_id=1, text="открытый чат", business_connection_id="conn_a"),
+            Message(chat_id=511002, message_id=1, text="своё подключение", business_connection_id="conn_a"),
+            Message(chat_id=511002, message_id=2, text="чужое подключение", business_connection_id="conn_b"),
+            Message(chat_id=511003, message_id=1, text="закрытый чат", business_connection_id="conn_a"),
+        ])
+
+    def _visible(self):
+        response = self.client.get("/admin/webhook_tg/message/")
+        return sorted(m.text for m in response.context["cl"].result_list)
+
+    def test_filters_compile_to_in_lists(self):
+        from .chat_access import compile_chat_access
+        from .models import AdminChatFilter
+
+        AdminChatFilter.objects.create(user=self.staff, chat_id=511001)
+        AdminChatFilter.objects.create(user=self.staff, chat_id=511001, business_connection_id="conn_a")
+        AdminChatFilter.objects.create(user=self.staff, chat_id=511002, business_connection_id="conn_a")
+
+        access = compile_chat_access(self.staff.pk)
+        self.assertEqual(access.chat_ids, {511001})
+        self.assertEqual(access.connection_chat_ids, {"conn_a": {511002}})
+        self.assertEqual(self._visible(), ["открытый чат", "своё подключение"])
+
+    def test_access_is_cached_and_reset_by_filter_changes(self):
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from .models import AdminChatFilter
+
+        self.assertEqual(self._visible(), [])
+        with CaptureQueriesContext(connection) as captured:
+            self._visible()
+        self.assertFalse([q for q in captured.captured_queries if "adminchatfilter" in q["sql"]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            chat_filter = AdminChatFilter.objects.create(user=self.staff, chat_id=511003)
+        self.assertEqual(self._visible(), ["закрытый чат"])
+
+        other = User.objects.create_user("acl_other", password="pass", is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            chat_filter.user = other
+            chat_filter.save()
+        self.assertEqual(self._visible(), [], "Переназначенный фильтр сбрасывает доступ прежнего владельца")
+
+    def test_deleted_filter_revokes_access_cached_by_another_process(self):
+        from .chat_access import _cache_key
+        from .models import AdminChatFilter
+
+        chat_filter = AdminChatFilter.objects.create(user=self.staff, chat_id=511003)
+        self.assertEqual(self._visible(), ["закрытый чат"])
+        stale = cache.get(_cache_key(self.staff.pk))
+
+        chat_filter.delete()
+        # кэш другого процесса сигнал не сбрасывает: там осталась старая запись
+        cache.set(_cache_key(self.staff.pk), stale)
+
+        self.assertEqual(self._visible(), [])
@@ -1,24 +1,48 @@
 from django.http import HttpResponse, HttpRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 import json
 import subprocess
 import sys
+from datetime import timedelta
+from functools import partial
 from pathlib import Path
-from .models import UserTg, Message, FileType, TelegramOutbox
+from .models import UserTg, FileType, TelegramOutbox
 import html
 from .telegram import (
     tg_send_message,
-    get_business_connection,
     send_photo,
     send_audio,
     send_video,
-    send_document,
+    input_media,
+    MEDIA_GROUP_MAX_ITEMS,
+)
+from .config import (
+    START_PHOTO_ID,
+    START_TEXT,
+    OWNER_CHAT_ID,
+    ALLOWED_SEND_CHAT_IDS,
+    WEBHOOK_INBOX_MODE,
+    DELETED_DOCUMENT_THRESHOLD,
+    EDIT_COALESCE_WINDOW_SECONDS,
 )
-from .config import START_PHOTO_ID, START_TEXT, OWNER_CHAT_ID, ALLOWED_SEND_CHAT_IDS
 from .inner_models.BusinessConnection import BusinessConnection
-from .idempotency import acquire_webhook_update
-from .outbox import enqueue_outbox, edit_notification_dedup_key
+from .business_connections import get_business_connection, save_business_connection
+from .archive import archived_previous
+from .deleted_messages import DELETED_REPORT_KEY, deleted_report_payload, iter_deleted_messages
+from .message_store import upsert_message
+from .write_behind import flush_pending_writes, save_message
+from .idempotency import acquire_webhook_update, is_valid_update_id
+from .inbox import store_inbox_update
+from .outbox import (
+    enqueue_outbox,
+    edit_coalesce_key,
+    edit_notification_dedup_key,
+    deleted_notification_dedup_key,
+)
 from .event_reporter import report_who_update_event
+from .wakeup import notify_outbox_worker
 from .events_chart import parse_events_period, PERIOD_HELP
 
 
@@ -31,39 +55,20 @@ def webhook_tg(request: HttpRequest):
     try:
         data = json.loads(request.body.decode("utf-8"))
         print(data)
-        if not acquire_webhook_update(data.get("update_id")):
+        if not isinstance(data, dict) or not is_valid_update_id(data.get("update_id")):
+            # Повтор такого апдейта ничего не исправит — отвечаем успехом, чтобы Telegram не повторял
+            print(f"Bad update: {str(data)[:200]}")
             return HttpResponse("Success")
-        msg = data.get("business_message") or data.get("message") or data.get("edited_message") or \
-              data.get("edited_business_message") or data.get("deleted_business_messages") or data.get("deleted_messages") or {}
-        text = msg.get("text")
-        if text is None and not is_deleted_message(data):
-            print("СООБЩЕНИЕ БЕЗ ТЕКСТА")
-            if is_edited_message(data) or is_new_message(data):
-                create_message(msg)
+        if WEBHOOK_INBOX_MODE:
+            store_inbox_update(data)
             return HttpResponse("Success")
-        from_user_id = msg.get("from", {}).get("id")
-        chat_id = msg.get("chat", {}).get("id")
-        username = msg.get("from", {}).get("username")
-        first_name = msg.get("from", {}).get("first_name")
-        if text == "/start" and is_message_to_bot(data):
-            init_user_bot(user_id=from_user_id, chat_id=chat_id, username=username, first_name=first_name)
-            send_meeting_message(chat_id)
-        elif is_message_to_bot(data) and _handle_events_command(chat_id, text):
-            pass
-        elif is_message_to_bot(data) and _handle_send_media_command(chat_id, text):
-            pass
-        elif is_edited_message(data):
-            business_connection = get_business_connection(msg)
-            _send_edit_notification(msg, business_connection)
-        elif is_deleted_message(data):
-            business_connection = get_business_connection(msg)
-            if (business_connection.user_chat_id != chat_id):
-                _send_deleted_notifications(msg, business_connection)
-        if is_edited_message(data) or is_new_message(data):
-            create_message(msg)
-
-
-        print(f"text: {text}")
+        prepare_update(data)
+        # Маркер идемпотентности, сообщение и outbox коммитятся вместе: при ошибке апдейт
+        # откатывается целиком и Telegram пришлёт его повторно
+        with transaction.atomic():
+            if not acquire_webhook_update(data.get("update_id")):
+                return HttpResponse("Success")
+            handle_update(data)
     except (UnicodeDecodeError, json.JSONDecodeError) as e:
         print(f"Bad JSON: {e}")
         pass
@@ -72,6 +77,75 @@ def webhook_tg(request: HttpRequest):
     
     return HttpResponse(f"Success")
 
+
+def _after_commit(func, *args, **kwargs) -> None:
+    """Внешний эффект (запрос в Telegram, процесс, HTTP) — только после коммита апдейта."""
+    transaction.on_commit(partial(func, *args, **kwargs), robust=True)
+
+
+def prepare_update(data: dict) -> None:
+    """
+    Вызывается до транзакции апдейта: правке и удалению нужны уже записанные сообщения
+    и business-подключение — возможный getBusinessConnection идёт здесь, а не внутри транзакции.
+    """
+    if is_edited_message(data) or is_deleted_message(data):
+        flush_pending_writes()
+        get_business_connection(_update_message(data))
+
+
+def _update_message(data: dict) -> dict:
+    return data.get("business_message") or data.get("message") or data.get("edited_message") or \
+        data.get("edited_business_message") or data.get("deleted_business_messages") or data.get("deleted_messages") or {}
+
+
+def handle_update(data: dict) -> None:
+    """
+    Обработка одного апдейта Telegram: вызывается из webhook или воркером inbox внутри их транзакции.
+    Записи в БД идут в эту транзакцию, отправки откладываются через _after_commit.
+    """
+    if data.get("business_connection"):
+        save_business_connection(data["business_connection"])
+        return
+    msg = _update_message(data)
+    text = msg.get("text")
+    if text is None and not is_deleted_message(data):
+        print("СООБЩЕНИЕ БЕЗ ТЕКСТА")
+        if is_edited_message(data) or is_new_message(data):
+            create_message(msg, write_behind=is_new_message(data))
+        return
+    from_user_id = msg.get("from", {}).get("id")
+    chat_id = msg.get("chat", {}).get("id")
+    username = msg.get("from", {}).get("username")
+    first_name = msg.get("from", {}).get("first_name")
+    stored = False
+    if text == "/start" and is_message_to_bot(data):
+        init_user_bot(user_id=from_user_id, chat_id=chat_id, username=username, first_name=first_name)
+        _after_commit(send_meeting_message, chat_id)
+    elif is_message_to_bot(data) and _handle_events_command(chat_id, text):
+        pass
+    elif is_message_to_bot(data) and _handle_send_media_command(chat_id, text):
+        pass
+    elif is_edited_message(data):
+        business_connection = get_business_connection(msg, allow_fetch=False)
+        # upsert возвращает прежний текст — отдельный поиск старой версии не нужен
+        previous = create_message(msg)
+        if previous is None:
+            # Старое сообщение могло уйти из БД в архив — прежний текст берём оттуда
+            previous = archived_previous(_message_chat_id(msg), msg.get("message_id"), msg.get("business_connection_id"))
+        stored = True
+        # Владелец отключил бота — уведомлений от его подключения больше не шлём
+        if business_connection.is_enabled:
+            _send_edit_notification(msg, business_connection, previous)
+    elif is_deleted_message(data):
+        business_connection = get_business_connection(msg, allow_fetch=False)
+        if business_connection.is_enabled and business_connection.user_chat_id != chat_id:
+            _send_deleted_notifications(msg, business_connection)
+    if not stored and (is_edited_message(data) or is_new_message(data)):
+        create_message(msg, write_behind=is_new_message(data))
+
+    print(f"text: {text}")
+
+
 def send_meeting_message(chat_id):
     send_photo(chat_id=chat_id, photo_id=START_PHOTO_ID, caption=START_TEXT)
 
@@ -86,10 +160,10 @@ def _handle_events_command(chat_id, text: str) -> bool:
     period_raw = parts[1] if len(parts) > 1 else ""
     period = parse_events_period(period_raw)
     if period is None:
-        tg_send_message(chat_id, PERIOD_HELP)
+        _after_commit(tg_send_message, chat_id, PERIOD_HELP)
         return True
 
-    _spawn_events_chart(chat_id, period_raw or "1h")
+    _after_commit(_spawn_events_chart, chat_id, period_raw or "1h")
     return True
 
 
@@ -125,19 +199,20 @@ def _handle_send_media_command(chat_id, text: str) -> bool:
     command = (parts[0] or "").lower()
     file_id = (parts[1] or "").strip() if len(parts) > 1 else ""
     if not file_id:
-        tg_send_message(
+        _after_commit(
+            tg_send_message,
             chat_id,
             "Укажите file_id после команды, например:\n/send_photo <i>file_id</i>",
         )
         return True
     if command == "/send_photo":
-        send_photo(chat_id, file_id)
+        _after_commit(send_photo, chat_id, file_id)
         return True
     if command == "/send_audio":
-        send_audio(chat_id, file_id)
+        _after_commit(send_audio, chat_id, file_id)
         return True
     if command == "/send_video":
-        send_video(chat_id, file_id)
+        _after_commit(send_video, chat_id, file_id)
         return True
     return False
 
@@ -178,19 +253,15 @@ def _message_chat_id(msg):
     return chat.get("id")
 
 
-def get_message_by_tg(msg):
+def create_message(msg, *, write_behind: bool = False) -> dict | None:
+    """
+    Сохраняет сообщение и возвращает его прежнее содержимое (None — раньше не было).
+    write_behind — новое сообщение, прежнее не нужно: запись может уйти в очередь write_behind.
+    """
     chat_id = _message_chat_id(msg)
     message_id = msg.get("message_id")
     if chat_id is None or message_id is None:
         return None
-    return Message.objects.filter(chat_id=chat_id, message_id=message_id).first()
-
-
-def create_message(msg):
-    chat_id = _message_chat_id(msg)
-    message_id = msg.get("message_id")
-    if chat_id is None or message_id is None:
-        return
 
     file_id, file_type, caption = _extract_file_data(msg)
     text = msg.get("text")
@@ -203,27 +274,32 @@ def create_message(msg):
     username_from = msg.get("from", {}).get("username")
     first_name = msg.get("from", {}).get("first_name")
 
-    Message.objects.update_or_create(
-        chat_id=chat_id,
-        message_id=message_id,
-        defaults={
-            "business_connection_id": business_connection_id,
-            "username_from": username_from,
-            "first_name": first_name,
-            "text": text,
-            "file_id": file_id,
-            "file_type": file_type or FileType.UNKNOWN,
-            "caption": caption,
-            "payload": str(msg),
-        },
-    )
-    report_who_update_event(
+    values = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "business_connection_id": business_connection_id,
+        "username_from": username_from,
+        "first_name": first_name,
+        "text": text,
+        "file_id": file_id,
+        "file_type": file_type or FileType.UNKNOWN,
+        "caption": caption,
+        "payload": msg,
+    }
+    previous = None
+    if write_behind:
+        save_message(values)
+    else:
+        previous = upsert_message(**values)
+    _after_commit(
+        report_who_update_event,
         chat_id=chat_id,
         message_id=message_id,
         business_connection_id=business_connection_id,
         username_from=username_from,
         first_name=first_name,
     )
+    return previous
 
 def _build_deleted_caption(deleted: dict, message_id: int, text: str) -> str:
     """Текст уведомления об удалении: кто удалил, id сообщения, содержимое."""
@@ -240,26 +316,41 @@ def _build_deleted_caption(deleted: dict, message_id: int, text: str) -> str:
     )
 
 
-def _send_file_by_type(chat_id, file_id: str, file_type: str, caption: str) -> None:
-    """Отправляет файл в чат в зависимости от file_type (PHOTO, AUDIO, VIDEO, DOCUMENT)."""
-    if file_type == FileType.PHOTO:
-        send_photo(chat_id, file_id, caption=caption)
-    elif file_type == FileType.AUDIO:
-        send_audio(chat_id, file_id, caption=caption)
-    elif file_type == FileType.VIDEO:
-        send_video(chat_id, file_id, caption=caption)
-    elif file_type == FileType.DOCUMENT:
-        send_document(chat_id, file_id, caption=caption)
-    else:
-        tg_send_message(chat_id, caption)
+_FILE_SEND_METHODS = {
+    FileType.PHOTO: (TelegramOutbox.Method.SEND_PHOTO, "photo"),
+    FileType.AUDIO: (TelegramOutbox.Method.SEND_AUDIO, "audio"),
+    FileType.VIDEO: (TelegramOutbox.Method.SEND_VIDEO, "video"),
+    FileType.DOCUMENT: (TelegramOutbox.Method.SEND_DOCUMENT, "document"),
+}
+
+
+# Какие медиа можно собирать в один альбом и их тип InputMedia
+_ALBUM_MEDIA_TYPES = {
+    FileType.PHOTO: "photo",
+    FileType.VIDEO: "video",
+}
+
+
+def _html_message_payload(text: str) -> dict:
+    return {"text": text, "parse_mode": "HTML", "disable_web_page_preview": True}
+
+
+def _deleted_notification_request(message, caption: str) -> tuple[str, dict]:
+    """Метод и payload уведомления об удалённом сообщении: файл с подписью или просто текст."""
+    if message and message.file_id and message.file_type in _FILE_SEND_METHODS:
+        method, field = _FILE_SEND_METHODS[message.file_type]
+        return method, {field: message.file_id, "caption": caption, "parse_mode": "HTML"}
+    return TelegramOutbox.Method.SEND_MESSAGE, _html_message_payload(caption)
 
 
 def _send_deleted_notifications(deleted: dict, business_connection: BusinessConnection) -> None:
     """
-    Находит удалённые сообщения в БД по message_ids и отправляет пользователю:
-    — если у сообщения есть file_id и тип медиа: отправляет файл (photo/audio/video/document) с подписью;
-    — иначе: отправляет текстовое уведомление.
-    Максимум 20 таких отправок, затем одно сообщение «больше 20 удалено».
+    Находит удалённые сообщения в БД по message_ids и ставит в outbox уведомления пользователю:
+    — фото и видео: альбомами sendMediaGroup, у каждого элемента своя подпись;
+    — остальные файлы (audio/document): по одному с подписью;
+    — иначе: текстовое уведомление.
+    Если удалено больше DELETED_DOCUMENT_THRESHOLD сообщений — один файл-отчёт вместо отдельных уведомлений.
+    Ключи дедупликации не дают повторному апдейту отправить уведомления второй раз.
     """
     chat = deleted.get("chat") or {}
     business_connection_id = deleted.get("business_connection_id")
@@ -267,38 +358,96 @@ def _send_deleted_notifications(deleted: dict, business_connection: BusinessConn
     msg_ids = deleted.get("message_ids") or []
     first_name = chat.get("first_name") or "Unknown"
     username = chat.get("username")
+    recipient = business_connection.user_chat_id
 
     user_part = html.escape(first_name)
     if username:
         user_part += f" (@{html.escape(username)})"
 
     if not msg_ids:
-        tg_send_message(business_connection.user_chat_id, f"{user_part} удалил(а) сообщения (ids не пришли).")
+        enqueue_outbox(
+            chat_id=recipient,
+            method=TelegramOutbox.Method.SEND_MESSAGE,
+            payload=_html_message_payload(f"{user_part} удалил(а) сообщения (ids не пришли)."),
+            deliver_now=False,
+        )
         return
 
-    known = Message.objects.filter(
-        message_id__in=msg_ids,
-        business_connection_id=business_connection_id,
-        chat_id=chat_id,
-    )
-    known_map = {m.message_id: m for m in known}
+    if len(msg_ids) > DELETED_DOCUMENT_THRESHOLD:
+        _send_deleted_report(deleted, recipient, user_part, msg_ids)
+        return
 
-    for mid in msg_ids[:20]:
-        m = known_map.get(mid)
+    album = []
+    for mid, m in iter_deleted_messages(chat_id, business_connection_id, msg_ids):
         caption = _build_deleted_caption(deleted, mid, m.text if m else None)
-        if m and m.file_id and m.file_type and m.file_type != FileType.UNKNOWN:
-            _send_file_by_type(business_connection.user_chat_id, m.file_id, m.file_type, caption)
+        if m and m.file_id and m.file_type in _ALBUM_MEDIA_TYPES:
+            album.append((mid, m, caption))
+            continue
+        method, payload = _deleted_notification_request(m, caption)
+        enqueue_outbox(
+            chat_id=recipient,
+            method=method,
+            payload=payload,
+            dedup_key=deleted_notification_dedup_key(business_connection_id, chat_id, mid),
+            deliver_now=False,
+        )
+
+    _send_deleted_albums(album, recipient, business_connection_id, chat_id)
+
+
+def _send_deleted_albums(album: list, recipient, business_connection_id, chat_id) -> None:
+    """Удалённые фото и видео одного события — альбомами sendMediaGroup по MEDIA_GROUP_MAX_ITEMS."""
+    for start in range(0, len(album), MEDIA_GROUP_MAX_ITEMS):
+        group = album[start:start + MEDIA_GROUP_MAX_ITEMS]
+        first_mid = group[0][0]
+        if len(group) == 1:
+            _, m, caption = group[0]
+            method, payload = _deleted_notification_request(m, caption)
+            dedup_key = deleted_notification_dedup_key(business_connection_id, chat_id, first_mid)
         else:
-            tg_send_message(business_connection.user_chat_id, caption)
+            method = TelegramOutbox.Method.SEND_MEDIA_GROUP
+            payload = {
+                "media": [input_media(_ALBUM_MEDIA_TYPES[m.file_type], m.file_id, caption) for _, m, caption in group],
+            }
+            dedup_key = deleted_notification_dedup_key(
+                business_connection_id, chat_id, f"album:{first_mid}:{len(group)}"
+            )
+        enqueue_outbox(
+            chat_id=recipient,
+            method=method,
+            payload=payload,
+            dedup_key=dedup_key,
+            deliver_now=False,
+        )
 
-    if len(msg_ids) > 10:
-        tg_send_message(business_connection.user_chat_id, f"Было удалено больше 10 сообщений (всего {len(msg_ids)}).")
+
+def _send_deleted_report(deleted: dict, recipient, user_part: str, msg_ids) -> None:
+    """
+    Массовое удаление: все сохранённые тексты и ссылки на медиа одним документом.
+    Файл здесь не пишется — его собирает воркер outbox по сохранённым id перед отправкой и сразу удаляет.
+    """
+    if not recipient:
+        return
+    chat_id = (deleted.get("chat") or {}).get("id")
+    enqueue_outbox(
+        chat_id=recipient,
+        method=TelegramOutbox.Method.SEND_DOCUMENT,
+        payload={
+            "caption": f"{user_part} удалил(а) {len(msg_ids)} сообщений. Сохранённые тексты — в файле.",
+            "parse_mode": "HTML",
+            DELETED_REPORT_KEY: deleted_report_payload(deleted),
+        },
+        dedup_key=deleted_notification_dedup_key(
+            deleted.get("business_connection_id"), chat_id, f"report:{min(msg_ids)}:{len(msg_ids)}"
+        ),
+        deliver_now=False,
+    )
 
 
 def _build_deleted_message_parts(deleted: dict) -> list[str]:
     """
-    Формирует список строк для отправки: до 10 отдельных сообщений об удалённых,
-    затем одно сообщение о том, что удалено больше 10. (Используется для тестов и build_message_delete.)
+    Формирует список строк для отправки: по строке на каждое из первых DELETED_DOCUMENT_THRESHOLD удалённых,
+    затем одна строка о том, что удалено больше DELETED_DOCUMENT_THRESHOLD. (Используется для тестов и build_message_delete.)
     """
     chat = deleted.get("chat") or {}
     first_name = chat.get("first_name") or "Unknown"
@@ -313,22 +462,16 @@ def _build_deleted_message_parts(deleted: dict) -> list[str]:
 
     business_connection_id = deleted.get("business_connection_id")
     chat_id = deleted.get("chat", {}).get("id")
-    known = Message.objects.filter(
-        message_id__in=msg_ids,
-        business_connection_id=business_connection_id,
-        chat_id=chat_id,
-    )
-    known_map = {m.message_id: (m.text or "") for m in known}
 
     parts = []
-    for mid in msg_ids[:20]:
-        old_text = known_map.get(mid) or "(текст не сохранён)"
+    for mid, m in iter_deleted_messages(chat_id, business_connection_id, msg_ids[:DELETED_DOCUMENT_THRESHOLD]):
+        old_text = (m.text if m else None) or "(текст не сохранён)"
         parts.append(
             f"{user_part} удалил(а) сообщение (id={mid}):\n"
             f"<blockquote>{html.escape(old_text)}</blockquote>"
         )
-    if len(msg_ids) > 20:
-        parts.append(f"Было удалено больше 10 сообщений (всего {len(msg_ids)}).")
+    if len(msg_ids) > DELETED_DOCUMENT_THRESHOLD:
+        parts.append(f"Было удалено больше {DELETED_DOCUMENT_THRESHOLD} сообщений (всего {len(msg_ids)}).")
     return parts
 
 
@@ -337,22 +480,29 @@ def build_message_delete(deleted: dict) -> str:
     parts = _build_deleted_message_parts(deleted)
     return "\n\n".join(parts)
 
-def build_message_update(msg: dict, business_connection: BusinessConnection):
-    fr = msg.get("from") or {}
+EDIT_OLD_TEXT_UNKNOWN = "(Это сообщение было написано до подключения бота)"
+
+
+def _previous_text(previous: dict | None) -> str:
+    return previous["text"] if previous is not None else EDIT_OLD_TEXT_UNKNOWN
+
+
+def build_message_update(msg: dict, previous: dict | None):
+    """Текст уведомления о правке; previous — прежнее содержимое из create_message."""
+    return _render_edit_notification(msg.get("from") or {}, _previous_text(previous), msg.get("text") or "")
+
+
+def _render_edit_notification(fr: dict, old_text: str, new_text: str, edits: int = 1) -> str:
     first_name = fr.get("first_name") or "Unknown"
     username = fr.get("username")
 
-    message_id = msg.get("message_id")
-    old = get_message_by_tg(msg)
-    old_text = old.text if old is not None else "(Это сообщение было написано до подключения бота)"
-    new_text = msg.get("text") or ""
-
     user_part = html.escape(first_name)
     if username:
         user_part += f" (@{html.escape(username)})"
+    edits_part = f" (правок: {edits})" if edits > 1 else ""
 
     return (
-        f"{user_part} изменил(а) сообщение:\n\n"
+        f"{user_part} изменил(а) сообщение{edits_part}:\n\n"
         f"<b>Old:</b>\n<blockquote>{html.escape(old_text)}</blockquote>\n"
         f"<b>New:</b>\n<blockquote>{html.escape(new_text)}</blockquote>\n\n"
         f"<b>@{html.escape('who_update_bot')}</b>"
@@ -377,23 +527,79 @@ def _edit_notification_recipient(msg: dict, business_connection: BusinessConnect
     return business_connection.user_chat_id
 
 
-def _send_edit_notification(msg: dict, business_connection: BusinessConnection) -> None:
+def _send_edit_notification(msg: dict, business_connection: BusinessConnection, previous: dict | None) -> None:
     recipient = _edit_notification_recipient(msg, business_connection)
     if recipient is None:
         return
 
-    notification = build_message_update(msg, business_connection)
+    if EDIT_COALESCE_WINDOW_SECONDS > 0:
+        _enqueue_coalesced_edit(msg, recipient, previous)
+        return
+
+    notification = build_message_update(msg, previous)
     enqueue_outbox(
         chat_id=recipient,
         method=TelegramOutbox.Method.SEND_MESSAGE,
-        payload={
-            "text": notification,
-            "parse_mode": "HTML",
-            "disable_web_page_preview": True,
-        },
+        payload=_html_message_payload(notification),
         dedup_key=edit_notification_dedup_key(msg),
     )
 
+
+def _pending_edit(key: str):
+    """Строка outbox, в которую сливаются правки, под блокировкой до конца транзакции."""
+    return TelegramOutbox.objects.select_for_update().filter(dedup_key=key).first()
+
+
+def _enqueue_coalesced_edit(msg: dict, recipient, previous: dict | None) -> None:
+    """
+    Правки одного сообщения в пределах EDIT_COALESCE_WINDOW_SECONDS сливаются в одну строку outbox:
+    исходный текст берётся из первой правки, новый — из последней.
+    Ключ слияния держит только строка, которая ещё не отправляется: уже взятая воркером строка
+    получает другой dedup_key, а правка начинает новую строку с тем же ключом — в неё сольются следующие.
+    Первую правку вставляет INSERT по уникальному dedup_key: если параллельно её вставил другой процесс,
+    IntegrityError, и правка сливается с его строкой, а не теряется.
+    """
+    fr = msg.get("from") or {}
+    new_text = msg.get("text") or ""
+    key = edit_coalesce_key(recipient, _message_chat_id(msg), msg.get("message_id"))
+
+    with transaction.atomic():
+        while True:
+            pending = _pending_edit(key)
+            if pending is None:
+                old_text = _previous_text(previous)
+                try:
+                    with transaction.atomic():
+                        TelegramOutbox.objects.create(
+                            chat_id=recipient,
+                            method=TelegramOutbox.Method.SEND_MESSAGE,
+                            payload=_html_message_payload(_render_edit_notification(fr, old_text, new_text)),
+                            dedup_key=key,
+                            next_attempt_at=timezone.now() + timedelta(seconds=EDIT_COALESCE_WINDOW_SECONDS),
+                            meta={"old_text": old_text, "new_text": new_text, "edits": 1},
+                        )
+                except IntegrityError:
+                    continue
+                transaction.on_commit(notify_outbox_worker, robust=True)
+                return
+
+            if pending.locked_until is not None and pending.locked_until > timezone.now():
+                # Предыдущее уведомление уже отправляется — освобождаем ключ для новой строки
+                TelegramOutbox.objects.filter(pk=pending.pk).update(dedup_key=f"{key}:{pending.pk}")
+                continue
+
+            meta = {**pending.meta, "new_text": new_text, "edits": pending.meta.get("edits", 1) + 1}
+            pending.meta = meta
+            pending.payload = _html_message_payload(
+                _render_edit_notification(fr, meta["old_text"], new_text, meta["edits"])
+            )
+            # Аренда истекла: снимаем её, чтобы воркер-владелец не завершил строку со старым текстом
+            pending.locked_by = ""
+            pending.locked_until = None
+            pending.save(update_fields=["meta", "payload", "locked_by", "locked_until"])
+            return
+
+
 def init_user_bot(user_id: int, chat_id: int, username: str, first_name: str):
     user, created = UserTg.objects.get_or_create(
         user_id=user_id,
@@ -405,7 +611,7 @@ def init_user_bot(user_id: int, chat_id: int, username: str, first_name: str):
     )
 
     if created:
-        tg_send_message(OWNER_CHAT_ID, f"New user: @{username or '-'} {first_name or ''} (id={user_id})")
+        _after_commit(tg_send_message, OWNER_CHAT_ID, f"New user: @{username or '-'} {first_name or ''} (id={user_id})")
     else:
         updated = False
         if user.chat_id != chat_id:
@@ -0,0 +1,60 @@
+import logging
+import select
+import socket
+
+from .config import OUTBOX_WAKEUP_PORT
+
+logger = logging.getLogger(__name__)
+
+WAKEUP_ADDRESS = ("127.0.0.1", OUTBOX_WAKEUP_PORT)
+
+
+def notify_outbox_worker() -> None:
+    """Будит воркер outbox на этой машине (UDP на loopback). Если воркера нет — датаграмма просто теряется."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"1", WAKEUP_ADDRESS)
+    except OSError as exc:
+        logger.debug("Outbox wakeup failed: %s", exc)
+
+
+class WakeupListener:
+    """
+    Ожидание сигнала notify_outbox_worker вместо сна между опросами очереди.
+    Если порт занять не удалось, wait() ведёт себя как обычный sleep — воркер продолжит работать опросом.
+    """
+
+    def __init__(self, address=WAKEUP_ADDRESS):
+        self._sock = None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if hasattr(socket, "SO_REUSEPORT"):
+                # Несколько воркеров на одном порту: ядро отдаёт датаграмму одному из них
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(address)
+            sock.setblocking(False)
+        except OSError as exc:
+            logger.warning("Outbox wakeup listener disabled (%s), polling only", exc)
+            sock.close()
+            return
+        self._sock = sock
+
+    def wait(self, timeout: float) -> bool:
+        """Ждёт сигнал не дольше timeout секунд. True — разбудили."""
+        if self._sock is None:
+            select.select([], [], [], timeout)
+            return False
+
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if not ready:
+            return False
+        while True:
+            try:
+                self._sock.recv(16)
+            except BlockingIOError:
+                return True
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
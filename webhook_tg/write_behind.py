@@ -0,0 +1,206 @@
+import atexit
+import logging
+import threading
+from functools import partial
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .chat_summaries import record_new_messages
+from .config import (
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_FLUSH_MS,
+    WRITE_BEHIND_MAX_PENDING,
+    WRITE_BEHIND_MAX_ROWS,
+)
+from .live_updates import publish_message_update
+from .message_store import insert_new_messages, remember_message, upsert_message
+from .models import BotOutgoingMessage
+from .payloads import save_message_payloads
+
+logger = logging.getLogger(__name__)
+
+
+def _store_new_messages(messages: list) -> list[dict]:
+    """Вставка без перезаписи: сообщения, уже записанные (в том числе правкой из другого процесса), пропускаются."""
+    created_at = timezone.now()
+    inserted = insert_new_messages(messages, created_at=created_at)
+    save_message_payloads(
+        (pk, values["payload"]) for pk, values in inserted if values.get("payload") is not None
+    )
+    # Сводки и живые обновления — только по реально вставленным строкам
+    record_new_messages({**values, "created_at": created_at} for _, values in inserted)
+    return [values for _, values in inserted]
+
+
+def _publish_new(messages: list) -> None:
+    for values in messages:
+        publish_message_update(
+            chat_id=values["chat_id"],
+            message_id=values["message_id"],
+            business_connection_id=values.get("business_connection_id"),
+            created=True,
+        )
+
+
+def _write_batch(messages: list, outgoing: list) -> None:
+    try:
+        with transaction.atomic():
+            inserted = _store_new_messages(messages) if messages else []
+            if outgoing:
+                BotOutgoingMessage.objects.bulk_create([BotOutgoingMessage(**values) for values in outgoing])
+        _publish_new(inserted)
+        return
+    except Exception:
+        logger.exception("Write-behind batch failed (%s messages, %s outgoing), writing rows one by one",
+                         len(messages), len(outgoing))
+
+    # Одна плохая строка не должна утянуть за собой всю пачку
+    for values in messages:
+        try:
+            with transaction.atomic():
+                inserted = _store_new_messages([values])
+            _publish_new(inserted)
+        except Exception:
+            logger.exception("Write-behind message chat_id=%s message_id=%s lost",
+                             values.get("chat_id"), values.get("message_id"))
+    for values in outgoing:
+        try:
+            BotOutgoingMessage.objects.create(**values)
+        except Exception:
+            logger.exception("Write-behind outgoing log chat_id=%s lost", values.get("chat_id"))
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи Message и BotOutgoingMessage. Фоновый поток пишет накопленное одной
+    транзакцией (INSERT … ON CONFLICT DO NOTHING): сотни мелких коммитов превращаются в несколько.
+    Повторы одного (chat_id, message_id) внутри пачки схлопываются до последней версии; строку,
+    которая уже есть в БД, пачка не перезаписывает.
+    """
+
+    def __init__(
+        self,
+        *,
+        flush_interval: float = WRITE_BEHIND_FLUSH_MS / 1000,
+        max_rows: int = WRITE_BEHIND_MAX_ROWS,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+    ):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Запись пачек по очереди: пачка из потока не обгонит flush() из обработчика
+        self._flush_lock = threading.Lock()
+        self._messages: dict[tuple, dict] = {}
+        self._outgoing: list[dict] = []
+        self._thread = None
+        self._closed = False
+
+    def _pending(self) -> int:
+        return len(self._messages) + len(self._outgoing)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="webhook-tg-write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _submit(self, add) -> bool:
+        """Кладёт строку в очередь. False — очередь закрыта или переполнена, писать нужно синхронно."""
+        with self._lock:
+            if self._closed or self._pending() >= self.max_pending:
+                return False
+            add()
+            self._ensure_thread()
+            pending = self._pending()
+            if pending == 1 or pending >= self.max_rows:
+                self._wakeup.notify()
+            return True
+
+    def submit_message(self, values: dict) -> None:
+        key = (values["chat_id"], values["message_id"])
+
+        def add():
+            self._messages.pop(key, None)
+            self._messages[key] = values
+
+        if not self._submit(add):
+            # Сначала всё накопленное, иначе старая версия из очереди перезапишет эту
+            self.flush()
+            upsert_message(**values)
+
+    def submit_outgoing(self, values: dict) -> None:
+        if not self._submit(lambda: self._outgoing.append(values)):
+            BotOutgoingMessage.objects.create(**values)
+
+    def flush(self) -> int:
+        """Синхронно пишет всё накопленное. Возвращает число записанных строк."""
+        with self._flush_lock:
+            with self._lock:
+                messages = list(self._messages.values())
+                outgoing = self._outgoing
+                self._messages = {}
+                self._outgoing = []
+            if messages or outgoing:
+                _write_batch(messages, outgoing)
+            return len(messages) + len(outgoing)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._lock:
+                    while not self._closed and not self._pending():
+                        self._wakeup.wait()
+                    # Первая строка пачки пришла — добираем остальные до интервала или max_rows
+                    if not self._closed and self._pending() < self.max_rows:
+                        self._wakeup.wait(self.flush_interval)
+                    closed = self._closed
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Write-behind flush failed")
+                if closed:
+                    return
+        finally:
+            connections.close_all()
+
+    def close(self) -> None:
+        """Останавливает поток и дописывает очередь. Дальнейшие записи идут синхронно."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        self.flush()
+
+
+message_writer = WriteBehindQueue()
+
+
+def save_message(values: dict) -> None:
+    """
+    Upsert сообщения: при WRITE_BEHIND_ENABLED — в очередь после коммита текущей транзакции
+    (откаченный апдейт ничего не запишет), иначе сразу.
+    """
+    if WRITE_BEHIND_ENABLED:
+        transaction.on_commit(partial(message_writer.submit_message, values), robust=True)
+        remember_message(values, created_at=timezone.now())
+    else:
+        upsert_message(**values)
+
+
+def save_outgoing(values: dict) -> None:
+    if WRITE_BEHIND_ENABLED:
+        message_writer.submit_outgoing(values)
+    else:
+        BotOutgoingMessage.objects.create(**values)
+
+
+def flush_pending_writes() -> int:
+    """Перед чтением сообщений (правка, удаление) дописывает очередь. Вызывать вне транзакции."""
+    if not WRITE_BEHIND_ENABLED:
+        return 0
+    return message_writer.flush()